@@ -2,7 +2,7 @@
 API v1
 """
 from fastapi import APIRouter
-from app.api.v1.endpoints import webhooks, sync
+from app.api.v1.endpoints import webhooks, sync, admin
 
 api_router = APIRouter()
 
@@ -19,3 +19,8 @@ api_router.include_router(
     tags=["Sincronización"]
 )
 
+api_router.include_router(
+    admin.router,
+    prefix="/admin",
+    tags=["Administración"]
+)
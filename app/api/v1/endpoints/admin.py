@@ -0,0 +1,308 @@
+"""
+Endpoints de administración (estadísticas internas y diagnóstico)
+"""
+import asyncio
+import cProfile
+import io
+import pstats
+from typing import Any, Literal, Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from fastapi.responses import PlainTextResponse
+from app.core.adaptive_limiter import limiter_stats
+from app.core.config import settings
+from app.core.idempotency import get_cache_stats
+from app.core.logger import logger
+from app.core.memory import memory_registry, trace_allocations
+from app.core.payload_archive import payload_archive
+from app.core.singleflight import upstream_reads
+from app.services.contact_matching import contact_match_index, NOWCERTS
+from app.services.opportunity_index import opportunity_index
+from app.services.sync_journal import sync_journal, contact_match_key
+
+
+async def require_admin_key(x_admin_key: Optional[str] = Header(None)):
+    """
+    Valida el header X-Admin-Key contra settings.ADMIN_API_KEY
+    
+    Los endpoints de administración quedan deshabilitados si no hay clave configurada.
+    """
+    if not settings.ADMIN_API_KEY:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Endpoints de administración deshabilitados (configure ADMIN_API_KEY)"
+        )
+    if x_admin_key != settings.ADMIN_API_KEY:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Clave de administración inválida"
+        )
+
+
+router = APIRouter(dependencies=[Depends(require_admin_key)])
+
+
+@router.get(
+    "/idempotency",
+    summary="Estadísticas del cache de idempotencia",
+    description="Entradas, buckets, memoria aproximada, expiraciones y desalojos"
+)
+async def idempotency_stats() -> Any:
+    """
+    Estadísticas del cache de eventos procesados
+    
+    Returns:
+        Ocupación, memoria aproximada y contadores de expiración/desalojo
+    """
+    return get_cache_stats()
+
+
+@router.get(
+    "/upstream",
+    summary="Estadísticas de llamadas a APIs externas",
+    description=(
+        "Límite de concurrencia adaptativo y RTT por servicio, y lecturas "
+        "coalescidas (single-flight) hacia NowCerts y GHL"
+    )
+)
+async def upstream_stats() -> Any:
+    """
+    Estadísticas de las llamadas a APIs externas
+    
+    Returns:
+        Límite actual, RTT medido y contadores de cada servicio, y llamadas
+        reales y compartidas del single-flight de lecturas
+    """
+    return {
+        "limits": limiter_stats(),
+        "singleflight": upstream_reads.stats()
+    }
+
+
+@router.get(
+    "/archive",
+    summary="Estado del archivo de payloads",
+    description="Segmento actual, payloads archivados y descartados y ratio de compresión"
+)
+async def archive_stats() -> Any:
+    """
+    Estado del archivo comprimido de payloads
+    
+    Returns:
+        Segmento actual, contadores y ratio de compresión
+    """
+    return payload_archive.stats()
+
+
+@router.get(
+    "/sync-journal",
+    summary="Historial de sincronización de una entidad",
+    description=(
+        "Escrituras de la integración y ecos descartados de una entidad. "
+        "La entidad se indica con entity_key (p. ej. email:ana@example.com) "
+        "o, para contactos, con email o phone"
+    )
+)
+async def sync_journal_history(
+    entity_type: str = Query("contact", description="Tipo de entidad"),
+    entity_key: Optional[str] = Query(None, description="Clave de la entidad"),
+    email: Optional[str] = Query(None, description="Email del contacto"),
+    phone: Optional[str] = Query(None, description="Teléfono del contacto"),
+    limit: int = Query(50, ge=1, le=1000, description="Máximo de entradas")
+) -> Any:
+    """
+    Historial de sincronización de una entidad
+    
+    Returns:
+        Estadísticas del diario y entradas de la entidad, de más reciente a más antigua
+    """
+    if entity_key is None and (email or phone):
+        entity_key = contact_match_key({"email": email, "phone": phone})
+    if entity_key is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Indique entity_key, email o phone"
+        )
+    return {
+        "journal": sync_journal.stats(),
+        "entity_type": entity_type,
+        "entity_key": entity_key,
+        "entries": sync_journal.history(entity_type, entity_key, limit)
+    }
+
+
+@router.get(
+    "/opportunity-index",
+    summary="Índice de pólizas y cotizaciones → oportunidades",
+    description=(
+        "Entradas y aciertos del índice; con number (y kind) devuelve la "
+        "oportunidad de GHL de esa póliza o cotización"
+    )
+)
+async def opportunity_index_lookup(
+    kind: Literal["policy", "quote"] = Query("policy", description="Tipo"),
+    number: Optional[str] = Query(None, description="Número de póliza o ID de NowCerts")
+) -> Any:
+    """
+    Estado del índice de oportunidades y, opcionalmente, una entrada
+    
+    Returns:
+        Estadísticas del índice y la entrada pedida (None si no existe)
+    """
+    result = {"index": opportunity_index.stats()}
+    if number is not None:
+        result["entry"] = opportunity_index.get(kind, number)
+    return result
+
+
+@router.get(
+    "/contact-match",
+    summary="Candidatos del índice de emparejamiento de contactos",
+    description=(
+        "Contactos indexados por sistema; con email, phone o nombre devuelve los "
+        "candidatos puntuados del sistema indicado y la contraparte elegida"
+    )
+)
+async def contact_match_lookup(
+    system: Literal["nowcerts", "ghl"] = Query(NOWCERTS, description="Sistema donde buscar"),
+    email: Optional[str] = Query(None, description="Email"),
+    phone: Optional[str] = Query(None, description="Teléfono en cualquier formato"),
+    first_name: Optional[str] = Query(None, alias="firstName", description="Nombre"),
+    last_name: Optional[str] = Query(None, alias="lastName", description="Apellido"),
+    postal_code: Optional[str] = Query(None, alias="postalCode", description="Código postal")
+) -> Any:
+    """
+    Estado del índice de emparejamiento y, opcionalmente, una búsqueda
+    
+    Returns:
+        Estadísticas del índice, candidatos puntuados y la contraparte elegida
+    """
+    result = {"index": contact_match_index.stats()}
+    contact = {
+        "email": email, "phone": phone, "firstName": first_name,
+        "lastName": last_name, "postalCode": postal_code
+    }
+    if any(contact.values()):
+        result["candidates"] = contact_match_index.candidates(contact, system)
+        match = contact_match_index.find_match(contact, system)
+        result["match"] = match["record_id"] if match else None
+    return result
+
+
+@router.get(
+    "/memory",
+    summary="Uso de memoria por cache y cola",
+    description=(
+        "RSS del proceso y, por cada cache o cola en memoria, entradas, bytes "
+        "aproximados y crecimiento por minuto en la ventana de muestreo"
+    )
+)
+async def memory_usage() -> Any:
+    """
+    Contabilidad de memoria de los componentes registrados
+    
+    Returns:
+        Memoria del proceso y componentes de mayor a menor tamaño, con su crecimiento
+    """
+    return memory_registry.report()
+
+
+# Solo una captura de tracemalloc a la vez
+_tracing_allocations = False
+
+
+@router.post(
+    "/memory/allocations",
+    summary="Captura de asignaciones (tracemalloc)",
+    description=(
+        "Compara dos capturas de tracemalloc separadas N segundos y devuelve "
+        "los puntos del código cuya memoria asignada más creció"
+    )
+)
+async def memory_allocations(
+    seconds: float = Query(30.0, gt=0, le=settings.MEMORY_TRACE_MAX_SECONDS),
+    group_by: Literal["lineno", "filename", "traceback"] = Query("lineno"),
+    limit: int = Query(25, ge=1, le=500),
+    frames: int = Query(settings.MEMORY_TRACE_FRAMES, ge=1, le=100)
+) -> Any:
+    """
+    Diferencia de asignaciones durante `seconds` segundos de tráfico real
+    
+    Args:
+        seconds: Tiempo entre las dos capturas
+        group_by: Agrupar por línea, archivo o traza completa
+        limit: Número de puntos de asignación a mostrar
+        frames: Marcos por asignación (si tracemalloc no estaba activo)
+    
+    Returns:
+        Memoria trazada y puntos de asignación ordenados por crecimiento
+    """
+    global _tracing_allocations
+    if _tracing_allocations:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Ya hay una captura de asignaciones en curso"
+        )
+    
+    _tracing_allocations = True
+    logger.info(f"Iniciando captura de asignaciones de {seconds:.1f}s")
+    try:
+        return await trace_allocations(seconds, limit, group_by, frames)
+    finally:
+        _tracing_allocations = False
+
+
+# Solo una captura de perfil a la vez (cProfile es global al hilo del event loop)
+_profiling = False
+
+
+@router.post(
+    "/profile",
+    response_class=PlainTextResponse,
+    summary="Captura de perfil (cProfile)",
+    description=(
+        "Perfila el proceso durante N segundos mientras atiende tráfico real "
+        "y devuelve las funciones más costosas"
+    )
+)
+async def profile(
+    seconds: float = Query(10.0, gt=0, le=settings.PROFILER_MAX_SECONDS),
+    sort: Literal["cumulative", "tottime", "calls"] = Query("cumulative"),
+    limit: int = Query(50, ge=1, le=500)
+) -> Any:
+    """
+    Perfila el event loop durante `seconds` segundos
+    
+    Todo lo que ejecute el event loop en ese periodo (webhooks, sondeo,
+    tareas en segundo plano) queda incluido en la captura.
+    
+    Args:
+        seconds: Duración de la captura
+        sort: Criterio de ordenación de pstats
+        limit: Número de funciones a mostrar
+    
+    Returns:
+        Salida de pstats en texto plano
+    """
+    global _profiling
+    if _profiling:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Ya hay una captura de perfil en curso"
+        )
+    
+    _profiling = True
+    profiler = cProfile.Profile()
+    logger.info(f"Iniciando captura de perfil de {seconds:.1f}s")
+    try:
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+    finally:
+        _profiling = False
+    
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.sort_stats(sort).print_stats(limit)
+    return stream.getvalue()
@@ -1,13 +1,24 @@
 """
 Endpoint para sincronización manual
 """
-from fastapi import APIRouter, HTTPException
-from typing import Any
-from app.models.webhooks import SyncRequest, SyncResponse
+from fastapi import APIRouter, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
+from typing import Any, AsyncIterator, Literal, Optional
+from app.models.webhooks import SyncRequest, SyncResponse, SyncJobRequest, GHLOpportunity, PolicyData
 from app.services.nowcerts_service import NowCertsService
 from app.services.ghl_service import GHLService
 from app.services.mapper import DataMapper
+from app.services.contact_matching import contact_match_index, upsert_nowcerts_contact, NOWCERTS, GHL
+from app.services.entity_sync import entity_sync
+from app.services.opportunity_writer import opportunity_writer
+from app.services.sync_jobs import sync_jobs, SyncJob
+from app.services.sync_journal import sync_journal, contact_match_key, contact_fingerprint
+from app.core.config import settings
+from app.core.json_codec import dumps
 from app.core.logger import logger
+from app.core.priority import MANUAL, lane
+from app.core.timing import phase, mark_validated
+from app.core.tracing import start_trace
 
 router = APIRouter()
 nowcerts_service = NowCertsService()
@@ -30,102 +41,298 @@ async def sync_manual(request: SyncRequest) -> Any:
     - Pólizas/Cotizaciones de NowCerts a oportunidades en GHL
     - Oportunidades de GHL a cotizaciones en NowCerts
     
+    Con entity_id y sin data, la entidad se descarga del origen junto con sus
+    registros relacionados (pólizas y cotizaciones de un asegurado,
+    oportunidades de un contacto de GHL) y se sincroniza todo a la vez.
+    
     Args:
         request: Solicitud de sincronización con source, entity_type, direction y datos
     
     Returns:
         Resultado de la sincronización
     """
-    try:
-        logger.info(
-            f"Sincronización manual: {request.source} -> {request.direction} "
-            f"({request.entity_type})"
-        )
-        
-        source_id = None
-        target_id = None
-        result_data = None
+    mark_validated()
+    with lane(MANUAL), start_trace(
+        "sync.manual",
+        source=request.source,
+        entity_type=request.entity_type,
+        direction=request.direction
+    ):
+        try:
+            logger.info(
+                f"Sincronización manual: {request.source} -> {request.direction} "
+                f"({request.entity_type})"
+            )
+            
+            source_id = None
+            target_id = None
+            result_data = None
+            
+            if request.entity_id and not request.data:
+                return await _sync_by_id(request)
+            
+            if request.direction == "to_ghl":
+                # Sincronizar hacia GHL
+                if request.source == "nowcerts":
+                    if request.entity_type == "contact":
+                        # Contacto de NowCerts a GHL
+                        if request.data:
+                            with phase("map"):
+                                ghl_data = mapper.nowcerts_to_ghl_contact(request.data)
+                            async with sync_journal.writing(
+                                "contact", contact_match_key(ghl_data), "nowcerts", "ghl",
+                                contact_fingerprint(ghl_data), source_id=request.entity_id
+                            ) as write:
+                                result = await ghl_service.upsert_contact(ghl_data)
+                                target_id = (result.get("contact") or result).get("id")
+                                write.target_id = target_id
+                            contact_match_index.upsert(NOWCERTS, request.entity_id, ghl_data)
+                            contact_match_index.upsert(GHL, target_id, ghl_data)
+                            result_data = result
+                        else:
+                            raise HTTPException(
+                                status_code=400,
+                                detail="Se requieren datos para crear contacto"
+                            )
+                    
+                    elif request.entity_type in ["policy", "quote"]:
+                        # Póliza/Cotización de NowCerts a oportunidad en GHL
+                        if request.data:
+                            # contactId opcional en los datos; si no, el del asegurado
+                            result_data = await opportunity_writer.upsert(
+                                request.entity_type,
+                                PolicyData.model_validate(request.data),
+                                contact_id=request.data.get("contactId")
+                            )
+                            target_id = result_data.get("opportunity_id")
+                        else:
+                            raise HTTPException(
+                                status_code=400,
+                                detail="Se requieren datos para crear oportunidad"
+                            )
+            
+            elif request.direction == "to_nowcerts":
+                # Sincronizar hacia NowCerts
+                if request.source == "ghl":
+                    if request.entity_type == "contact":
+                        # Contacto de GHL a NowCerts
+                        if request.data:
+                            with phase("map"):
+                                nowcerts_data = mapper.ghl_to_nowcerts_contact(request.data)
+                            async with sync_journal.writing(
+                                "contact", contact_match_key(request.data), "ghl", "nowcerts",
+                                contact_fingerprint(request.data), source_id=request.entity_id
+                            ) as write:
+                                contact_match_index.upsert(GHL, request.entity_id, request.data)
+                                result = await upsert_nowcerts_contact(
+                                    nowcerts_service, request.data, nowcerts_data
+                                )
+                                target_id = result.get("id")
+                                write.target_id = target_id
+                            result_data = result
+                        else:
+                            raise HTTPException(
+                                status_code=400,
+                                detail="Se requieren datos para crear contacto"
+                            )
+                    
+                    elif request.entity_type == "opportunity":
+                        # Oportunidad de GHL a cotización en NowCerts
+                        if request.data:
+                            quote_data = mapper.ghl_opportunity_to_nowcerts_quote(
+                                GHLOpportunity.model_validate(request.data)
+                            )
+                            result = await nowcerts_service.create_quote(quote_data)
+                            target_id = result.get("id")
+                            result_data = result
+                        else:
+                            raise HTTPException(
+                                status_code=400,
+                                detail="Se requieren datos para crear cotización"
+                            )
+            
+            return SyncResponse(
+                success=True,
+                message=f"Sincronización {request.entity_type} completada exitosamente",
+                source_id=request.entity_id,
+                target_id=target_id,
+                data=result_data
+            )
         
-        if request.direction == "to_ghl":
-            # Sincronizar hacia GHL
-            if request.source == "nowcerts":
-                if request.entity_type == "contact":
-                    # Contacto de NowCerts a GHL
-                    if request.data:
-                        ghl_data = mapper.nowcerts_to_ghl_contact(request.data)
-                        result = await ghl_service.create_contact(ghl_data)
-                        target_id = result.get("id")
-                        result_data = result
-                    else:
-                        raise HTTPException(
-                            status_code=400,
-                            detail="Se requieren datos para crear contacto"
-                        )
-                
-                elif request.entity_type in ["policy", "quote"]:
-                    # Póliza/Cotización de NowCerts a oportunidad en GHL
-                    if request.data:
-                        # Necesitamos contact_id, por ahora lo omitimos
-                        opportunity_data = mapper.nowcerts_to_ghl_opportunity(request.data)
-                        # Nota: crear oportunidad requiere contact_id
-                        result_data = {
-                            "message": "Crear oportunidad requiere contact_id en GHL",
-                            "opportunity_data": opportunity_data
-                        }
-                    else:
-                        raise HTTPException(
-                            status_code=400,
-                            detail="Se requieren datos para crear oportunidad"
-                        )
-        
-        elif request.direction == "to_nowcerts":
-            # Sincronizar hacia NowCerts
-            if request.source == "ghl":
-                if request.entity_type == "contact":
-                    # Contacto de GHL a NowCerts
-                    if request.data:
-                        nowcerts_data = mapper.ghl_to_nowcerts_contact(request.data)
-                        result = await nowcerts_service.create_contact(nowcerts_data)
-                        target_id = result.get("id")
-                        result_data = result
-                    else:
-                        raise HTTPException(
-                            status_code=400,
-                            detail="Se requieren datos para crear contacto"
-                        )
-                
-                elif request.entity_type == "opportunity":
-                    # Oportunidad de GHL a cotización en NowCerts
-                    if request.data:
-                        quote_data = {
-                            "policyType": request.data.get("customFields", {}).get("policy_type", "General"),
-                            "premium": request.data.get("monetaryValue", 0),
-                            "carrier": request.data.get("customFields", {}).get("carrier", ""),
-                            "source": "GHL"
-                        }
-                        result = await nowcerts_service.create_quote(quote_data)
-                        target_id = result.get("id")
-                        result_data = result
-                    else:
-                        raise HTTPException(
-                            status_code=400,
-                            detail="Se requieren datos para crear cotización"
-                        )
-        
-        return SyncResponse(
-            success=True,
-            message=f"Sincronización {request.entity_type} completada exitosamente",
-            source_id=request.entity_id,
-            target_id=target_id,
-            data=result_data
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Error en sincronización manual: {str(e)}", exc_info=True)
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error en sincronización: {str(e)}"
+            )
+
+
+
+# Combinaciones admitidas en la sincronización por ID: (origen, dirección) -> tipos
+_SYNC_BY_ID = {
+    ("nowcerts", "to_ghl"): ("contact", "policy", "quote"),
+    ("ghl", "to_nowcerts"): ("contact", "opportunity")
+}
+
+
+async def _sync_by_id(request: SyncRequest) -> SyncResponse:
+    """Sincronización por ID: descarga la entidad (y sus relacionados) del origen"""
+    supported = _SYNC_BY_ID.get((request.source, request.direction), ())
+    if request.entity_type not in supported:
+        raise HTTPException(
+            status_code=400,
+            detail=(
+                f"Sincronización por ID no disponible para {request.entity_type} "
+                f"({request.source} {request.direction})"
+            )
         )
     
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Error en sincronización manual: {str(e)}", exc_info=True)
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error en sincronización: {str(e)}"
+    if request.source == "nowcerts":
+        report = await entity_sync.sync_nowcerts(
+            request.entity_type, request.entity_id, request.include_related
+        )
+    else:
+        report = await entity_sync.sync_ghl(
+            request.entity_type, request.entity_id, request.include_related
         )
+    
+    errors = report["summary"].get("error", 0)
+    total = len(report["records"])
+    return SyncResponse(
+        success=not errors,
+        message=(
+            f"Sincronización {request.entity_type} {request.entity_id} completada: "
+            f"{total - errors}/{total} registros relacionados sin errores"
+        ),
+        source_id=request.entity_id,
+        target_id=report["root"].get("target_id"),
+        data=report
+    )
+
+
+# Direcciones de la sincronización por ID según el origen
+_JOB_DIRECTIONS = {"nowcerts": "to_ghl", "ghl": "to_nowcerts"}
+
 
+def _validate_job(request: SyncJobRequest):
+    """Comprueba los parámetros que necesita cada tipo de trabajo"""
+    if request.kind in ("entity", "import") and request.source is None:
+        raise HTTPException(status_code=400, detail=f"Los trabajos {request.kind} requieren source")
+    if request.kind == "entity":
+        supported = _SYNC_BY_ID[(request.source, _JOB_DIRECTIONS[request.source])]
+        if not request.entity_id or request.entity_type not in supported:
+            raise HTTPException(
+                status_code=400,
+                detail=(
+                    f"Los trabajos entity desde {request.source} requieren entity_id y "
+                    f"entity_type ({', '.join(supported)})"
+                )
+            )
+    elif request.kind == "import" and not request.contacts:
+        raise HTTPException(status_code=400, detail="Los trabajos import requieren contacts")
+
+
+def _get_job(job_id: str) -> SyncJob:
+    job = sync_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Trabajo {job_id} no encontrado")
+    return job
+
+
+@router.post(
+    "/jobs",
+    status_code=status.HTTP_202_ACCEPTED,
+    summary="Crear trabajo de sincronización",
+    description=(
+        "Encola una sincronización larga (entidad con sus relacionados, importación masiva, "
+        "reconciliación o recarga del índice de contactos) y devuelve su ID sin esperar"
+    )
+)
+async def create_sync_job(request: SyncJobRequest) -> Any:
+    """
+    Encola un trabajo de sincronización en segundo plano
+    
+    Args:
+        request: Tipo de trabajo y parámetros
+    
+    Returns:
+        Estado inicial del trabajo (id, status queued)
+    """
+    mark_validated()
+    _validate_job(request)
+    return sync_jobs.submit(request).snapshot(include_result=False)
+
+
+@router.get(
+    "/jobs",
+    summary="Listar trabajos de sincronización",
+    description="Trabajos en cola, en curso y terminados dentro del periodo de retención"
+)
+async def list_sync_jobs(
+    job_status: Optional[Literal["queued", "running", "succeeded", "failed", "cancelled", "timed_out"]] = Query(
+        None, alias="status", description="Filtrar por estado"
+    )
+) -> Any:
+    """Trabajos conservados (sin su resultado) y totales por estado"""
+    return {
+        "jobs": [job.snapshot(include_result=False) for job in sync_jobs.list_jobs(job_status)],
+        "stats": sync_jobs.stats()
+    }
+
+
+@router.get(
+    "/jobs/{job_id}",
+    summary="Estado de un trabajo de sincronización",
+    description="Estado, avance y, si terminó, resultado del trabajo"
+)
+async def get_sync_job(job_id: str) -> Any:
+    """Estado completo de un trabajo"""
+    return _get_job(job_id).snapshot()
+
+
+@router.delete(
+    "/jobs/{job_id}",
+    summary="Cancelar un trabajo de sincronización",
+    description="Cancela un trabajo en cola o en curso; los terminados no cambian"
+)
+async def cancel_sync_job(job_id: str) -> Any:
+    """Cancela un trabajo y devuelve su estado"""
+    job = _get_job(job_id)
+    sync_jobs.cancel(job_id)
+    return job.snapshot(include_result=False)
+
+
+async def _job_events(job: SyncJob) -> AsyncIterator[str]:
+    """Un evento progress por cambio (los cambios seguidos se agrupan) y end al terminar"""
+    version = -1
+    while True:
+        if job.version != version:
+            version = job.version
+            event = "end" if job.finished else "progress"
+            data = dumps(job.snapshot(include_result=job.finished)).decode()
+            yield f"event: {event}\nid: {version}\ndata: {data}\n\n"
+            if job.finished:
+                return
+        elif not await job.wait_for_change(version, settings.SYNC_JOB_SSE_HEARTBEAT_SECONDS):
+            # Mantiene viva la conexión a través de proxies
+            yield ": heartbeat\n\n"
+
+
+@router.get(
+    "/jobs/{job_id}/events",
+    summary="Avance de un trabajo (Server-Sent Events)",
+    description=(
+        "Stream text/event-stream con un evento progress por cambio de avance o estado "
+        "y un evento end con el resultado al terminar"
+    )
+)
+async def stream_sync_job(job_id: str) -> StreamingResponse:
+    """Sigue el avance de un trabajo por SSE"""
+    job = _get_job(job_id)
+    return StreamingResponse(
+        _job_events(job),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -2,35 +2,110 @@
 Endpoints para webhooks de NowCerts y GHL
 """
 from fastapi import APIRouter, HTTPException, Request
-from typing import Any, Dict
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, TypeAdapter, ValidationError
+from typing import Any, Callable, Dict, Optional, Set, Tuple, TypeVar
 from app.models.webhooks import (
-    NowCertsWebhookPayload,
-    GHLWebhookPayload,
-    WebhookResponse
+    WebhookResponse,
+    nowcerts_event_adapter,
+    ghl_event_adapter,
+    parse_nowcerts_event,
+    parse_ghl_event
 )
-from app.services.nowcerts_service import NowCertsService
-from app.services.ghl_service import GHLService
-from app.services.mapper import DataMapper
-from app.core.idempotency import generate_event_id, is_duplicate, mark_event_processed
-from app.core.logger import logger, log_payload, log_response
-from app.core.exceptions import DuplicateEventError
+from app.services.event_processor import (
+    process_nowcerts_event,
+    process_ghl_event,
+    nowcerts_payload_paths
+)
+from app.core.logger import logger
+from app.core.exceptions import DuplicateEventError, EventNotReadyError
+from app.core.json_codec import loads
+from app.core.request_body import is_large_body, parse_json_fields
+from app.core.tracing import start_trace
 
 router = APIRouter()
-nowcerts_service = NowCertsService()
-ghl_service = GHLService()
-mapper = DataMapper()
+
+PayloadModel = TypeVar("PayloadModel", bound=BaseModel)
+
+
+def _inline_refs(schema: Any, definitions: Dict[str, Any]) -> Any:
+    if isinstance(schema, dict):
+        ref = schema.get("$ref")
+        if isinstance(ref, str) and ref.startswith("#/$defs/"):
+            return _inline_refs(definitions[ref[len("#/$defs/"):]], definitions)
+        return {key: _inline_refs(value, definitions) for key, value in schema.items()}
+    if isinstance(schema, list):
+        return [_inline_refs(item, definitions) for item in schema]
+    return schema
+
+
+def _json_body(adapter: TypeAdapter) -> dict:
+    """
+    Documentación OpenAPI del body para endpoints que leen el Request directamente
+    
+    Las referencias a $defs del esquema se sustituyen por su contenido: en
+    openapi_extra no se resolverían respecto al documento OpenAPI.
+    """
+    schema = adapter.json_schema()
+    definitions = schema.pop("$defs", {})
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": _inline_refs(schema, definitions)}}
+        }
+    }
+
+
+async def _read_payload(
+    request: Request,
+    parse: Callable[[Any], PayloadModel],
+    large_body_paths: Optional[Set[str]] = None
+) -> Tuple[PayloadModel, Optional[bytes]]:
+    """
+    Lee y valida el body de un webhook
+    
+    El body se decodifica con app.core.json_codec (orjson si está instalado;
+    más rápido que json.loads y que model_validate_json con campos
+    Dict[str, Any]) y después se valida con `parse`, que elige el modelo
+    tipado del evento (parse_nowcerts_event, parse_ghl_event). Si se indican
+    `large_body_paths`, los bodies grandes (STREAMING_PARSE_THRESHOLD_BYTES)
+    se parsean de forma incremental conservando solo esos campos, de modo
+    que el volcado, el log y el hash no recorren el payload completo.
+    
+    Returns:
+        (payload validado, body crudo; None si se parseó de forma incremental)
+    """
+    try:
+        if large_body_paths is not None and is_large_body(request):
+            data = await parse_json_fields(request, large_body_paths)
+            payload = parse(data)
+            logger.debug(f"Payload grande proyectado a los campos usados ({type(payload).__name__})")
+            return payload, None
+        body = await request.body()
+        return parse(loads(body)), body
+    
+    except ValidationError as e:
+        raise RequestValidationError(
+            [{**error, "loc": ("body", *error["loc"])} for error in e.errors()]
+        )
+    except ValueError as e:
+        raise RequestValidationError([{
+            "type": "json_invalid",
+            "loc": ("body",),
+            "msg": "JSON decode error",
+            "input": {},
+            "ctx": {"error": str(e)}
+        }])
 
 
 @router.post(
     "/nowcerts",
     response_model=WebhookResponse,
     summary="Webhook de NowCerts",
-    description="Recibe eventos desde NowCerts y los sincroniza con GHL"
+    description="Recibe eventos desde NowCerts y los sincroniza con GHL",
+    openapi_extra=_json_body(nowcerts_event_adapter)
 )
-async def webhook_nowcerts(
-    payload: NowCertsWebhookPayload,
-    request: Request
-) -> Any:
+async def webhook_nowcerts(request: Request) -> Any:
     """
     Endpoint para recibir webhooks de NowCerts
     
@@ -42,94 +117,30 @@ async def webhook_nowcerts(
     Returns:
         Respuesta con el resultado del procesamiento
     """
-    try:
-        # Log del payload recibido
-        payload_dict = payload.model_dump()
-        log_payload("NOWCERTS_WEBHOOK", payload_dict, "incoming")
-        
-        # Generar ID del evento para control de duplicados
-        event_id = generate_event_id(payload_dict, "nowcerts")
-        
-        # Verificar duplicados
-        if is_duplicate(event_id):
-            logger.warning(f"Evento duplicado detectado: {event_id}")
-            raise DuplicateEventError(f"Evento ya procesado: {event_id}")
-        
-        # Procesar según el tipo de evento
-        event_type = payload.event_type.upper()
-        result_data = None
-        
-        if event_type in ["INSURED_INSERT", "INSURED_UPDATE"]:
-            # Sincronizar contacto con GHL
-            contact_data = payload.data
-            ghl_contact_data = mapper.nowcerts_to_ghl_contact(contact_data)
-            
-            if event_type == "INSURED_INSERT":
-                result = await ghl_service.create_contact(ghl_contact_data)
-            else:
-                # Para UPDATE, necesitaríamos el ID del contacto en GHL
-                # Por ahora, intentamos crear si no existe
-                result = await ghl_service.create_contact(ghl_contact_data)
-            
-            result_data = result
-            logger.info(f"Contacto sincronizado con GHL: {result.get('id', 'N/A')}")
-        
-        elif event_type in ["POLICY_INSERT", "POLICY_UPDATE", "QUOTE_INSERT", "QUOTE_UPDATE"]:
-            # Crear/actualizar oportunidad en GHL
-            policy_data = payload.data
-            
-            # Necesitamos el contact_id en GHL
-            # Por ahora, creamos la oportunidad sin contacto asociado
-            # En producción, deberías buscar el contacto por email/phone
-            opportunity_data = mapper.nowcerts_to_ghl_opportunity(policy_data)
-            
-            if event_type in ["POLICY_INSERT", "QUOTE_INSERT"]:
-                # Para crear oportunidad, necesitamos contact_id
-                # Esto debería mejorarse buscando el contacto primero
-                logger.warning("Crear oportunidad requiere contact_id - implementar búsqueda de contacto")
-                result_data = {"message": "Oportunidad requiere contact_id para ser creada"}
-            else:
-                # UPDATE requiere opportunity_id
-                logger.warning("Actualizar oportunidad requiere opportunity_id")
-                result_data = {"message": "Actualizar oportunidad requiere opportunity_id"}
-        
-        else:
-            logger.warning(f"Tipo de evento no soportado: {event_type}")
-            result_data = {"message": f"Evento {event_type} no procesado"}
-        
-        # Marcar evento como procesado
-        mark_event_processed(event_id)
-        
-        # Log de respuesta
-        log_response("NOWCERTS_WEBHOOK", result_data or {}, "outgoing")
-        
-        return WebhookResponse(
-            success=True,
-            message=f"Evento {event_type} procesado exitosamente",
-            event_id=event_id,
-            data=result_data
-        )
+    payload, body = await _read_payload(request, parse_nowcerts_event, nowcerts_payload_paths())
     
-    except DuplicateEventError:
-        raise
-    except Exception as e:
-        logger.error(f"Error procesando webhook de NowCerts: {str(e)}", exc_info=True)
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error procesando webhook: {str(e)}"
-        )
+    with start_trace("webhook.nowcerts", event_type=payload.event_type):
+        try:
+            return await process_nowcerts_event(payload, body)
+        
+        except (DuplicateEventError, EventNotReadyError):
+            raise
+        except Exception as e:
+            logger.error(f"Error procesando webhook de NowCerts: {str(e)}", exc_info=True)
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error procesando webhook: {str(e)}"
+            )
 
 
 @router.post(
     "/ghl",
     response_model=WebhookResponse,
     summary="Webhook de GoHighLevel",
-    description="Recibe eventos desde GHL y los sincroniza con NowCerts"
+    description="Recibe eventos desde GHL y los sincroniza con NowCerts",
+    openapi_extra=_json_body(ghl_event_adapter)
 )
-async def webhook_ghl(
-    payload: GHLWebhookPayload,
-    request: Request
-) -> Any:
+async def webhook_ghl(request: Request) -> Any:
     """
     Endpoint para recibir webhooks de GHL
     
@@ -140,71 +151,18 @@ async def webhook_ghl(
     Returns:
         Respuesta con el resultado del procesamiento
     """
-    try:
-        # Log del payload recibido
-        payload_dict = payload.model_dump()
-        log_payload("GHL_WEBHOOK", payload_dict, "incoming")
-        
-        # Generar ID del evento para control de duplicados
-        event_id = generate_event_id(payload_dict, "ghl")
-        
-        # Verificar duplicados
-        if is_duplicate(event_id):
-            logger.warning(f"Evento duplicado detectado: {event_id}")
-            raise DuplicateEventError(f"Evento ya procesado: {event_id}")
-        
-        result_data = None
-        
-        # Procesar según el tipo de evento
-        if payload.contact:
-            # Sincronizar contacto con NowCerts
-            contact_data = payload.contact
-            nowcerts_contact_data = mapper.ghl_to_nowcerts_contact(contact_data)
-            
-            # Intentar crear el contacto en NowCerts
-            result = await nowcerts_service.create_contact(nowcerts_contact_data)
-            result_data = result
-            logger.info(f"Contacto sincronizado con NowCerts: {result.get('id', 'N/A')}")
-        
-        elif payload.opportunity:
-            # Crear cotización en NowCerts basada en la oportunidad
-            opportunity_data = payload.opportunity
-            
-            # Mapear oportunidad a cotización (simplificado)
-            quote_data = {
-                "policyType": opportunity_data.get("customFields", {}).get("policy_type", "General"),
-                "premium": opportunity_data.get("monetaryValue", 0),
-                "carrier": opportunity_data.get("customFields", {}).get("carrier", ""),
-                "source": "GHL"
-            }
-            
-            result = await nowcerts_service.create_quote(quote_data)
-            result_data = result
-            logger.info(f"Cotización creada en NowCerts: {result.get('id', 'N/A')}")
-        
-        else:
-            logger.warning("Webhook de GHL sin datos de contacto u oportunidad")
-            result_data = {"message": "No se procesó ningún dato"}
-        
-        # Marcar evento como procesado
-        mark_event_processed(event_id)
-        
-        # Log de respuesta
-        log_response("GHL_WEBHOOK", result_data or {}, "outgoing")
-        
-        return WebhookResponse(
-            success=True,
-            message="Evento de GHL procesado exitosamente",
-            event_id=event_id,
-            data=result_data
-        )
+    payload, body = await _read_payload(request, parse_ghl_event)
     
-    except DuplicateEventError:
-        raise
-    except Exception as e:
-        logger.error(f"Error procesando webhook de GHL: {str(e)}", exc_info=True)
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error procesando webhook: {str(e)}"
-        )
+    with start_trace("webhook.ghl", event=payload.event):
+        try:
+            return await process_ghl_event(payload, body)
+        
+        except DuplicateEventError:
+            raise
+        except Exception as e:
+            logger.error(f"Error procesando webhook de GHL: {str(e)}", exc_info=True)
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error procesando webhook: {str(e)}"
+            )
 
@@ -0,0 +1,400 @@
+"""
+Límite de concurrencia adaptativo por servicio externo (AIMD guiado por latencia)
+"""
+import asyncio
+import re
+import time
+from typing import Optional, Dict, Any
+from urllib.parse import urlsplit
+from app.core.config import settings
+from app.core.logger import logger
+from app.core.memory import memory_registry, deep_sizeof
+from app.core.priority import LANES, BULK, LaneQueue, current_lane
+from app.core.timing import phase
+
+
+# Endpoints con latencia de referencia propia por servicio
+_MAX_ENDPOINTS = 256
+
+# Segmentos de ruta que son IDs: llevan algún dígito o son muy largos
+_ID_SEGMENT = re.compile(r"\d|^.{21,}$")
+
+
+def endpoint_key(method: str, url: str) -> str:
+    """
+    Clave de endpoint para la latencia de referencia: método y ruta con los IDs
+    sustituidos (GET /contacts/abc123 y GET /contacts/xyz789 comparten clave)
+    
+    Args:
+        method: Método HTTP
+        url: URL completa (la query no cuenta)
+    """
+    segments = [
+        "{id}" if _ID_SEGMENT.search(segment) else segment
+        for segment in urlsplit(url).path.split("/")
+    ]
+    return f"{method.upper()} {'/'.join(segments) or '/'}"
+
+
+class EndpointLatency:
+    """Latencia suavizada y mínima de un endpoint"""
+    
+    __slots__ = ("rtt_ewma", "min_rtt", "min_rtt_expires_at")
+    
+    def __init__(self):
+        self.rtt_ewma = 0.0
+        self.min_rtt = 0.0
+        self.min_rtt_expires_at = 0.0
+    
+    def observe(self, rtt: float, now: float, window: float):
+        if not self.rtt_ewma:
+            self.rtt_ewma = rtt
+        else:
+            self.rtt_ewma = 0.8 * self.rtt_ewma + 0.2 * rtt
+        if not self.min_rtt or rtt < self.min_rtt or now >= self.min_rtt_expires_at:
+            self.min_rtt = rtt
+            self.min_rtt_expires_at = now + window
+
+
+class AdaptiveLimiter:
+    """
+    Limita las llamadas simultáneas a un servicio externo y ajusta el límite solo
+    
+    - Aumento aditivo: mientras la latencia suavizada se mantiene cerca de la
+      mínima observada y el límite se está usando, sube ~1 por cada `limit`
+      respuestas (≈ +1 por RTT).
+    - Reducción multiplicativa: con 429, 5xx, errores de conexión/timeouts o
+      latencia por encima de ADAPTIVE_LIMIT_LATENCY_TOLERANCE veces la
+      mínima, multiplica el límite por ADAPTIVE_LIMIT_BACKOFF (como mucho una
+      vez por RTT, para que una ráfaga de errores no lo hunda de golpe).
+    
+    La latencia de referencia (suavizada y mínima) se lleva por endpoint
+    (método y ruta sin IDs): una búsqueda lenta pero normal no se compara
+    con la mínima de un GET rápido. La mínima se reinicia cada
+    ADAPTIVE_LIMIT_RTT_WINDOW_SECONDS para seguir los cambios de la línea
+    base del servicio.
+    
+    Las esperas se atienden por carriles de prioridad (app.core.priority)
+    con reparto ponderado, y el carril masivo no puede ocupar más de
+    UPSTREAM_BULK_MAX_SHARE del límite: siempre queda hueco libre para los
+    webhooks aunque haya una carga masiva en curso. Si el servicio tiene
+    límite de peticiones por segundo (UPSTREAM_RATE_LIMITS), cada hueco
+    consume además un token del cubo, y los tokens se reparten igual.
+    """
+    
+    def __init__(
+        self,
+        name: str,
+        initial_limit: Optional[int] = None,
+        min_limit: Optional[int] = None,
+        max_limit: Optional[int] = None,
+        rate_limit: Optional[float] = None
+    ):
+        self.name = name
+        self.enabled = settings.ADAPTIVE_LIMIT_ENABLED
+        self.min_limit = min_limit or settings.ADAPTIVE_LIMIT_MIN
+        self.max_limit = max_limit or settings.ADAPTIVE_LIMIT_MAX
+        self.limit = float(initial_limit or settings.ADAPTIVE_LIMIT_INITIAL)
+        self.backoff = settings.ADAPTIVE_LIMIT_BACKOFF
+        self.tolerance = settings.ADAPTIVE_LIMIT_LATENCY_TOLERANCE
+        self.rtt_window = settings.ADAPTIVE_LIMIT_RTT_WINDOW_SECONDS
+        
+        self.bulk_max_share = settings.UPSTREAM_BULK_MAX_SHARE
+        
+        self.in_flight = 0
+        self._lane_in_flight = {name: 0 for name in LANES}
+        self._waiters = LaneQueue()
+        self._granted = {name: 0 for name in LANES}
+        self._wait_ewma: Dict[str, Optional[float]] = {name: None for name in LANES}
+        
+        # Cubo de tokens (peticiones por segundo); None = sin límite de tasa
+        self.rate = rate_limit if rate_limit is not None else settings.UPSTREAM_RATE_LIMITS.get(name)
+        self._tokens = float(max(1.0, self.rate)) if self.rate else 0.0
+        self._tokens_at = time.monotonic()
+        self._refill_timer: Optional[asyncio.TimerHandle] = None
+        
+        self.rtt_ewma: Optional[float] = None
+        self._endpoints: Dict[str, EndpointLatency] = {}
+        self._last_decrease = 0.0
+        
+        self.samples = 0
+        self.overloads = 0
+        self.decreases = 0
+    
+    @property
+    def current_limit(self) -> int:
+        """Llamadas simultáneas permitidas ahora mismo"""
+        return max(1, int(self.limit))
+    
+    @property
+    def queued(self) -> int:
+        """Llamadas esperando hueco"""
+        return len(self._waiters)
+    
+    def _lane_allowed(self, lane: str) -> bool:
+        if lane != BULK:
+            return True
+        return self._lane_in_flight[BULK] < max(1, int(self.current_limit * self.bulk_max_share))
+    
+    def _refill(self) -> bool:
+        """Repone tokens y dice si hay al menos uno"""
+        if not self.rate:
+            return True
+        now = time.monotonic()
+        self._tokens = min(max(1.0, self.rate), self._tokens + (now - self._tokens_at) * self.rate)
+        self._tokens_at = now
+        return self._tokens >= 1.0
+    
+    def _grant(self, lane: str):
+        self.in_flight += 1
+        self._lane_in_flight[lane] += 1
+        self._granted[lane] += 1
+        if self.rate:
+            self._tokens -= 1.0
+    
+    def _has_eligible_waiters(self) -> bool:
+        return any(self._waiters.queued(name) and self._lane_allowed(name) for name in LANES)
+    
+    async def acquire(self, lane: Optional[str] = None) -> str:
+        """
+        Espera hasta que haya hueco bajo el límite actual
+        
+        Args:
+            lane: Carril de prioridad (por defecto el de la tarea actual)
+        
+        Returns:
+            Carril en el que se concedió el hueco (para release)
+        """
+        lane = lane or current_lane()
+        if not self.enabled:
+            self.in_flight += 1
+            self._lane_in_flight[lane] += 1
+            self._granted[lane] += 1
+            return lane
+        
+        if (
+            self.in_flight < self.current_limit
+            and self._lane_allowed(lane)
+            and not self._has_eligible_waiters()
+            and self._refill()
+        ):
+            self._grant(lane)
+            self._record_wait(lane, 0.0)
+            return lane
+        
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(lane, future)
+        started = time.perf_counter()
+        self._schedule_refill()
+        try:
+            # Quien libera un hueco lo cede directamente (in_flight ya incluye esta llamada)
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release_slot(lane)
+            else:
+                try:
+                    self._waiters.remove(lane, future)
+                except ValueError:
+                    pass
+            raise
+        self._record_wait(lane, time.perf_counter() - started)
+        return lane
+    
+    def _record_wait(self, lane: str, waited: float):
+        previous = self._wait_ewma[lane]
+        self._wait_ewma[lane] = waited if previous is None else 0.8 * previous + 0.2 * waited
+    
+    def release(
+        self,
+        rtt: Optional[float],
+        overloaded: bool = False,
+        lane: Optional[str] = None,
+        endpoint: str = "*"
+    ):
+        """
+        Libera un hueco y actualiza el límite con el resultado de la llamada
+        
+        Args:
+            rtt: Duración de la llamada en segundos (None si no es representativa)
+            overloaded: La llamada indica sobrecarga (429, 5xx, timeout, conexión)
+            lane: Carril devuelto por acquire()
+            endpoint: Endpoint llamado (ver endpoint_key), con su propia latencia de referencia
+        """
+        self._observe(rtt, overloaded, endpoint)
+        self._release_slot(lane or current_lane())
+    
+    def _release_slot(self, lane: str):
+        self.in_flight -= 1
+        self._lane_in_flight[lane] -= 1
+        self._wake()
+    
+    def _wake(self):
+        while self._waiters and self.in_flight < self.current_limit:
+            if not self._refill():
+                self._schedule_refill()
+                return
+            popped = self._waiters.pop(self._lane_allowed)
+            if popped is None:
+                return
+            lane, future = popped
+            if not future.done():
+                self._grant(lane)
+                future.set_result(None)
+    
+    def _schedule_refill(self):
+        """Programa un _wake() para cuando haya un token nuevo"""
+        if not self.rate or self._refill_timer is not None or self._tokens >= 1.0:
+            return
+        delay = (1.0 - self._tokens) / self.rate
+        
+        def _on_refill():
+            self._refill_timer = None
+            self._wake()
+        
+        self._refill_timer = asyncio.get_running_loop().call_later(delay, _on_refill)
+    
+    def _observe(self, rtt: Optional[float], overloaded: bool, endpoint: str = "*"):
+        now = time.monotonic()
+        
+        if overloaded:
+            self.overloads += 1
+            self._decrease(now, "sobrecarga")
+            return
+        if rtt is None:
+            return
+        
+        self.samples += 1
+        self.rtt_ewma = rtt if self.rtt_ewma is None else 0.8 * self.rtt_ewma + 0.2 * rtt
+        
+        latency = self._endpoints.get(endpoint)
+        if latency is None:
+            if len(self._endpoints) >= _MAX_ENDPOINTS:
+                # Se descarta el endpoint visto hace más tiempo
+                self._endpoints.pop(next(iter(self._endpoints)))
+            latency = self._endpoints[endpoint] = EndpointLatency()
+        latency.observe(rtt, now, self.rtt_window)
+        
+        if latency.rtt_ewma > latency.min_rtt * self.tolerance:
+            self._decrease(now, f"latencia de {endpoint}")
+        elif self.in_flight >= self.current_limit / 2:
+            # Solo crece si el límite se está usando
+            self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+    
+    def _decrease(self, now: float, reason: str):
+        if now - self._last_decrease < max(self.rtt_ewma or 0.0, 0.1):
+            return
+        previous = self.current_limit
+        self.limit = max(float(self.min_limit), self.limit * self.backoff)
+        self._last_decrease = now
+        self.decreases += 1
+        if self.current_limit != previous:
+            logger.debug(f"Límite de {self.name} reducido por {reason}: {previous} → {self.current_limit}")
+    
+    def slot(self, endpoint: str = "*") -> "LimiterSlot":
+        """
+        Context manager que ocupa un hueco durante una llamada
+        
+        Uso:
+            async with limiter.slot(endpoint_key("GET", url)) as slot:
+                response = await client.request(...)
+                slot.observe(response.status_code)
+        """
+        return LimiterSlot(self, endpoint)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Límite actual, latencias medidas y contadores"""
+        return {
+            "enabled": self.enabled,
+            "limit": self.current_limit,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "rate_per_second": self.rate,
+            "lanes": {
+                name: {
+                    "in_flight": self._lane_in_flight[name],
+                    "queued": self._waiters.queued(name),
+                    "granted": self._granted[name],
+                    "wait_ms": (
+                        round(self._wait_ewma[name] * 1000, 1)
+                        if self._wait_ewma[name] is not None else None
+                    )
+                }
+                for name in LANES
+            },
+            "rtt_ms": round(self.rtt_ewma * 1000, 1) if self.rtt_ewma is not None else None,
+            "endpoints": {
+                endpoint: {
+                    "rtt_ms": round(latency.rtt_ewma * 1000, 1),
+                    "min_rtt_ms": round(latency.min_rtt * 1000, 1)
+                }
+                for endpoint, latency in self._endpoints.items()
+            },
+            "samples": self.samples,
+            "overloads": self.overloads,
+            "decreases": self.decreases
+        }
+
+
+class LimiterSlot:
+    """Hueco ocupado en un AdaptiveLimiter durante una llamada"""
+    
+    __slots__ = ("limiter", "endpoint", "lane", "started", "status_code")
+    
+    def __init__(self, limiter: AdaptiveLimiter, endpoint: str = "*"):
+        self.limiter = limiter
+        self.endpoint = endpoint
+        self.lane: Optional[str] = None
+        self.started = 0.0
+        self.status_code: Optional[int] = None
+    
+    def observe(self, status_code: int):
+        """Registra el status de la respuesta"""
+        self.status_code = status_code
+    
+    async def __aenter__(self) -> "LimiterSlot":
+        with phase("upstream_wait"):
+            self.lane = await self.limiter.acquire()
+        self.started = time.perf_counter()
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is not None and issubclass(exc_type, asyncio.CancelledError):
+            self.limiter.release(None, lane=self.lane)
+        elif exc_type is not None:
+            # Errores de conexión y timeouts cuentan como sobrecarga
+            self.limiter.release(None, overloaded=True, lane=self.lane)
+        elif self.status_code is not None and (self.status_code == 429 or self.status_code >= 500):
+            self.limiter.release(None, overloaded=True, lane=self.lane)
+        else:
+            self.limiter.release(time.perf_counter() - self.started, lane=self.lane, endpoint=self.endpoint)
+        return False
+
+
+# Un limitador por servicio externo
+_limiters: Dict[str, AdaptiveLimiter] = {}
+
+
+def get_limiter(name: str) -> AdaptiveLimiter:
+    """
+    Obtiene el limitador adaptativo de un servicio externo
+    
+    Args:
+        name: Nombre del servicio (nowcerts, ghl)
+    """
+    limiter = _limiters.get(name)
+    if limiter is None:
+        limiter = AdaptiveLimiter(name)
+        _limiters[name] = limiter
+    return limiter
+
+
+def limiter_stats() -> Dict[str, Dict[str, Any]]:
+    """Estadísticas de todos los limitadores"""
+    return {name: limiter.stats() for name, limiter in _limiters.items()}
+
+
+memory_registry.register("upstream.limiter_waiters", "queue", lambda: {
+    "entries": sum(len(limiter._waiters) for limiter in _limiters.values()),
+    "approx_bytes": sum(deep_sizeof(limiter._waiters) for limiter in _limiters.values())
+})
@@ -0,0 +1,243 @@
+"""
+Control de admisión y descarte de carga
+Limita las peticiones en curso (global y por ruta) con una cola de espera
+acotada; cuando se satura responde 503/429 con Retry-After
+"""
+import asyncio
+import json
+from collections import deque
+from fnmatch import fnmatchcase
+from typing import Optional, Dict, Any, Deque, List, Tuple
+from fastapi import status
+from app.core.config import settings
+from app.core.logger import logger
+from app.core.memory import memory_registry, container_usage
+
+
+class AdmissionController:
+    """Controla cuántas peticiones pueden estar en curso a la vez"""
+    
+    def __init__(
+        self,
+        max_in_flight: Optional[int] = None,
+        max_queue: Optional[int] = None,
+        queue_timeout: Optional[float] = None,
+        route_limits: Optional[Dict[str, int]] = None,
+        retry_after: Optional[int] = None
+    ):
+        self.max_in_flight = max_in_flight or settings.ADMISSION_MAX_IN_FLIGHT
+        self.max_queue = max_queue if max_queue is not None else settings.ADMISSION_MAX_QUEUE
+        self.queue_timeout = (
+            queue_timeout if queue_timeout is not None
+            else settings.ADMISSION_QUEUE_TIMEOUT_SECONDS
+        )
+        self.route_limits = (
+            route_limits if route_limits is not None else settings.ADMISSION_ROUTE_LIMITS
+        )
+        self.retry_after = retry_after or settings.ADMISSION_RETRY_AFTER_SECONDS
+        
+        self.in_flight = 0
+        self._route_in_flight: Dict[str, int] = {}
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._idle_event: Optional[asyncio.Event] = None
+        self.draining = False
+        self.rejected = {"global": 0, "route": 0, "timeout": 0, "draining": 0}
+    
+    @property
+    def queued(self) -> int:
+        """Peticiones esperando en la cola"""
+        return len(self._waiters)
+    
+    def _route_saturated(self, route: str) -> bool:
+        limit = self.route_limits.get(route)
+        return limit is not None and self._route_in_flight.get(route, 0) >= limit
+    
+    async def acquire(self, route: str) -> Optional[Tuple[int, str]]:
+        """
+        Intenta admitir una petición
+        
+        Args:
+            route: Ruta de la petición
+        
+        Returns:
+            None si se admitió; (status_code, motivo) si se rechaza
+        """
+        if self.draining:
+            self.rejected["draining"] += 1
+            return status.HTTP_503_SERVICE_UNAVAILABLE, "Servicio cerrándose"
+        
+        if self._route_saturated(route):
+            self.rejected["route"] += 1
+            return status.HTTP_429_TOO_MANY_REQUESTS, f"Límite de peticiones en curso alcanzado para {route}"
+        
+        if self.in_flight >= self.max_in_flight or self._waiters:
+            if len(self._waiters) >= self.max_queue:
+                self.rejected["global"] += 1
+                return status.HTTP_503_SERVICE_UNAVAILABLE, "Servicio saturado"
+            
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.append(future)
+            try:
+                await asyncio.wait_for(future, timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._discard_waiter(future)
+                self.rejected["timeout"] += 1
+                return status.HTTP_503_SERVICE_UNAVAILABLE, "Tiempo de espera en cola agotado"
+            except asyncio.CancelledError:
+                # Si ya se nos había cedido el hueco, devolverlo
+                if future.done() and not future.cancelled():
+                    self._release_slot()
+                else:
+                    self._discard_waiter(future)
+                raise
+            # El hueco se cedió directamente desde release(): in_flight ya lo cuenta
+        else:
+            self.in_flight += 1
+        
+        if self._route_saturated(route):
+            self._release_slot()
+            self.rejected["route"] += 1
+            return status.HTTP_429_TOO_MANY_REQUESTS, f"Límite de peticiones en curso alcanzado para {route}"
+        
+        self._route_in_flight[route] = self._route_in_flight.get(route, 0) + 1
+        return None
+    
+    def release(self, route: str):
+        """
+        Libera el hueco de una petición admitida
+        
+        Args:
+            route: Ruta de la petición
+        """
+        count = self._route_in_flight.get(route, 0) - 1
+        if count > 0:
+            self._route_in_flight[route] = count
+        else:
+            self._route_in_flight.pop(route, None)
+        self._release_slot()
+    
+    def _release_slot(self):
+        # Ceder el hueco al primer esperando todavía activo (sin pasar por in_flight)
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(True)
+                return
+        self.in_flight -= 1
+        if self.in_flight == 0 and self._idle_event is not None:
+            self._idle_event.set()
+    
+    def _discard_waiter(self, future: asyncio.Future):
+        try:
+            self._waiters.remove(future)
+        except ValueError:
+            # Ya se le había cedido un hueco que no va a usar
+            if future.done() and not future.cancelled():
+                self._release_slot()
+    
+    async def drain(self, timeout: float) -> bool:
+        """
+        Deja de admitir peticiones nuevas y espera a que terminen las admitidas
+        
+        Las peticiones que ya esperaban en la cola se siguen atendiendo.
+        
+        Args:
+            timeout: Tiempo máximo de espera en segundos
+        
+        Returns:
+            True si no queda ninguna petición en curso
+        """
+        self.draining = True
+        if self.in_flight == 0 and not self._waiters:
+            return True
+        
+        self._idle_event = asyncio.Event()
+        logger.info(
+            f"Esperando {self.in_flight} peticiones en curso y "
+            f"{len(self._waiters)} en cola (máximo {timeout:.0f}s)..."
+        )
+        try:
+            await asyncio.wait_for(self._idle_event.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+    
+    def stats(self) -> Dict[str, Any]:
+        """Estadísticas actuales del control de admisión"""
+        return {
+            "draining": self.draining,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+            "route_in_flight": dict(self._route_in_flight),
+            "rejected": dict(self.rejected)
+        }
+
+
+class AdmissionMiddleware:
+    """
+    Middleware ASGI que aplica el control de admisión a las rutas de la API
+    
+    Las rutas de ADMISSION_EXEMPT_PATHS (streams SSE que pueden durar una
+    hora) no ocupan hueco: con unos cuantos abiertos se agotaría el límite
+    global sin que haya trabajo en curso.
+    """
+    
+    def __init__(
+        self,
+        app,
+        controller: Optional[AdmissionController] = None,
+        path_prefix: Optional[str] = None,
+        exempt_paths: Optional[List[str]] = None
+    ):
+        self.app = app
+        self.controller = controller or admission_controller
+        self.path_prefix = path_prefix if path_prefix is not None else settings.API_V1_PREFIX
+        self.exempt_paths = exempt_paths if exempt_paths is not None else settings.ADMISSION_EXEMPT_PATHS
+    
+    def _exempt(self, path: str) -> bool:
+        relative = path[len(self.path_prefix):]
+        return any(fnmatchcase(relative, pattern) for pattern in self.exempt_paths)
+    
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or not scope["path"].startswith(self.path_prefix)
+            or self._exempt(scope["path"])
+        ):
+            await self.app(scope, receive, send)
+            return
+        
+        route = scope["path"]
+        rejection = await self.controller.acquire(route)
+        if rejection is not None:
+            status_code, reason = rejection
+            logger.warning(f"Petición rechazada por control de admisión ({status_code}): {reason}")
+            await self._reject(send, status_code, reason)
+            return
+        
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(route)
+    
+    async def _reject(self, send, status_code: int, reason: str):
+        body = json.dumps({"detail": reason}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status_code,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(self.controller.retry_after).encode())
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+# Instancia global del control de admisión
+admission_controller = AdmissionController()
+memory_registry.register("admission.waiters", "queue", lambda: container_usage(
+    admission_controller._waiters, admission_controller.max_queue
+))
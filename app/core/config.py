@@ -2,16 +2,12 @@
 Configuración centralizada de la aplicación
 """
 import os
-from typing import List, Optional
+from typing import Dict, List, Literal, Optional
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from dotenv import load_dotenv
-
-# Cargar variables de entorno
-load_dotenv()
 
 
 class Settings(BaseSettings):
-    """Configuración de la aplicación"""
+    """Configuración de la aplicación (lee variables de entorno y el archivo .env)"""
     
     model_config = SettingsConfigDict(
         env_file=".env",
@@ -37,11 +33,31 @@ class Settings(BaseSettings):
     NOWCERTS_CLIENT_ID: Optional[str] = None
     NOWCERTS_CLIENT_SECRET: Optional[str] = None
     
+    # Caché cifrada del token de NowCerts (requiere 'cryptography'); deshabilitada si es None
+    NOWCERTS_TOKEN_CACHE_FILE: Optional[str] = None
+    NOWCERTS_TOKEN_CACHE_KEY: Optional[str] = None  # Clave Fernet; si es None se deriva de las credenciales
+    NOWCERTS_TOKEN_CACHE_LOCK_TIMEOUT_SECONDS: float = 10.0  # Espera del bloqueo entre procesos
+    
     # GoHighLevel API
     GHL_BASE_URL: str = "https://services.leadconnectorhq.com"
     GHL_API_KEY: Optional[str] = None
     GHL_LOCATION_ID: Optional[str] = None
     
+    # Sondeo incremental de NowCerts (alternativa/complemento a los webhooks)
+    NOWCERTS_POLL_ENABLED: bool = False
+    NOWCERTS_POLL_STATE_FILE: Optional[str] = "data/nowcerts_poll_state.json"  # Marcas de agua
+    NOWCERTS_POLL_MIN_INTERVAL_SECONDS: float = 15.0
+    NOWCERTS_POLL_MAX_INTERVAL_SECONDS: float = 900.0
+    NOWCERTS_POLL_IDLE_BACKOFF: float = 1.5  # Factor de alargamiento sin cambios
+    NOWCERTS_POLL_PAGE_SIZE: int = 100
+    NOWCERTS_POLL_CONCURRENCY: int = 4  # Páginas/registros procesados a la vez
+    NOWCERTS_POLL_MAX_STUCK_ROUNDS: int = 10  # Vueltas que un registro fallido frena la marca de agua
+    
+    # Escrituras de contactos en GHL (agrupación por ventana)
+    GHL_BATCH_WINDOW_SECONDS: float = 0.05  # Ventana para combinar escrituras
+    GHL_BATCH_MAX_SIZE: int = 100  # Enviar de inmediato al alcanzar este tamaño
+    GHL_BATCH_CONCURRENCY: int = 5  # Upserts simultáneos por lote
+    
     # Configuración de tokens
     TOKEN_REFRESH_BUFFER_SECONDS: int = 300  # Renovar token 5 minutos antes de expirar
     
@@ -50,14 +66,137 @@ class Settings(BaseSettings):
     RETRY_BACKOFF_FACTOR: float = 2.0
     RETRY_INITIAL_DELAY: float = 1.0
     
+    # Límite de concurrencia adaptativo por servicio externo (AIMD por latencia)
+    ADAPTIVE_LIMIT_ENABLED: bool = True
+    ADAPTIVE_LIMIT_INITIAL: int = 20  # Llamadas simultáneas al arrancar
+    ADAPTIVE_LIMIT_MIN: int = 2
+    ADAPTIVE_LIMIT_MAX: int = 100  # No más que HTTP_MAX_CONNECTIONS
+    ADAPTIVE_LIMIT_BACKOFF: float = 0.9  # Factor de reducción ante sobrecarga
+    ADAPTIVE_LIMIT_LATENCY_TOLERANCE: float = 2.0  # Latencia/mínima a partir de la cual se reduce
+    ADAPTIVE_LIMIT_RTT_WINDOW_SECONDS: float = 60.0  # Reinicio de la latencia mínima
+    
+    # Carriles de prioridad hacia los servicios externos (realtime, manual, bulk)
+    UPSTREAM_LANE_WEIGHTS: Dict[str, int] = {"realtime": 8, "manual": 3, "bulk": 1}
+    UPSTREAM_BULK_MAX_SHARE: float = 0.75  # Fracción máxima del límite que puede ocupar bulk
+    UPSTREAM_RATE_LIMITS: Dict[str, float] = {}  # {"ghl": 10} → peticiones/segundo por servicio
+    
+    # JSON rápido (orjson) si está instalado
+    JSON_USE_ORJSON: bool = True
+    
+    # Clientes HTTP compartidos (pool de conexiones por servicio externo)
+    HTTP_TIMEOUT_SECONDS: float = 30.0
+    HTTP_MAX_CONNECTIONS: int = 100
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    
     # Configuración del servidor
     HOST: str = "0.0.0.0"
     PORT: int = 8000
     DEBUG: bool = False
     
+    # Tamaño de las peticiones
+    MAX_REQUEST_BODY_BYTES: int = 10 * 1024 * 1024  # Más grande → 413
+    # Desde este tamaño el webhook de NowCerts se parsea de forma incremental
+    # conservando solo los campos que se usan (requiere ijson para no
+    # cargar el body completo en memoria)
+    STREAMING_PARSE_THRESHOLD_BYTES: int = 256 * 1024
+    
+    # Control de admisión (peticiones en curso y cola de espera)
+    ADMISSION_MAX_IN_FLIGHT: int = 200  # Peticiones de la API en curso a la vez
+    ADMISSION_MAX_QUEUE: int = 500  # Peticiones esperando hueco; más allá → 503
+    ADMISSION_QUEUE_TIMEOUT_SECONDS: float = 5.0  # Espera máxima en cola → 503
+    ADMISSION_ROUTE_LIMITS: Dict[str, int] = {}  # {"/api/v1/webhooks/ghl": 50} → 429
+    ADMISSION_RETRY_AFTER_SECONDS: int = 1  # Valor de Retry-After en 503/429
+    # Rutas (relativas a API_V1_PREFIX, con comodín *) que no ocupan hueco:
+    # streams largos que retendrían un hueco durante toda la conexión
+    ADMISSION_EXEMPT_PATHS: List[str] = ["/sync/jobs/*/events"]
+    
+    # Arranque: precarga de token y metadatos de GHL
+    # "background": arranca de inmediato y /ready responde 503 hasta terminar
+    # "blocking": no acepta tráfico hasta terminar la precarga
+    # "off": sin precarga (la primera petición paga el arranque en frío)
+    STARTUP_WARMUP_MODE: Literal["background", "blocking", "off"] = "background"
+    STARTUP_WARMUP_TIMEOUT_SECONDS: float = 15.0
+    
+    # Sondas de readiness (/ready lee el último resultado, nunca hace I/O)
+    READINESS_PROBE_INTERVAL_SECONDS: float = 15.0
+    READINESS_PROBE_TIMEOUT_SECONDS: float = 5.0
+    READINESS_FAILURE_THRESHOLD: int = 3  # Fallos seguidos para marcar el servicio como caído
+    
     # Base de datos para control de duplicados (opcional, usar SQLite por defecto)
     DATABASE_URL: Optional[str] = None  # Si es None, usa SQLite en memoria
     
+    # Cache de idempotencia en memoria (buckets de tiempo con tope de entradas)
+    IDEMPOTENCY_EXPIRY_HOURS: int = 24
+    IDEMPOTENCY_BUCKET_SECONDS: int = 3600  # Los buckets expiran completos
+    IDEMPOTENCY_MAX_ENTRIES: int = 1_000_000  # Tope duro; desaloja los más antiguos
+    # Campos de la clave semántica por fuente y tipo de evento (sobrescribe los
+    # de app.core.idempotency.DEFAULT_KEY_FIELDS), p. ej.
+    # {"nowcerts": {"POLICY_UPDATE": ["event_type", "data.policyNumber", "data.changeDate"]}}
+    IDEMPOTENCY_KEY_FIELDS: Dict[str, Dict[str, List[str]]] = {}
+    
+    # Forma canónica de los IDs de eventos: "stdlib" (compatible con los IDs
+    # ya persistidos) o "fast" (orjson; cambia los IDs, ver app.core.json_codec)
+    IDEMPOTENCY_CANONICAL_JSON: Literal["stdlib", "fast"] = "stdlib"
+    
+    # Estado de idempotencia persistido al cerrar y cargado al arrancar
+    IDEMPOTENCY_STATE_FILE: Optional[str] = None  # Si es None, no se persiste
+    
+    # Diario de sincronización (SQLite) y supresión de ecos
+    SYNC_JOURNAL_FILE: Optional[str] = "data/sync_journal.db"  # Si es None, solo en memoria
+    SYNC_ECHO_WINDOW_SECONDS: float = 600.0  # Antigüedad máxima de una escritura nuestra para considerar eco
+    SYNC_JOURNAL_RETENTION_DAYS: float = 30.0
+    
+    # Índice póliza/cotización de NowCerts → oportunidad de GHL (SQLite)
+    OPPORTUNITY_INDEX_FILE: Optional[str] = "data/opportunity_index.db"  # Si es None, solo en memoria
+    # Retry-After (503) de pólizas cuyo asegurado aún no está en GHL: NowCerts las reenvía
+    OPPORTUNITY_PENDING_RETRY_AFTER_SECONDS: int = 60
+    OPPORTUNITY_PENDING_MAX_RETRIES: int = 30  # Pasados RETRY_AFTER × MAX_RETRIES se omite
+    
+    # Sincronización manual por ID: escrituras de registros relacionados a la vez
+    SYNC_FANOUT_CONCURRENCY: int = 8
+    
+    # Reconciliación (detección de divergencias NowCerts ↔ GHL)
+    RECONCILE_BUCKETS: int = 4096  # Hojas del árbol de hashes
+    RECONCILE_PAGE_CONCURRENCY: int = 4  # Páginas de NowCerts descargadas a la vez
+    
+    # Emparejamiento de contactos NowCerts ↔ GHL (índice local, SQLite)
+    CONTACT_MATCH_INDEX_FILE: Optional[str] = "data/contact_match.db"  # Si es None, solo en memoria
+    CONTACT_MATCH_MIN_SCORE: float = 0.6  # Puntuación mínima para dar por buena una contraparte
+    CONTACT_PHONE_COUNTRY_CODE: str = "1"  # Código de país de los teléfonos sin prefijo (E.164)
+    
+    # Trabajos de sincronización en segundo plano (POST /sync/jobs)
+    SYNC_JOBS_CONCURRENCY: int = 2  # Trabajos ejecutándose a la vez
+    SYNC_JOBS_MAX_PENDING: int = 50  # Trabajos sin terminar; más allá → 429
+    SYNC_JOB_TIMEOUT_SECONDS: float = 3600.0  # Tiempo máximo por trabajo
+    SYNC_JOB_RETENTION_SECONDS: float = 86400.0  # Tiempo que se conserva el resultado
+    SYNC_JOBS_DIR: str = "data/jobs"  # Planes de reconciliación de los trabajos
+    SYNC_JOB_SSE_HEARTBEAT_SECONDS: float = 15.0  # Comentario SSE si no hay cambios
+    
+    # Contabilidad de memoria (GET /admin/memory)
+    MEMORY_SAMPLE_INTERVAL_SECONDS: float = 60.0  # Cada cuánto se muestrea el tamaño de caches y colas
+    MEMORY_SAMPLE_HISTORY: int = 60  # Muestras conservadas para calcular el crecimiento
+    MEMORY_TRACE_MAX_SECONDS: float = 600.0  # Duración máxima de una captura de tracemalloc
+    MEMORY_TRACE_FRAMES: int = 10  # Marcos guardados por asignación en las capturas
+    
+    # Cierre ordenado: plazo total (drenado, escrituras pendientes y cierre)
+    SHUTDOWN_GRACE_PERIOD_SECONDS: float = 25.0
+    
+    # Endpoints de administración (/api/v1/admin); deshabilitados si es None
+    ADMIN_API_KEY: Optional[str] = None
+    PROFILER_MAX_SECONDS: float = 60.0  # Duración máxima de /admin/profile
+    
+    # Trazas (spans en JSON Lines); deshabilitadas si es None
+    TRACE_EXPORT_FILE: Optional[str] = None
+    TRACE_EXPORT_MAX_QUEUE: int = 10000  # Spans pendientes de escribir; el resto se descarta
+    
+    # Archivo comprimido de payloads recibidos; deshabilitado si es None
+    PAYLOAD_ARCHIVE_DIR: Optional[str] = None
+    PAYLOAD_ARCHIVE_SEGMENT_BYTES: int = 64 * 1024 * 1024  # Rotación del segmento (comprimido)
+    PAYLOAD_ARCHIVE_BLOCK_RECORDS: int = 256  # Payloads por bloque zlib
+    PAYLOAD_ARCHIVE_FLUSH_SECONDS: float = 2.0  # Espera máxima para completar un bloque
+    PAYLOAD_ARCHIVE_MAX_QUEUE: int = 10000  # Payloads pendientes de escribir; el resto se descarta
+    PAYLOAD_ARCHIVE_RETENTION_DAYS: float = 30.0  # 0 = sin borrado
+    
     # Logging
     LOG_LEVEL: str = "INFO"
     LOG_FILE: Optional[str] = None  # Si es None, solo log a consola
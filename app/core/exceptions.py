@@ -36,6 +36,16 @@ class TokenExpiredError(HTTPException):
         )
 
 
+class PayloadTooLargeError(HTTPException):
+    """Excepción para bodies que superan MAX_REQUEST_BODY_BYTES"""
+    
+    def __init__(self, detail: str = "El body de la petición es demasiado grande"):
+        super().__init__(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=detail
+        )
+
+
 class DuplicateEventError(HTTPException):
     """Excepción para eventos duplicados (idempotencia)"""
     
@@ -45,3 +55,23 @@ class DuplicateEventError(HTTPException):
             detail=detail
         )
 
+
+class EventNotReadyError(HTTPException):
+    """Excepción para eventos que dependen de otro aún no sincronizado (reintentable)"""
+    
+    def __init__(self, detail: str = "El evento depende de otro aún no sincronizado", retry_after: int = 60):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=detail,
+            headers={"Retry-After": str(retry_after)}
+        )
+
+
+class JobQueueFullError(HTTPException):
+    """Excepción para trabajos de sincronización rechazados por cola llena"""
+    
+    def __init__(self, detail: str = "Demasiados trabajos de sincronización pendientes"):
+        super().__init__(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=detail
+        )
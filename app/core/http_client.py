@@ -0,0 +1,129 @@
+"""
+Clientes HTTP compartidos (pool de conexiones por servicio externo)
+"""
+from typing import Optional, Dict, Any
+import httpx
+from app.core.config import settings
+from app.core.adaptive_limiter import AdaptiveLimiter, endpoint_key
+from app.core.exceptions import ExternalAPIError
+from app.core.json_codec import dumps
+from app.core.logger import logger
+from app.core.timing import phase
+
+# Métodos HTTP soportados y cuáles llevan body JSON
+SUPPORTED_METHODS = ("GET", "POST", "PUT", "DELETE")
+BODY_METHODS = ("POST", "PUT")
+
+# Un cliente por servicio externo para reutilizar conexiones TCP/TLS
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def get_client(name: str) -> httpx.AsyncClient:
+    """
+    Obtiene el cliente HTTP compartido de un servicio externo
+    
+    Args:
+        name: Nombre del servicio (nowcerts, ghl)
+    
+    Returns:
+        Cliente httpx con pool de conexiones
+    """
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            timeout=settings.HTTP_TIMEOUT_SECONDS,
+            limits=httpx.Limits(
+                max_connections=settings.HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS
+            )
+        )
+        _clients[name] = client
+    return client
+
+
+async def send_request(
+    client: httpx.AsyncClient,
+    method: str,
+    url: str,
+    service_name: str,
+    headers: Optional[Dict[str, str]] = None,
+    json_data: Optional[Dict[str, Any]] = None,
+    params: Optional[Dict[str, Any]] = None,
+    limiter: Optional[AdaptiveLimiter] = None
+) -> httpx.Response:
+    """
+    Envía una petición a un servicio externo (mide la fase "upstream")
+    
+    Args:
+        client: Cliente HTTP compartido del servicio
+        method: Método HTTP (GET, POST, PUT, DELETE)
+        url: URL completa
+        service_name: Nombre del servicio (para errores)
+        headers: Headers de la petición
+        json_data: Datos JSON para el body (solo POST/PUT)
+        params: Parámetros de query
+        limiter: Límite de concurrencia adaptativo del servicio (opcional);
+            la espera por hueco se mide como fase "upstream_wait"
+    
+    Returns:
+        Respuesta HTTP (sin verificar el status)
+    """
+    method = method.upper()
+    if method not in SUPPORTED_METHODS:
+        raise ExternalAPIError(
+            status_code=400,
+            detail=f"Método {method} no soportado",
+            service_name=service_name
+        )
+    
+    content = None
+    if method in BODY_METHODS and json_data is not None:
+        content = dumps(json_data)
+        headers = {**(headers or {}), "Content-Type": "application/json"}
+    
+    if limiter is None:
+        with phase("upstream"):
+            return await client.request(method, url, content=content, headers=headers, params=params)
+    
+    async with limiter.slot(endpoint_key(method, url)) as slot:
+        with phase("upstream"):
+            response = await client.request(method, url, content=content, headers=headers, params=params)
+        slot.observe(response.status_code)
+        return response
+
+
+def pool_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Uso de los pools de conexiones de cada servicio (sin I/O)
+    
+    Returns:
+        Por servicio: conexiones abiertas, activas, ociosas, peticiones en
+        espera de conexión y límite configurado
+    """
+    stats: Dict[str, Dict[str, Any]] = {}
+    for name, client in _clients.items():
+        # httpx no expone el pool públicamente; si cambia la estructura
+        # interna se informa solo el límite
+        pool = getattr(getattr(client, "_transport", None), "_pool", None)
+        connections = list(getattr(pool, "connections", None) or [])
+        requests = list(getattr(pool, "_requests", None) or [])
+        idle = sum(1 for connection in connections if connection.is_idle())
+        stats[name] = {
+            "connections": len(connections),
+            "active": len(connections) - idle,
+            "idle": idle,
+            "waiting": sum(1 for request in requests if request.is_queued()),
+            "max_connections": settings.HTTP_MAX_CONNECTIONS,
+            "closed": client.is_closed
+        }
+    return stats
+
+
+async def close_clients():
+    """Cierra todos los clientes HTTP compartidos"""
+    for name, client in list(_clients.items()):
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.warning(f"Error cerrando cliente HTTP de {name}: {str(e)}")
+    _clients.clear()
@@ -1,21 +1,348 @@
 """
 Sistema de control de duplicados (idempotencia)
 """
+import asyncio
 import hashlib
-import json
-from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+import os
+import struct
+import sys
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Callable, List, Sequence, Set, Tuple
 from app.core.config import settings
+from app.core.json_codec import canonical_dumps
 from app.core.logger import logger
+from app.core.memory import memory_registry
+from app.core.storage import atomic_write_bytes, atomic_write_json
 
-# Almacenamiento en memoria (en producción usar Redis o base de datos)
-_event_cache: Dict[str, datetime] = {}
-CACHE_EXPIRY_HOURS = 24
+CACHE_EXPIRY_HOURS = settings.IDEMPOTENCY_EXPIRY_HOURS
+
+# Bytes del digest que se guardan por evento (128 bits)
+KEY_BYTES = 16
+
+# Formato del archivo de estado: cabecera, y por bucket (índice, nº de claves) + claves
+_STATE_MAGIC = b"IDEM1\n"
+_BUCKET_HEADER = struct.Struct(">qI")
+
+
+class InMemoryIdempotencyStore:
+    """
+    Cache en memoria de eventos procesados (en producción usar Redis o base de datos)
+    
+    Los eventos se agrupan en buckets de tiempo (por defecto horarios) que
+    contienen solo los bytes del digest. Al expirar se descarta el bucket
+    completo, por lo que la expiración cuesta O(1) amortizado; un evento
+    vive entre CACHE_EXPIRY_HOURS y CACHE_EXPIRY_HOURS + un bucket. Si se
+    supera max_entries se desalojan primero los eventos más antiguos.
+    """
+    
+    def __init__(
+        self,
+        expiry_seconds: Optional[float] = None,
+        bucket_seconds: Optional[int] = None,
+        max_entries: Optional[int] = None
+    ):
+        self.expiry_seconds = expiry_seconds or CACHE_EXPIRY_HOURS * 3600
+        self.bucket_seconds = bucket_seconds or settings.IDEMPOTENCY_BUCKET_SECONDS
+        self.max_entries = max_entries or settings.IDEMPOTENCY_MAX_ENTRIES
+        # Número de buckets completos que cubren el periodo de expiración
+        self._bucket_span = -(-int(self.expiry_seconds) // self.bucket_seconds)
+        
+        self._buckets: "OrderedDict[int, Set[bytes]]" = OrderedDict()
+        self._size = 0
+        self.expired = 0
+        self.evicted = 0
+    
+    @staticmethod
+    def key_for(event_id: str) -> bytes:
+        """
+        Convierte un ID de evento en su clave compacta
+        
+        Los IDs "<fuente>_<sha256 hex>" usan directamente los primeros bytes
+        del digest; cualquier otro ID se resume con SHA-256.
+        """
+        _, _, digest_hex = event_id.rpartition("_")
+        if len(digest_hex) == 64:
+            try:
+                return bytes.fromhex(digest_hex[:KEY_BYTES * 2])
+            except ValueError:
+                pass
+        return hashlib.sha256(event_id.encode()).digest()[:KEY_BYTES]
+    
+    def _current_bucket(self) -> int:
+        return int(time.time() // self.bucket_seconds)
+    
+    def expire(self) -> int:
+        """
+        Descarta los buckets expirados completos
+        
+        Returns:
+            Número de eventos descartados
+        """
+        oldest_valid = self._current_bucket() - self._bucket_span
+        dropped = 0
+        while self._buckets:
+            bucket, keys = next(iter(self._buckets.items()))
+            if bucket >= oldest_valid:
+                break
+            self._buckets.popitem(last=False)
+            dropped += len(keys)
+        if dropped:
+            self._size -= dropped
+            self.expired += dropped
+        return dropped
+    
+    def contains(self, key: bytes) -> bool:
+        """Indica si la clave está en algún bucket vigente"""
+        self.expire()
+        # Los duplicados suelen ser recientes: buscar del bucket más nuevo al más viejo
+        for keys in reversed(self._buckets.values()):
+            if key in keys:
+                return True
+        return False
+    
+    def add(self, key: bytes, bucket: Optional[int] = None):
+        """
+        Registra una clave en el bucket actual (o en el indicado)
+        
+        Args:
+            key: Clave compacta del evento
+            bucket: Índice de bucket (solo al cargar estado persistido)
+        """
+        if bucket is None:
+            bucket = self._current_bucket()
+        keys = self._buckets.get(bucket)
+        if keys is None:
+            keys = set()
+            self._buckets[bucket] = keys
+            if len(self._buckets) > 1 and bucket < next(reversed(self._buckets)):
+                # Solo ocurre al cargar estado desordenado; mantener orden cronológico
+                self._buckets = OrderedDict(sorted(self._buckets.items()))
+        if key in keys:
+            return
+        keys.add(key)
+        self._size += 1
+        
+        if self._size > self.max_entries:
+            self._evict(self._size - self.max_entries)
+    
+    def _evict(self, count: int):
+        # Desalojar desde el bucket más antiguo
+        while count > 0 and self._buckets:
+            bucket, keys = next(iter(self._buckets.items()))
+            if len(keys) <= count:
+                self._buckets.popitem(last=False)
+                removed = len(keys)
+            else:
+                for _ in range(count):
+                    keys.pop()
+                removed = count
+            count -= removed
+            self._size -= removed
+            self.evicted += removed
+    
+    def __len__(self) -> int:
+        return self._size
+    
+    def clear(self):
+        """Vacía el cache"""
+        self._buckets.clear()
+        self._size = 0
+    
+    def items(self):
+        """Itera (bucket, claves) en orden cronológico"""
+        return self._buckets.items()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Estadísticas de ocupación, memoria aproximada y desalojos"""
+        key_bytes = sys.getsizeof(b"\0" * KEY_BYTES)
+        approx_bytes = sys.getsizeof(self._buckets) + sum(
+            sys.getsizeof(keys) + len(keys) * key_bytes for keys in self._buckets.values()
+        )
+        oldest_bucket = next(iter(self._buckets), None)
+        return {
+            "entries": self._size,
+            "max_entries": self.max_entries,
+            "buckets": len(self._buckets),
+            "bucket_seconds": self.bucket_seconds,
+            "approx_bytes": approx_bytes,
+            "approx_bytes_per_entry": round(approx_bytes / self._size, 1) if self._size else None,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "oldest_entry_age_seconds": (
+                int(time.time() - oldest_bucket * self.bucket_seconds)
+                if oldest_bucket is not None else None
+            )
+        }
+
+
+# Almacenamiento en memoria del proceso
+_store = InMemoryIdempotencyStore()
+memory_registry.register("idempotency.events", "cache", lambda: {
+    name: _store.stats()[name] for name in ("entries", "approx_bytes", "max_entries")
+})
+
+
+# Campos que identifican semánticamente un evento, por fuente y tipo de evento
+# ("POLICY_*" aplica a los tipos con ese prefijo y "*" a cualquier tipo). Cada
+# campo es una ruta con puntos dentro del payload; "a|b" toma la primera
+# alternativa no vacía y "=valor" es un valor fijo. Si falta algún campo se
+# usa el hash del payload completo. Se puede sobrescribir con
+# settings.IDEMPOTENCY_KEY_FIELDS.
+#
+# Las pólizas y cotizaciones llevan también el insuredId del asegurado: la
+# clave debe usar el ID propio de cada tipo, o dos pólizas del mismo
+# asegurado con la misma fecha se tomarían por el mismo evento. La clave
+# lleva el tipo de entidad y no INSERT/UPDATE: el sondeo no distingue
+# altas de cambios, y un registro que llegó por webhook como *_INSERT debe
+# reconocerse al volver como *_UPDATE con la misma fecha de modificación.
+_NOWCERTS_VERSION = "data.modifiedDate|data.changeDate|data.lastModified|data.version"
+
+DEFAULT_KEY_FIELDS: Dict[str, Dict[str, List[str]]] = {
+    "nowcerts": {
+        "INSURED_*": ["=INSURED", "data.id|data.databaseId|data.insuredId", _NOWCERTS_VERSION],
+        "POLICY_*": [
+            "=POLICY",
+            "data.id|data.databaseId|data.policyId|data.policyNumber",
+            _NOWCERTS_VERSION
+        ],
+        "QUOTE_*": [
+            "=QUOTE",
+            "data.id|data.databaseId|data.quoteId|data.quoteNumber|data.policyNumber",
+            _NOWCERTS_VERSION
+        ],
+        "*": ["event_type", "data.id|data.databaseId", _NOWCERTS_VERSION]
+    },
+    "ghl": {
+        "*": [
+            "event|type",
+            "contact.id|opportunity.id|id",
+            "contact.dateUpdated|opportunity.dateUpdated|dateUpdated"
+        ]
+    }
+}
+
+# Extractores registrados en código: (fuente, tipo de evento) -> función
+KeyExtractor = Callable[[dict], Optional[Sequence[Any]]]
+_key_extractors: Dict[Tuple[str, str], KeyExtractor] = {}
+
+_MISSING = object()
+
+
+def register_key_extractor(source: str, event_type: str, extractor: KeyExtractor):
+    """
+    Registra un extractor de clave semántica para una fuente y tipo de evento
+    
+    Args:
+        source: Fuente del evento (nowcerts, ghl)
+        event_type: Tipo de evento en mayúsculas, o "*" para todos
+        extractor: Función que recibe el payload y devuelve los valores que
+            identifican el evento, o None para usar el hash del payload
+    """
+    _key_extractors[(source, event_type.upper())] = extractor
+
+
+def _event_type_of(payload: dict, source: str) -> str:
+    if source == "nowcerts":
+        event_type = payload.get("event_type")
+    else:
+        event_type = payload.get("event") or payload.get("type")
+    return str(event_type or "").upper()
+
+
+def _resolve_path(payload: dict, path: str) -> Any:
+    if path.startswith("="):
+        return path[1:]
+    for alternative in path.split("|"):
+        value: Any = payload
+        for part in alternative.split("."):
+            if not isinstance(value, dict):
+                value = _MISSING
+                break
+            value = value.get(part, _MISSING)
+        if value is not _MISSING and value not in (None, ""):
+            return value
+    return _MISSING
+
+
+def _key_fields_for(source: str, event_type: str) -> Optional[List[str]]:
+    configured = settings.IDEMPOTENCY_KEY_FIELDS.get(source, {})
+    defaults = DEFAULT_KEY_FIELDS.get(source, {})
+    # Del tipo exacto al más genérico: POLICY_INSERT, POLICY_*, *
+    candidates = [event_type]
+    if "_" in event_type:
+        candidates.append(event_type.split("_", 1)[0] + "_*")
+    candidates.append("*")
+    for table in (configured, defaults):
+        for candidate in candidates:
+            fields = table.get(candidate)
+            if fields is not None:
+                return fields
+    return None
+
+
+def key_field_paths(source: str) -> Set[str]:
+    """
+    Rutas de todos los campos que pueden formar la clave semántica de una fuente
+    
+    Los extractores registrados en código no se pueden inspeccionar; quien
+    los registre debe asegurarse de que sus campos se conservan al proyectar
+    payloads grandes.
+    
+    Args:
+        source: Fuente del evento (nowcerts, ghl)
+    
+    Returns:
+        Rutas con puntos (p. ej. "data.policyNumber")
+    """
+    paths: Set[str] = set()
+    for table in (settings.IDEMPOTENCY_KEY_FIELDS.get(source, {}), DEFAULT_KEY_FIELDS.get(source, {})):
+        for fields in table.values():
+            for path in fields:
+                if not path.startswith("="):
+                    paths.update(path.split("|"))
+    return paths
+
+
+def extract_semantic_key(payload: dict, source: str) -> Optional[List[Any]]:
+    """
+    Obtiene la clave semántica de un evento (tipo, ID de entidad, versión)
+    
+    Args:
+        payload: Payload del evento
+        source: Fuente del evento (nowcerts, ghl)
+    
+    Returns:
+        Valores que identifican el evento, o None si no se pueden extraer
+    """
+    event_type = _event_type_of(payload, source)
+    
+    extractor = _key_extractors.get((source, event_type)) or _key_extractors.get((source, "*"))
+    if extractor is not None:
+        values = extractor(payload)
+        return list(values) if values else None
+    
+    fields = _key_fields_for(source, event_type)
+    if not fields:
+        return None
+    
+    values = []
+    for path in fields:
+        value = _resolve_path(payload, path)
+        if value is _MISSING:
+            return None
+        values.append(value)
+    return values
 
 
 def generate_event_id(payload: dict, source: str) -> str:
     """
-    Genera un ID único para un evento basado en su contenido
+    Genera un ID único para un evento
+    
+    Usa la clave semántica del evento (tipo, ID de entidad y fecha de
+    modificación/versión) cuando está disponible, de modo que una reentrega
+    con otro timestamp o campos reordenados se detecta como duplicado.
+    Si no, usa el hash del payload completo.
     
     Args:
         payload: Payload del evento
@@ -24,13 +351,19 @@ def generate_event_id(payload: dict, source: str) -> str:
     Returns:
         ID único del evento
     """
-    # Crear un hash del payload y la fuente
-    event_data = {
-        "source": source,
-        "payload": payload
-    }
-    event_str = json.dumps(event_data, sort_keys=True)
-    event_hash = hashlib.sha256(event_str.encode()).hexdigest()
+    semantic_key = extract_semantic_key(payload, source)
+    if semantic_key is not None:
+        event_data = {
+            "source": source,
+            "key": semantic_key
+        }
+    else:
+        # Crear un hash del payload y la fuente
+        event_data = {
+            "source": source,
+            "payload": payload
+        }
+    event_hash = hashlib.sha256(canonical_dumps(event_data)).hexdigest()
     return f"{source}_{event_hash}"
 
 
@@ -44,20 +377,38 @@ def is_duplicate(event_id: str) -> bool:
     Returns:
         True si es duplicado, False si no
     """
-    if event_id in _event_cache:
-        # Verificar si el evento aún está en el período de validez
-        event_time = _event_cache[event_id]
-        expiry_time = event_time + timedelta(hours=CACHE_EXPIRY_HOURS)
-        if datetime.now() < expiry_time:
-            logger.warning(f"Evento duplicado detectado: {event_id}")
-            return True
-        else:
-            # El evento expiró, removerlo
-            del _event_cache[event_id]
+    if _store.contains(_store.key_for(event_id)):
+        logger.warning(f"Evento duplicado detectado: {event_id}")
+        return True
     
     return False
 
 
+# Eventos en proceso: ID → (fuente, tarea que lo procesa). Los que fallan
+# no se marcan; se descartan cuando su tarea ya terminó
+_in_flight: Dict[str, Tuple[str, asyncio.Task]] = {}
+
+
+def begin_processing(event_id: str, source: str):
+    """
+    Anota que la tarea actual empieza a procesar un evento (ver save_pending)
+    
+    Args:
+        event_id: ID del evento
+        source: Fuente del evento (nowcerts, ghl)
+    """
+    for stale in [key for key, (_, task) in _in_flight.items() if task.done()]:
+        del _in_flight[stale]
+    task = asyncio.current_task()
+    if task is not None:
+        _in_flight[event_id] = (source, task)
+
+
+def in_flight_events() -> Dict[str, str]:
+    """Eventos que se están procesando ahora: ID → fuente"""
+    return {event_id: source for event_id, (source, task) in _in_flight.items() if not task.done()}
+
+
 def mark_event_processed(event_id: str):
     """
     Marca un evento como procesado
@@ -65,19 +416,125 @@ def mark_event_processed(event_id: str):
     Args:
         event_id: ID del evento
     """
-    _event_cache[event_id] = datetime.now()
+    _in_flight.pop(event_id, None)
+    _store.add(_store.key_for(event_id))
     logger.debug(f"Evento marcado como procesado: {event_id}")
 
 
 def cleanup_expired_events():
-    """Limpia eventos expirados del cache"""
-    now = datetime.now()
-    expired_keys = [
-        key for key, timestamp in _event_cache.items()
-        if now - timestamp > timedelta(hours=CACHE_EXPIRY_HOURS)
-    ]
-    for key in expired_keys:
-        del _event_cache[key]
-    if expired_keys:
-        logger.debug(f"Limpiados {len(expired_keys)} eventos expirados")
+    """Limpia eventos expirados del cache (también se hace al consultar)"""
+    expired = _store.expire()
+    if expired:
+        logger.debug(f"Limpiados {expired} eventos expirados")
+
+
+def get_cache_stats() -> Dict[str, Any]:
+    """Estadísticas del cache de eventos procesados"""
+    return _store.stats()
+
+
+def save_state(path: Optional[str] = None) -> int:
+    """
+    Persiste los eventos procesados vigentes en disco (escritura atómica)
+    
+    Args:
+        path: Ruta del archivo (default: settings.IDEMPOTENCY_STATE_FILE)
+    
+    Returns:
+        Número de eventos guardados
+    """
+    path = path or settings.IDEMPOTENCY_STATE_FILE
+    if not path:
+        return 0
+    
+    cleanup_expired_events()
+    
+    chunks = [_STATE_MAGIC]
+    for bucket, keys in _store.items():
+        chunks.append(_BUCKET_HEADER.pack(bucket, len(keys)))
+        chunks.append(b"".join(keys))
+    atomic_write_bytes(path, b"".join(chunks))
+    
+    logger.info(f"Guardados {len(_store)} eventos procesados en {path}")
+    return len(_store)
+
+
+def pending_state_path(path: Optional[str] = None) -> Optional[str]:
+    """Archivo de eventos sin terminar al cerrar (junto al estado de idempotencia)"""
+    path = path or settings.IDEMPOTENCY_STATE_FILE
+    return f"{path}.pending.json" if path else None
+
+
+def save_pending(path: Optional[str] = None) -> int:
+    """
+    Guarda los eventos que siguen en proceso al agotarse el periodo de gracia
+    
+    No quedan marcados como procesados, así que su reentrega se aceptará;
+    si el remitente no reintenta, el archivo de payloads permite
+    reprocesarlos (python -m app.services.payload_replay --event-id ...).
+    
+    Args:
+        path: Ruta del estado de idempotencia (default: settings.IDEMPOTENCY_STATE_FILE)
+    
+    Returns:
+        Número de eventos guardados
+    """
+    pending = in_flight_events()
+    pending_path = pending_state_path(path)
+    if not pending or not pending_path:
+        return len(pending)
+    
+    atomic_write_json(pending_path, {
+        "saved_at": time.time(),
+        "events": [{"event_id": event_id, "source": source} for event_id, source in pending.items()]
+    })
+    logger.warning(
+        f"{len(pending)} eventos sin terminar guardados en {pending_path}; "
+        "reprocesarlos con python -m app.services.payload_replay --event-id <id>"
+    )
+    return len(pending)
+
 
+def load_state(path: Optional[str] = None) -> int:
+    """
+    Carga en el cache los eventos procesados guardados por save_state
+    
+    Args:
+        path: Ruta del archivo (default: settings.IDEMPOTENCY_STATE_FILE)
+    
+    Returns:
+        Número de eventos cargados (sin contar los expirados)
+    """
+    path = path or settings.IDEMPOTENCY_STATE_FILE
+    if not path or not os.path.exists(path):
+        return 0
+    
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError as e:
+        logger.warning(f"No se pudo cargar el estado de idempotencia de {path}: {str(e)}")
+        return 0
+    
+    if not data.startswith(_STATE_MAGIC):
+        logger.warning(f"Formato de estado de idempotencia no reconocido en {path}; se ignora")
+        return 0
+    
+    before = len(_store)
+    offset = len(_STATE_MAGIC)
+    try:
+        while offset < len(data):
+            bucket, count = _BUCKET_HEADER.unpack_from(data, offset)
+            offset += _BUCKET_HEADER.size
+            for i in range(count):
+                start = offset + i * KEY_BYTES
+                _store.add(data[start:start + KEY_BYTES], bucket=bucket)
+            offset += count * KEY_BYTES
+    except struct.error:
+        logger.warning(f"Estado de idempotencia truncado en {path}; se cargó parcialmente")
+    
+    # Descartar lo que ya expiró mientras el proceso estaba detenido
+    _store.expire()
+    loaded = len(_store) - before
+    logger.info(f"Cargados {loaded} eventos procesados desde {path}")
+    return loaded
@@ -0,0 +1,85 @@
+"""
+Codificación/decodificación JSON (orjson si está instalado, si no la stdlib)
+
+Las funciones producen la misma salida con ambos motores:
+- dumps: JSON compacto en UTF-8, como el JSONResponse de FastAPI (la única
+  diferencia son los floats en notación exponencial: 1e-07 frente a 1e-7)
+- loads: mismos valores (orjson convierte a float los enteros de más de
+  64 bits, que no aparecen en las APIs de NowCerts ni de GHL)
+- canonical_dumps: forma canónica de la idempotencia, idéntica byte a byte a
+  json.dumps(sort_keys=True, default=str) salvo que se active
+  IDEMPOTENCY_CANONICAL_JSON="fast"
+"""
+import json
+from typing import Any, Type
+from fastapi.responses import JSONResponse, ORJSONResponse
+from app.core.config import settings
+
+try:
+    import orjson
+except ImportError:  # Dependencia opcional: sin ella se usa la stdlib
+    orjson = None
+
+USE_ORJSON = orjson is not None and settings.JSON_USE_ORJSON
+
+# Valores que orjson no serializa (enteros de más de 64 bits, claves no
+# str); en esos casos se recurre a la stdlib
+_ORJSON_ERRORS = (TypeError, ValueError) if orjson is None else (orjson.JSONEncodeError,)
+
+
+def dumps(obj: Any) -> bytes:
+    """
+    Serializa a JSON compacto en UTF-8
+    
+    Args:
+        obj: Objeto serializable
+    
+    Returns:
+        JSON en bytes
+    """
+    if USE_ORJSON:
+        try:
+            return orjson.dumps(obj)
+        except _ORJSON_ERRORS:
+            pass
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data: Any) -> Any:
+    """
+    Deserializa JSON desde bytes o str
+    
+    Raises:
+        ValueError: Si el JSON no es válido
+    """
+    if USE_ORJSON:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # La stdlib acepta NaN/Infinity, que orjson rechaza, y da el
+            # mismo mensaje de error que antes para JSON inválido
+            pass
+    return json.loads(data)
+
+
+def canonical_dumps(obj: Any) -> bytes:
+    """
+    Forma canónica (claves ordenadas) usada para los IDs de eventos
+    
+    Por defecto es idéntica a la de versiones anteriores para que los IDs
+    persistidos sigan siendo válidos. Con IDEMPOTENCY_CANONICAL_JSON="fast"
+    usa orjson: más rápida, pero con otros bytes (compacta y en UTF-8), por
+    lo que los eventos ya procesados no se reconocen durante una ventana de
+    expiración tras el cambio.
+    """
+    if USE_ORJSON and settings.IDEMPOTENCY_CANONICAL_JSON == "fast":
+        try:
+            return orjson.dumps(obj, default=str, option=orjson.OPT_SORT_KEYS)
+        except _ORJSON_ERRORS:
+            pass
+    return json.dumps(obj, sort_keys=True, default=str).encode()
+
+
+def response_class() -> Type[JSONResponse]:
+    """Clase de respuesta por defecto de FastAPI (misma salida que JSONResponse)"""
+    return ORJSONResponse if USE_ORJSON else JSONResponse
@@ -3,16 +3,41 @@ Sistema de logging centralizado
 """
 import logging
 import sys
+from contextvars import ContextVar, Token
 from pathlib import Path
+from typing import Optional
 from app.core.config import settings
 
+# ID de la traza activa (lo fija app.core.tracing al abrir una traza)
+_trace_id: ContextVar[Optional[str]] = ContextVar("trace_id", default=None)
+
+
+def set_trace_id(trace_id: Optional[str]) -> Token:
+    """Fija el ID de traza que se añade a los logs del contexto actual"""
+    return _trace_id.set(trace_id)
+
+
+def reset_trace_id(token: Token):
+    """Restaura el ID de traza anterior"""
+    _trace_id.reset(token)
+
+
+class TraceIdFilter(logging.Filter):
+    """Añade `trace_id` a cada registro para correlacionar logs y trazas"""
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = _trace_id.get() or "-"
+        return True
+
+
 # Configurar logger
 logger = logging.getLogger(settings.APP_NAME)
 logger.setLevel(getattr(logging, settings.LOG_LEVEL.upper(), logging.INFO))
+logger.addFilter(TraceIdFilter())
 
 # Formato de logs
 formatter = logging.Formatter(
-    '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    '%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] - %(message)s',
     datefmt='%Y-%m-%d %H:%M:%S'
 )
 
@@ -31,11 +56,18 @@ if settings.LOG_FILE:
 
 
 def log_payload(event_type: str, payload: dict, direction: str = "incoming"):
-    """Registra un payload para debugging"""
-    logger.info(f"[{direction.upper()}] {event_type} - Payload: {payload}")
+    """
+    Registra un payload para debugging (solo con LOG_LEVEL=DEBUG)
+    
+    El registro duradero de los payloads es app.core.payload_archive; aquí
+    no se formatea nada si el nivel DEBUG no está activo.
+    """
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"[{direction.upper()}] {event_type} - Payload: {payload}")
 
 
 def log_response(event_type: str, response: dict, direction: str = "outgoing"):
-    """Registra una respuesta para debugging"""
-    logger.info(f"[{direction.upper()}] {event_type} - Response: {response}")
+    """Registra una respuesta para debugging (solo con LOG_LEVEL=DEBUG)"""
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"[{direction.upper()}] {event_type} - Response: {response}")
 
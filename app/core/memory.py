@@ -0,0 +1,314 @@
+"""
+Contabilidad de memoria del proceso
+Cada cache y cola en memoria se registra con una función que devuelve sus
+entradas y su tamaño aproximado; un muestreo periódico guarda la evolución
+para ver en minutos qué componente crece. Las capturas de tracemalloc
+muestran los puntos del código que más memoria asignan
+"""
+import asyncio
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from collections import deque
+from itertools import islice
+from typing import Optional, Dict, Any, Callable, Deque, Tuple
+from app.core.config import settings
+from app.core.logger import logger
+
+try:
+    import resource
+except ImportError:  # Dependencia opcional: no existe en Windows (sin pico de RSS)
+    resource = None
+
+# Elementos que se miden de cada contenedor; el resto se extrapola
+_SIZE_SAMPLE = 64
+
+# Profundidad máxima al medir estructuras anidadas
+_SIZE_MAX_DEPTH = 6
+
+_LEAF_TYPES = (str, bytes, bytearray, int, float, bool, type(None))
+
+_CONTAINER_TYPES = (dict, list, tuple, set, frozenset, deque)
+
+
+def deep_sizeof(obj: Any, _seen: Optional[set] = None, _depth: int = 0) -> int:
+    """
+    Tamaño aproximado en bytes de un objeto y lo que contiene
+    
+    Recorre diccionarios, listas, tuplas, conjuntos, colas y objetos de la
+    propia aplicación (atributos o __slots__). En contenedores grandes se
+    miden los primeros elementos y se extrapola, de modo que el coste no
+    depende del número de entradas. Los objetos de librerías (tareas,
+    locks, clientes) cuentan solo su tamaño propio: seguir sus referencias
+    acabaría midiendo el event loop entero.
+    
+    Args:
+        obj: Objeto a medir
+    
+    Returns:
+        Bytes aproximados
+    """
+    seen = _seen if _seen is not None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj, 0)
+    if isinstance(obj, _LEAF_TYPES) or _depth >= _SIZE_MAX_DEPTH:
+        return size
+    
+    if isinstance(obj, dict):
+        items = obj.items()
+    elif isinstance(obj, _CONTAINER_TYPES):
+        items = obj
+    elif type(obj).__module__.startswith("app."):
+        if hasattr(obj, "__dict__"):
+            return size + deep_sizeof(vars(obj), seen, _depth + 1)
+        slots = getattr(type(obj), "__slots__", ())
+        return size + sum(
+            deep_sizeof(getattr(obj, name), seen, _depth + 1) for name in slots if hasattr(obj, name)
+        )
+    else:
+        return size
+    
+    total = len(obj)
+    measured = 0
+    sampled = 0
+    for item in islice(items, _SIZE_SAMPLE):
+        if isinstance(obj, dict):
+            measured += deep_sizeof(item[0], seen, _depth + 1) + deep_sizeof(item[1], seen, _depth + 1)
+        else:
+            measured += deep_sizeof(item, seen, _depth + 1)
+        sampled += 1
+    if sampled and total > sampled:
+        measured = measured * total // sampled
+    return size + measured
+
+
+def container_usage(container: Any, max_entries: Optional[int] = None) -> Dict[str, Any]:
+    """Entradas y bytes aproximados de un contenedor (dict, set, deque...)"""
+    usage = {"entries": len(container), "approx_bytes": deep_sizeof(container)}
+    if max_entries is not None:
+        usage["max_entries"] = max_entries
+    return usage
+
+
+def queue_usage(queue: Optional[asyncio.Queue]) -> Dict[str, Any]:
+    """Entradas y bytes aproximados de una asyncio.Queue (vacía si aún no se creó)"""
+    if queue is None:
+        return {"entries": 0, "approx_bytes": 0}
+    # asyncio.Queue guarda los elementos en un deque interno
+    usage = container_usage(queue._queue)
+    if queue.maxsize:
+        usage["max_entries"] = queue.maxsize
+    return usage
+
+
+def process_memory() -> Dict[str, Any]:
+    """RSS actual y pico del proceso (None si el sistema no lo expone)"""
+    rss = None
+    try:
+        with open("/proc/self/statm", "r") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    
+    peak = None
+    if resource is not None:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux lo da en KiB y macOS en bytes
+        peak = max_rss if sys.platform == "darwin" else max_rss * 1024
+    
+    return {"rss_bytes": rss, "peak_rss_bytes": peak}
+
+
+class MemoryRegistry:
+    """
+    Registro de caches y colas en memoria con muestreo periódico
+    
+    Cada módulo registra sus estructuras junto a su instancia global. Cada
+    MEMORY_SAMPLE_INTERVAL_SECONDS se guarda una muestra (RSS y tamaño de
+    cada componente) y se conservan las últimas MEMORY_SAMPLE_HISTORY, con
+    las que se calcula el crecimiento por minuto.
+    """
+    
+    def __init__(self, interval: Optional[float] = None, history: Optional[int] = None):
+        self.interval = interval or settings.MEMORY_SAMPLE_INTERVAL_SECONDS
+        self._probes: Dict[str, Tuple[str, Callable[[], Dict[str, Any]]]] = {}
+        self._samples: Deque[Dict[str, Any]] = deque(maxlen=history or settings.MEMORY_SAMPLE_HISTORY)
+        self._task: Optional[asyncio.Task] = None
+    
+    def register(self, name: str, kind: str, usage: Callable[[], Dict[str, Any]]):
+        """
+        Registra una estructura en memoria
+        
+        Args:
+            name: Nombre del componente (p. ej. "idempotency.events")
+            kind: cache o queue
+            usage: Devuelve entries, approx_bytes y opcionalmente max_entries
+        """
+        self._probes[name] = (kind, usage)
+    
+    def measure(self) -> Dict[str, Dict[str, Any]]:
+        """Uso actual de cada componente registrado"""
+        components = {}
+        for name, (kind, usage) in self._probes.items():
+            try:
+                components[name] = {"kind": kind, **usage()}
+            except Exception as e:
+                components[name] = {"kind": kind, "error": str(e)}
+        return components
+    
+    def sample(self):
+        """Toma una muestra (RSS y tamaño de cada componente) y la añade al historial"""
+        self._samples.append({
+            "at": time.time(),
+            "rss_bytes": process_memory()["rss_bytes"],
+            "components": {
+                name: (usage.get("entries"), usage.get("approx_bytes"))
+                for name, usage in self.measure().items() if "error" not in usage
+            }
+        })
+    
+    def report(self) -> Dict[str, Any]:
+        """
+        Uso actual de memoria y crecimiento por minuto
+        
+        Mide ahora y compara con la muestra más antigua del historial (sin
+        añadir una muestra, para no acortar la ventana).
+        
+        Returns:
+            process (RSS, objetos vigilados por el gc, tracemalloc), components
+            de mayor a menor tamaño y crecimiento de cada uno
+        """
+        measured = self.measure()
+        process = process_memory()
+        oldest = self._samples[0] if self._samples else {"at": time.time(), "rss_bytes": None, "components": {}}
+        minutes = (time.time() - oldest["at"]) / 60
+        
+        def per_minute(current: Optional[int], previous: Optional[int]) -> Optional[float]:
+            # Con menos de un intervalo de historial el ritmo no es fiable
+            if minutes * 60 < self.interval or current is None or previous is None:
+                return None
+            return round((current - previous) / minutes, 1)
+        
+        components = []
+        for name, usage in measured.items():
+            previous = oldest["components"].get(name, (None, None))
+            if "error" not in usage:
+                usage["growth_per_minute"] = {
+                    "entries": per_minute(usage.get("entries"), previous[0]),
+                    "bytes": per_minute(usage.get("approx_bytes"), previous[1])
+                }
+            components.append({"name": name, **usage})
+        components.sort(key=lambda item: item.get("approx_bytes") or 0, reverse=True)
+        
+        process["rss_growth_bytes_per_minute"] = per_minute(process["rss_bytes"], oldest["rss_bytes"])
+        process["gc_tracked_objects"] = len(gc.get_objects())
+        process["tracemalloc"] = (
+            dict(zip(("current_bytes", "peak_bytes"), tracemalloc.get_traced_memory()))
+            if tracemalloc.is_tracing() else None
+        )
+        return {
+            "process": process,
+            "components": components,
+            "components_approx_bytes": sum(item.get("approx_bytes") or 0 for item in components),
+            "window_seconds": round(minutes * 60, 1),
+            "samples": len(self._samples)
+        }
+    
+    def start(self):
+        """Arranca el muestreo en segundo plano"""
+        if self._task is not None and not self._task.done():
+            return
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Detiene el muestreo"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+    
+    async def _run(self):
+        while True:
+            try:
+                self.sample()
+            except Exception as e:
+                logger.warning(f"Error muestreando el uso de memoria: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+
+def _filter_snapshot(snapshot: tracemalloc.Snapshot) -> tracemalloc.Snapshot:
+    return snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        tracemalloc.Filter(False, "<unknown>")
+    ))
+
+
+async def trace_allocations(
+    seconds: float,
+    limit: int = 25,
+    group_by: str = "lineno",
+    frames: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    Diferencia entre dos capturas de tracemalloc separadas `seconds` segundos
+    
+    Si tracemalloc no estaba activo se activa solo durante la captura (con
+    `frames` marcos por asignación); mientras está activo el proceso va más
+    lento y usa más memoria.
+    
+    Args:
+        seconds: Tiempo entre las dos capturas
+        limit: Número de puntos de asignación a devolver
+        group_by: lineno, filename o traceback
+        frames: Marcos guardados por asignación (por defecto MEMORY_TRACE_FRAMES)
+    
+    Returns:
+        Puntos de asignación ordenados por crecimiento (size_diff)
+    """
+    started_here = not tracemalloc.is_tracing()
+    if started_here:
+        tracemalloc.start(frames or settings.MEMORY_TRACE_FRAMES)
+    try:
+        before = tracemalloc.take_snapshot()
+        await asyncio.sleep(seconds)
+        after = tracemalloc.take_snapshot()
+        traced_bytes, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        if started_here:
+            tracemalloc.stop()
+    
+    # Filtrar y comparar recorre todas las asignaciones: fuera del event loop
+    stats = await asyncio.to_thread(
+        lambda: _filter_snapshot(after).compare_to(_filter_snapshot(before), group_by)
+    )
+    return {
+        "seconds": seconds,
+        "group_by": group_by,
+        "traced_bytes": traced_bytes,
+        "traced_peak_bytes": peak_bytes,
+        "size_diff_total": sum(stat.size_diff for stat in stats),
+        "top": [
+            {
+                "size_diff": stat.size_diff,
+                "size": stat.size,
+                "count_diff": stat.count_diff,
+                "count": stat.count,
+                "traceback": [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback]
+            }
+            for stat in stats[:limit]
+        ]
+    }
+
+
+# Instancia global del registro de memoria
+memory_registry = MemoryRegistry()
@@ -0,0 +1,340 @@
+"""
+Archivo comprimido de payloads recibidos (solo anexado) e índice por evento
+"""
+import asyncio
+import json
+import os
+import struct
+import time
+import zlib
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Iterator, Iterable, Tuple
+from app.core.config import settings
+from app.core.logger import logger
+from app.core.memory import memory_registry, queue_usage
+
+SEGMENT_SUFFIX = ".seg"
+INDEX_SUFFIX = ".idx"
+
+# Cada bloque: longitud comprimida (4 bytes, big-endian) + bloque zlib
+_BLOCK_HEADER = struct.Struct(">I")
+
+# Un registro es una línea JSON de cabecera y los `size` bytes del body
+ArchivedRecord = Dict[str, Any]
+
+# El índice guarda solo el final del ID de cada evento (hex de su hash): una
+# coincidencia casual solo obliga a descomprimir un bloque de más, porque el
+# ID completo se comprueba en el registro
+_SHORT_ID_CHARS = 16
+
+
+def _short_id(event_id: str) -> str:
+    return event_id[-_SHORT_ID_CHARS:]
+
+
+def _encode_record(source: str, event_id: str, received_at: float, body: bytes, raw: bool) -> bytes:
+    header = json.dumps({
+        "source": source,
+        "event_id": event_id,
+        "received_at": received_at,
+        "raw": raw,
+        "size": len(body)
+    }, separators=(",", ":")).encode()
+    return header + b"\n" + body
+
+
+def _decode_block(data: bytes) -> Iterator[ArchivedRecord]:
+    offset = 0
+    while offset < len(data):
+        end = data.index(b"\n", offset)
+        record = json.loads(data[offset:end])
+        body_start = end + 1
+        record["body"] = data[body_start:body_start + record["size"]]
+        offset = body_start + record["size"]
+        yield record
+
+
+class PayloadArchive:
+    """
+    Escritor de payloads a segmentos comprimidos que rotan por tamaño
+    
+    append() solo encola (nunca bloquea la petición). Una tarea en segundo
+    plano agrupa los registros en bloques de PAYLOAD_ARCHIVE_BLOCK_RECORDS,
+    los comprime con zlib (los payloads JSON de un bloque se comprimen juntos,
+    mucho mejor que uno a uno) y los anexa al segmento actual desde un hilo
+    aparte. Junto a cada segmento se escribe un índice JSON Lines con una
+    línea por bloque: offset, rango de tiempo, fuentes e IDs de sus eventos.
+    
+    Si la cola se llena, los payloads se descartan y se cuentan.
+    """
+    
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        segment_bytes: Optional[int] = None,
+        block_records: Optional[int] = None,
+        flush_seconds: Optional[float] = None,
+        max_queue: Optional[int] = None,
+        retention_days: Optional[float] = None
+    ):
+        self.directory = directory if directory is not None else settings.PAYLOAD_ARCHIVE_DIR
+        self.segment_bytes = segment_bytes or settings.PAYLOAD_ARCHIVE_SEGMENT_BYTES
+        self.block_records = block_records or settings.PAYLOAD_ARCHIVE_BLOCK_RECORDS
+        self.flush_seconds = flush_seconds or settings.PAYLOAD_ARCHIVE_FLUSH_SECONDS
+        self.max_queue = max_queue or settings.PAYLOAD_ARCHIVE_MAX_QUEUE
+        self.retention_days = (
+            retention_days if retention_days is not None else settings.PAYLOAD_ARCHIVE_RETENTION_DAYS
+        )
+        self.archived = 0
+        self.dropped = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._segment: Optional[Path] = None
+        self._segment_size = 0
+    
+    @property
+    def enabled(self) -> bool:
+        return self._task is not None and not self._task.done()
+    
+    def start(self):
+        """Arranca la tarea de escritura (no hace nada si no hay directorio configurado)"""
+        if not self.directory or self.enabled:
+            return
+        Path(self.directory).mkdir(parents=True, exist_ok=True)
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Archivando payloads en {self.directory}")
+    
+    def append(self, source: str, event_id: str, body: bytes, raw: bool = True):
+        """
+        Encola un payload para archivarlo
+        
+        Args:
+            source: nowcerts o ghl
+            event_id: ID del evento (clave del índice)
+            body: Body tal como se recibió
+            raw: False si el body se reconstruyó (payload proyectado o sondeo)
+        """
+        if not self.enabled:
+            return
+        try:
+            self._queue.put_nowait(_encode_record(source, event_id, time.time(), body, raw))
+        except asyncio.QueueFull:
+            self.dropped += 1
+    
+    async def _run(self):
+        while True:
+            batch: List[bytes] = [await self._queue.get()]
+            deadline = time.monotonic() + self.flush_seconds
+            while len(batch) < self.block_records:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await asyncio.to_thread(self._write_block, batch)
+                self.archived += len(batch)
+            except Exception as e:
+                self.dropped += len(batch)
+                logger.warning(f"Error archivando {len(batch)} payloads: {str(e)}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+    
+    def _new_segment(self) -> Path:
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+        return Path(self.directory) / f"payloads-{stamp}-{os.getpid()}{SEGMENT_SUFFIX}"
+    
+    def _write_block(self, records: List[bytes]):
+        if self._segment is None or self._segment_size >= self.segment_bytes:
+            self._segment = self._new_segment()
+            self._segment_size = 0
+            self._expire_segments()
+        
+        raw = b"".join(records)
+        compressed = zlib.compress(raw, 6)
+        with open(self._segment, "ab") as f:
+            offset = f.tell()
+            f.write(_BLOCK_HEADER.pack(len(compressed)) + compressed)
+        self._segment_size = offset + _BLOCK_HEADER.size + len(compressed)
+        self.bytes_in += len(raw)
+        self.bytes_out += _BLOCK_HEADER.size + len(compressed)
+        
+        # El índice se escribe después del bloque: una entrada del índice
+        # siempre apunta a un bloque completo
+        headers = [json.loads(record[:record.index(b"\n")]) for record in records]
+        entry = json.dumps({
+            "offset": offset,
+            "first": min(header["received_at"] for header in headers),
+            "last": max(header["received_at"] for header in headers),
+            "sources": sorted({header["source"] for header in headers}),
+            "ids": [_short_id(header["event_id"]) for header in headers]
+        }, separators=(",", ":"))
+        with open(self._segment.with_suffix(INDEX_SUFFIX), "a", encoding="utf-8") as f:
+            f.write(entry + "\n")
+    
+    def _expire_segments(self):
+        if not self.retention_days:
+            return
+        cutoff = time.time() - self.retention_days * 86400
+        for segment in Path(self.directory).glob(f"payloads-*{SEGMENT_SUFFIX}"):
+            try:
+                if segment.stat().st_mtime < cutoff:
+                    segment.unlink()
+                    segment.with_suffix(INDEX_SUFFIX).unlink(missing_ok=True)
+            except OSError as e:
+                logger.warning(f"No se pudo borrar el segmento {segment.name}: {str(e)}")
+    
+    async def stop(self, timeout: float = 5.0):
+        """
+        Escribe los payloads pendientes y detiene el archivado
+        
+        Args:
+            timeout: Tiempo máximo para vaciar la cola
+        """
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Archivado cortado con {self._queue.qsize()} payloads pendientes")
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+    
+    def stats(self) -> Dict[str, Any]:
+        """Estado del archivado y ratio de compresión"""
+        return {
+            "enabled": self.enabled,
+            "directory": self.directory,
+            "segment": self._segment.name if self._segment else None,
+            "queued": self._queue.qsize() if self.enabled else 0,
+            "archived": self.archived,
+            "dropped": self.dropped,
+            "compression_ratio": round(self.bytes_in / self.bytes_out, 2) if self.bytes_out else None
+        }
+
+
+def _read_index(index_path: Path) -> List[Dict[str, Any]]:
+    entries = []
+    with open(index_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                entries.append(json.loads(line))
+    return entries
+
+
+def list_segments(directory: str) -> List[Tuple[Path, float, float, int]]:
+    """
+    Segmentos de un directorio con su rango de tiempo
+    
+    Returns:
+        (segmento, primer received_at, último received_at, registros), por orden de nombre
+    """
+    segments = []
+    for segment in sorted(Path(directory).glob(f"payloads-*{SEGMENT_SUFFIX}")):
+        index_path = segment.with_suffix(INDEX_SUFFIX)
+        if not index_path.exists():
+            continue
+        blocks = _read_index(index_path)
+        if blocks:
+            segments.append((
+                segment,
+                min(block["first"] for block in blocks),
+                max(block["last"] for block in blocks),
+                sum(len(block["ids"]) for block in blocks)
+            ))
+    return segments
+
+
+def _read_block(f, offset: int) -> Optional[bytes]:
+    f.seek(offset)
+    header = f.read(_BLOCK_HEADER.size)
+    if len(header) < _BLOCK_HEADER.size:
+        return None
+    (length,) = _BLOCK_HEADER.unpack(header)
+    compressed = f.read(length)
+    if len(compressed) < length:
+        # Bloque cortado (cierre a mitad de escritura): se ignora
+        return None
+    return zlib.decompress(compressed)
+
+
+def iter_records(
+    directory: str,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    event_ids: Optional[Iterable[str]] = None,
+    sources: Optional[Iterable[str]] = None,
+    segments: Optional[Iterable[str]] = None
+) -> Iterator[ArchivedRecord]:
+    """
+    Lee registros archivados en orden de llegada
+    
+    Usa los índices para saltar segmentos fuera del rango de tiempo y para
+    descomprimir solo los bloques que contienen los eventos pedidos.
+    
+    Args:
+        directory: Directorio del archivo
+        since: Desde esta hora (epoch, incluida)
+        until: Hasta esta hora (epoch, excluida)
+        event_ids: Solo estos eventos
+        sources: Solo estas fuentes (nowcerts, ghl)
+        segments: Solo estos segmentos (nombre de archivo)
+    
+    Yields:
+        Registros con source, event_id, received_at, raw y body (bytes)
+    """
+    wanted_ids = set(event_ids) if event_ids is not None else None
+    wanted_short = {_short_id(event_id) for event_id in wanted_ids} if wanted_ids is not None else None
+    wanted_sources = set(sources) if sources is not None else None
+    wanted_segments = set(segments) if segments is not None else None
+    
+    def _block_matches(block: Dict[str, Any]) -> bool:
+        return (
+            (since is None or block["last"] >= since)
+            and (until is None or block["first"] < until)
+            and (wanted_sources is None or not wanted_sources.isdisjoint(block["sources"]))
+            and (wanted_short is None or not wanted_short.isdisjoint(block["ids"]))
+        )
+    
+    def _matches(record: ArchivedRecord) -> bool:
+        return (
+            (since is None or record["received_at"] >= since)
+            and (until is None or record["received_at"] < until)
+            and (wanted_ids is None or record["event_id"] in wanted_ids)
+            and (wanted_sources is None or record["source"] in wanted_sources)
+        )
+    
+    for segment, first, last, _ in list_segments(directory):
+        if wanted_segments is not None and segment.name not in wanted_segments:
+            continue
+        if (since is not None and last < since) or (until is not None and first >= until):
+            continue
+        offsets = [
+            block["offset"] for block in _read_index(segment.with_suffix(INDEX_SUFFIX))
+            if _block_matches(block)
+        ]
+        with open(segment, "rb") as f:
+            for offset in offsets:
+                block = _read_block(f, offset)
+                if block is None:
+                    break
+                for record in _decode_block(block):
+                    if _matches(record):
+                        yield record
+
+
+# Instancia global del archivo de payloads
+payload_archive = PayloadArchive()
+memory_registry.register("payload_archive.queue", "queue", lambda: queue_usage(payload_archive._queue))
@@ -0,0 +1,122 @@
+"""
+Carriles de prioridad para las llamadas a servicios externos
+Los webhooks (tiempo real) pasan por delante de la sincronización manual y
+esta por delante de los sondeos y cargas masivas
+"""
+import asyncio
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, Dict, Any, Deque, Iterator, Tuple
+from app.core.config import settings
+
+REALTIME = "realtime"
+MANUAL = "manual"
+BULK = "bulk"
+
+# De mayor a menor prioridad
+LANES: Tuple[str, ...] = (REALTIME, MANUAL, BULK)
+
+# Carril de la tarea actual; lo que no declara carril (webhooks, sondas de
+# readiness) cuenta como tiempo real
+_current_lane: ContextVar[str] = ContextVar("lane", default=REALTIME)
+
+
+def current_lane() -> str:
+    """Carril de la tarea actual"""
+    return _current_lane.get()
+
+
+@contextmanager
+def lane(name: str) -> Iterator[None]:
+    """
+    Ejecuta el bloque en un carril de prioridad
+    
+    Las tareas creadas dentro del bloque heredan el carril.
+    
+    Args:
+        name: realtime, manual o bulk
+    """
+    if name not in LANES:
+        raise ValueError(f"Carril desconocido: {name}")
+    token = _current_lane.set(name)
+    try:
+        yield
+    finally:
+        _current_lane.reset(token)
+
+
+def highest_lane(*names: str) -> str:
+    """Carril de mayor prioridad entre los indicados"""
+    return min(names, key=LANES.index) if names else REALTIME
+
+
+class LaneQueue:
+    """
+    Cola de espera con un carril por prioridad y reparto ponderado
+    
+    Cuando hay esperas en varios carriles, cada hueco se cede por turno
+    ponderado suave (UPSTREAM_LANE_WEIGHTS): con pesos 8/3/1 y los tres
+    carriles llenos, de cada 12 huecos 8 van a tiempo real, 3 a manual y 1
+    a masivo, intercalados. Un carril con peso nunca se queda sin servicio,
+    y un carril vacío no consume turnos.
+    """
+    
+    def __init__(self, weights: Optional[Dict[str, int]] = None):
+        configured = weights if weights is not None else settings.UPSTREAM_LANE_WEIGHTS
+        self.weights = {name: max(1, int(configured.get(name, 1))) for name in LANES}
+        self._waiters: Dict[str, Deque[asyncio.Future]] = {name: deque() for name in LANES}
+        self._credit = {name: 0 for name in LANES}
+    
+    def __len__(self) -> int:
+        return sum(len(waiters) for waiters in self._waiters.values())
+    
+    def __bool__(self) -> bool:
+        return any(self._waiters.values())
+    
+    def append(self, name: str, future: asyncio.Future):
+        """Añade una espera al final de su carril"""
+        self._waiters[name].append(future)
+    
+    def remove(self, name: str, future: asyncio.Future):
+        """Quita una espera (ValueError si ya no estaba)"""
+        self._waiters[name].remove(future)
+    
+    def queued(self, name: str) -> int:
+        """Esperas en un carril"""
+        return len(self._waiters[name])
+    
+    def pop(self, eligible=None) -> Optional[Tuple[str, asyncio.Future]]:
+        """
+        Saca la siguiente espera según el reparto ponderado
+        
+        Args:
+            eligible: Función opcional carril → bool para excluir carriles
+                (p. ej. el masivo cuando ya ocupa su cupo)
+        
+        Returns:
+            (carril, futuro) o None si no hay esperas elegibles
+        """
+        active = [
+            name for name in LANES
+            if self._waiters[name] and (eligible is None or eligible(name))
+        ]
+        if not active:
+            return None
+        
+        # Round-robin ponderado suave: cada carril acumula su peso y el que
+        # más crédito tiene cede el turno restando el total
+        total = 0
+        for name in LANES:
+            if name not in active:
+                self._credit[name] = 0
+        for name in active:
+            self._credit[name] += self.weights[name]
+            total += self.weights[name]
+        chosen = max(active, key=lambda name: (self._credit[name], -LANES.index(name)))
+        self._credit[chosen] -= total
+        return chosen, self._waiters[chosen].popleft()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Esperas por carril"""
+        return {name: len(waiters) for name, waiters in self._waiters.items()}
@@ -0,0 +1,195 @@
+"""
+Límite de tamaño de las peticiones y parseo incremental de bodies JSON grandes
+"""
+import json
+from typing import Optional, Dict, Any, Iterable, AsyncIterator
+from fastapi import Request
+from app.core.config import settings
+from app.core.exceptions import PayloadTooLargeError
+from app.core.json_codec import loads
+from app.core.logger import logger
+
+try:
+    import ijson
+except ImportError:  # Dependencia opcional: sin ella se parsea el body completo
+    ijson = None
+
+
+class BodySizeLimitMiddleware:
+    """
+    Middleware ASGI que rechaza con 413 los bodies mayores que MAX_REQUEST_BODY_BYTES
+    
+    Con Content-Length se rechaza antes de leer nada; sin él (chunked) se
+    cuentan los bytes a medida que se leen y se corta al superar el límite.
+    """
+    
+    def __init__(self, app, max_bytes: Optional[int] = None, path_prefix: Optional[str] = None):
+        self.app = app
+        self.max_bytes = max_bytes or settings.MAX_REQUEST_BODY_BYTES
+        self.path_prefix = path_prefix if path_prefix is not None else settings.API_V1_PREFIX
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+        
+        for name, value in scope.get("headers", []):
+            if name == b"content-length":
+                try:
+                    declared = int(value)
+                except ValueError:
+                    declared = 0
+                if declared > self.max_bytes:
+                    logger.warning(f"Petición rechazada: body de {declared} bytes en {scope['path']}")
+                    await self._reject(send)
+                    return
+                break
+        
+        received = 0
+        
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise PayloadTooLargeError()
+            return message
+        
+        await self.app(scope, limited_receive, send)
+    
+    async def _reject(self, send):
+        body = json.dumps({"detail": PayloadTooLargeError().detail}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode())
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def _set_path(target: Dict[str, Any], path: str, value: Any):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        target = target.setdefault(part, {})
+    target[parts[-1]] = value
+
+
+def project_fields(payload: Any, paths: Iterable[str]) -> Dict[str, Any]:
+    """
+    Copia de un payload con solo las rutas indicadas
+    
+    Args:
+        payload: Payload JSON ya parseado
+        paths: Rutas con puntos (p. ej. "data.email"); una ruta a un objeto
+            conserva el objeto completo
+    
+    Returns:
+        Diccionario anidado con los campos encontrados
+    """
+    result: Dict[str, Any] = {}
+    if not isinstance(payload, dict):
+        return result
+    for path in paths:
+        value: Any = payload
+        for part in path.split("."):
+            if not isinstance(value, dict) or part not in value:
+                break
+            value = value[part]
+        else:
+            _set_path(result, path, value)
+    return result
+
+
+class _StreamReader:
+    """Adapta el stream del body al objeto con read() asíncrono que espera ijson"""
+    
+    def __init__(self, chunks: AsyncIterator[bytes]):
+        self._chunks = chunks
+    
+    async def read(self, size: int = -1) -> bytes:
+        # ijson hace una lectura de tamaño 0 para detectar bytes/str y acepta
+        # lecturas de cualquier tamaño; b"" indica el final, por eso se
+        # saltan los chunks vacíos intermedios
+        if size == 0:
+            return b""
+        while True:
+            try:
+                chunk = await self._chunks.__anext__()
+            except StopAsyncIteration:
+                return b""
+            if chunk:
+                return chunk
+
+
+async def _stream_fields(chunks: AsyncIterator[bytes], paths: Iterable[str]) -> Dict[str, Any]:
+    wanted = set(paths)
+    result: Dict[str, Any] = {}
+    builder = None
+    builder_path = None
+    
+    async for prefix, event, value in ijson.parse_async(_StreamReader(chunks), use_float=True):
+        if builder is not None:
+            builder.event(event, value)
+            if prefix == builder_path and event in ("end_map", "end_array"):
+                _set_path(result, builder_path, builder.value)
+                builder = None
+            continue
+        
+        if event == "map_key" or prefix not in wanted:
+            continue
+        
+        if event in ("start_map", "start_array"):
+            # Objeto o lista pedida completa: reconstruirla hasta su cierre
+            builder = ijson.ObjectBuilder()
+            builder.event(event, value)
+            builder_path = prefix
+        else:
+            _set_path(result, prefix, value)
+    
+    return result
+
+
+async def parse_json_fields(request: Request, paths: Iterable[str]) -> Dict[str, Any]:
+    """
+    Parsea el body JSON de una petición conservando solo las rutas indicadas
+    
+    Con ijson instalado el body se parsea a medida que llega y la memoria
+    depende de los campos conservados, no del tamaño del payload. Sin ijson
+    se parsea el body completo y después se proyecta (el resto del
+    procesamiento sigue trabajando solo con los campos conservados).
+    
+    Args:
+        request: Petición entrante
+        paths: Rutas con puntos de los campos a conservar
+    
+    Returns:
+        Diccionario anidado con los campos encontrados
+    
+    Raises:
+        ValueError: Si el body no es JSON válido
+    """
+    if ijson is not None:
+        try:
+            return await _stream_fields(request.stream(), paths)
+        except ijson.JSONError as e:
+            raise ValueError(str(e))
+    return project_fields(loads(await request.body()), paths)
+
+
+def is_large_body(request: Request) -> bool:
+    """
+    Indica si el body debe parsearse de forma incremental
+    
+    Los bodies sin Content-Length (chunked) se consideran grandes.
+    """
+    content_length = request.headers.get("content-length")
+    if content_length is None:
+        return True
+    try:
+        return int(content_length) >= settings.STREAMING_PARSE_THRESHOLD_BYTES
+    except ValueError:
+        return True
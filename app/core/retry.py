@@ -6,6 +6,8 @@ from typing import Callable, Any, Optional
 from app.core.config import settings
 from app.core.logger import logger
 from app.core.exceptions import ExternalAPIError, ExternalAPIConnectionError
+from app.core.timing import phase
+from app.core.tracing import span
 
 
 async def retry_with_backoff(
@@ -59,7 +61,8 @@ async def retry_with_backoff(
                     f"Intento {attempt + 1}/{max_retries + 1} falló. "
                     f"Reintentando en {delay:.2f} segundos..."
                 )
-                await asyncio.sleep(delay)
+                with phase("retry_wait"), span("retry.wait", attempt=attempt + 1, delay_seconds=delay):
+                    await asyncio.sleep(delay)
             else:
                 logger.error(f"Todos los reintentos fallaron después de {max_retries + 1} intentos")
                 raise
@@ -72,7 +75,8 @@ async def retry_with_backoff(
                     f"Error inesperado en intento {attempt + 1}/{max_retries + 1}. "
                     f"Reintentando en {delay:.2f} segundos... Error: {str(e)}"
                 )
-                await asyncio.sleep(delay)
+                with phase("retry_wait"), span("retry.wait", attempt=attempt + 1, delay_seconds=delay):
+                    await asyncio.sleep(delay)
             else:
                 logger.error(f"Todos los reintentos fallaron: {str(e)}")
                 raise ExternalAPIError(
@@ -0,0 +1,96 @@
+"""
+Cierre ordenado en dos fases
+Al recibir SIGTERM/SIGINT se drena primero (readiness en 503, sin trabajo
+nuevo, esperando el que está en curso) y solo después uvicorn deja de
+aceptar conexiones y ejecuta el evento shutdown de la aplicación
+"""
+import asyncio
+import time
+from types import FrameType
+from typing import Optional, Callable, Awaitable
+import uvicorn
+from app.core.config import settings
+from app.core.logger import logger
+
+
+class GracefulShutdown:
+    """
+    Primera fase del cierre (drenado), compartida por el manejador de
+    señales y el evento shutdown
+    
+    El drenado se ejecuta una sola vez; quien llega después espera el mismo
+    resultado. Todo el cierre comparte un único plazo de
+    SHUTDOWN_GRACE_PERIOD_SECONDS contado desde el inicio del drenado.
+    """
+    
+    def __init__(self, grace_seconds: Optional[float] = None):
+        self.grace_seconds = grace_seconds or settings.SHUTDOWN_GRACE_PERIOD_SECONDS
+        self.deadline: Optional[float] = None
+        self._drain: Optional[Callable[[], Awaitable[bool]]] = None
+        self._task: Optional[asyncio.Task] = None
+    
+    def configure(self, drain: Callable[[], Awaitable[bool]]):
+        """
+        Registra el drenado de la aplicación (al arrancar)
+        
+        Args:
+            drain: Corrutina que drena y devuelve True si no quedó nada en curso
+        """
+        self._drain = drain
+        self._task = None
+        self.deadline = None
+    
+    def remaining(self) -> float:
+        """Segundos que quedan del periodo de gracia (todo el periodo si no empezó)"""
+        if self.deadline is None:
+            return self.grace_seconds
+        return max(0.0, self.deadline - time.monotonic())
+    
+    async def drain(self) -> bool:
+        """
+        Ejecuta el drenado (o espera al que ya está en marcha)
+        
+        Returns:
+            True si no quedó ninguna petición en curso
+        """
+        if self._drain is None:
+            return True
+        if self._task is None:
+            self.deadline = time.monotonic() + self.grace_seconds
+            self._task = asyncio.create_task(self._drain())
+        return await asyncio.shield(self._task)
+
+
+class DrainingServer(uvicorn.Server):
+    """
+    Servidor uvicorn que drena la aplicación antes de su propio cierre
+    
+    uvicorn, al recibir la señal, deja de aceptar conexiones, espera (o
+    cancela) las peticiones en curso y solo entonces ejecuta el evento
+    shutdown: demasiado tarde para que un balanceador vea /ready en 503.
+    Aquí la primera señal lanza el drenado y al terminar se cede a uvicorn
+    con lo que quede del periodo de gracia; una segunda señal lo salta.
+    """
+    
+    _drain_task: Optional[asyncio.Task] = None
+    
+    def handle_exit(self, sig: int, frame: Optional[FrameType]):
+        if self.should_exit or self._drain_task is not None:
+            super().handle_exit(sig, frame)
+            return
+        logger.info("Señal de cierre recibida: drenando antes de cerrar conexiones")
+        self._drain_task = asyncio.get_event_loop().create_task(self._drain_then_exit(sig, frame))
+    
+    async def _drain_then_exit(self, sig: int, frame: Optional[FrameType]):
+        try:
+            await graceful_shutdown.drain()
+        except Exception as e:
+            logger.error(f"Error drenando la aplicación: {str(e)}", exc_info=True)
+        finally:
+            # uvicorn solo espera lo que quede del plazo, no otro periodo completo
+            self.config.timeout_graceful_shutdown = max(1, int(graceful_shutdown.remaining()))
+            super().handle_exit(sig, frame)
+
+
+# Instancia global del cierre ordenado
+graceful_shutdown = GracefulShutdown()
@@ -0,0 +1,99 @@
+"""
+Coalescencia de lecturas concurrentes idénticas (single-flight)
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+from app.core.json_codec import canonical_dumps
+from app.core.memory import memory_registry, container_usage
+from app.core.tracing import span
+
+# Métodos que se coalescen por defecto (lecturas sin efectos)
+COALESCED_METHODS = ("GET",)
+
+
+def read_key(
+    method: str,
+    url: str,
+    tenant: Optional[str],
+    params: Optional[Dict[str, Any]] = None,
+    json_data: Optional[Dict[str, Any]] = None
+) -> Tuple:
+    """
+    Clave de coalescencia de una lectura: método, URL, parámetros
+    (ordenados), body si lo hay y tenant (cuenta/ubicación)
+    """
+    return (
+        method.upper(),
+        url,
+        canonical_dumps(params or {}),
+        canonical_dumps(json_data) if json_data is not None else None,
+        tenant
+    )
+
+
+class SingleFlight:
+    """
+    Comparte una sola llamada entre las corrutinas que piden lo mismo a la vez
+    
+    La primera petición de una clave lanza la llamada en una tarea propia;
+    las que llegan mientras está en curso esperan esa misma tarea y reciben
+    el mismo resultado (o la misma excepción). La tarea no se cancela si
+    quien la lanzó se cancela, para no arrastrar a las demás.
+    
+    El resultado es el mismo objeto para todas: debe tratarse como de solo
+    lectura.
+    """
+    
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.shared = 0
+    
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Ejecuta `func` o se une a la llamada en curso con la misma clave
+        
+        Args:
+            key: Identifica la lectura (método, URL, parámetros, tenant)
+            func: Corrutina que hace la llamada real
+        
+        Returns:
+            Resultado de la llamada compartida
+        """
+        task = self._calls.get(key)
+        if task is not None:
+            self.shared += 1
+            with span("singleflight.shared"):
+                return await asyncio.shield(task)
+        
+        self.calls += 1
+        task = asyncio.ensure_future(func())
+        self._calls[key] = task
+        task.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(task)
+    
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Marca la excepción como recuperada aunque todos los que esperaban
+        # se hayan cancelado
+        if not task.cancelled():
+            task.exception()
+    
+    @property
+    def in_flight(self) -> int:
+        """Llamadas compartibles en curso"""
+        return len(self._calls)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Llamadas reales, peticiones servidas por una llamada ajena y en curso"""
+        return {
+            "calls": self.calls,
+            "shared": self.shared,
+            "in_flight": self.in_flight
+        }
+
+
+# Lecturas a APIs externas (la clave incluye la URL, así que sirve para todos los servicios)
+upstream_reads = SingleFlight()
+memory_registry.register("singleflight.upstream_reads", "queue", lambda: container_usage(upstream_reads._calls))
@@ -0,0 +1,108 @@
+"""
+Utilidades de almacenamiento local en disco
+"""
+import json
+import os
+import time
+from typing import Any, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos
+    fcntl = None
+
+
+def atomic_write_bytes(path: str, data: bytes, mode: Optional[int] = None):
+    """
+    Escribe un archivo de forma atómica (archivo temporal + rename)
+    
+    Un lector nunca ve el archivo a medio escribir: o el contenido anterior
+    o el nuevo completo.
+    
+    Args:
+        path: Ruta del archivo destino
+        data: Contenido a escribir
+        mode: Permisos del archivo (p. ej. 0o600); se fijan antes del rename
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        if mode is not None:
+            os.chmod(tmp_path, mode)
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class FileLock:
+    """
+    Bloqueo exclusivo entre procesos (flock sobre `<path>.lock`)
+    
+    Bloqueante: desde código asíncrono, adquirir con asyncio.to_thread.
+    Sin fcntl (Windows) no bloquea nada.
+    """
+    
+    def __init__(self, path: str, timeout: float = 10.0):
+        self.path = f"{path}.lock"
+        self.timeout = timeout
+        self._fd: Optional[int] = None
+    
+    def acquire(self) -> bool:
+        """
+        Espera el bloqueo hasta `timeout` segundos
+        
+        Returns:
+            True si se obtuvo (o no hay fcntl); False si se agotó la espera
+        """
+        if fcntl is None:
+            return True
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self._fd = fd
+                return True
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    os.close(fd)
+                    return False
+                time.sleep(0.05)
+    
+    def release(self):
+        """Libera el bloqueo si se tiene"""
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+
+def atomic_write_json(path: str, data: Any):
+    """
+    Escribe un objeto como JSON de forma atómica
+    
+    Args:
+        path: Ruta del archivo destino
+        data: Objeto serializable a JSON
+    """
+    atomic_write_bytes(path, json.dumps(data).encode())
+
+
+def read_json(path: str, default: Any = None) -> Any:
+    """
+    Lee un archivo JSON
+    
+    Args:
+        path: Ruta del archivo
+        default: Valor a devolver si el archivo no existe
+    
+    Returns:
+        Contenido del archivo
+    """
+    if not os.path.exists(path):
+        return default
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
@@ -0,0 +1,124 @@
+"""
+Medición de tiempos por fase de cada petición (Server-Timing)
+"""
+import time
+from contextvars import ContextVar
+from typing import Optional, Dict
+from app.core.config import settings
+from app.core.logger import logger
+
+
+class PhaseTimer:
+    """Acumula la duración de cada fase de una petición"""
+    
+    __slots__ = ("started", "phases")
+    
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+    
+    def add(self, name: str, seconds: float):
+        """Suma una duración a la fase indicada"""
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+    
+    def mark_since_start(self, name: str):
+        """Registra como fase el tiempo transcurrido desde el inicio de la petición"""
+        self.add(name, time.perf_counter() - self.started)
+    
+    def total(self) -> float:
+        """Tiempo transcurrido desde el inicio de la petición"""
+        return time.perf_counter() - self.started
+    
+    def server_timing(self) -> str:
+        """Valor del header Server-Timing (duraciones en milisegundos)"""
+        parts = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.phases.items()]
+        parts.append(f"total;dur={self.total() * 1000:.2f}")
+        return ", ".join(parts)
+
+
+_current_timer: ContextVar[Optional[PhaseTimer]] = ContextVar("phase_timer", default=None)
+
+
+def current_timer() -> Optional[PhaseTimer]:
+    """Temporizador de la petición en curso (None fuera de una petición)"""
+    return _current_timer.get()
+
+
+class phase:
+    """
+    Context manager que mide una fase de la petición en curso
+    
+    Fuera de una petición (tareas en segundo plano) no mide nada.
+    
+    Uso:
+        with phase("map"):
+            data = mapper.nowcerts_to_ghl_contact(payload.data)
+    """
+    
+    __slots__ = ("name", "timer", "started")
+    
+    def __init__(self, name: str):
+        self.name = name
+        self.timer = _current_timer.get()
+        self.started = 0.0
+    
+    def __enter__(self):
+        if self.timer is not None:
+            self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        if self.timer is not None:
+            self.timer.add(self.name, time.perf_counter() - self.started)
+        return False
+
+
+def mark_validated():
+    """
+    Registra la fase "validate": lectura del body, parseo JSON y validación
+    Pydantic, que FastAPI ejecuta antes de entrar al handler
+    """
+    timer = _current_timer.get()
+    if timer is not None and "validate" not in timer.phases:
+        timer.mark_since_start("validate")
+
+
+class TimingMiddleware:
+    """
+    Middleware ASGI que mide las fases de cada petición de la API,
+    las devuelve en el header Server-Timing y las registra en el log
+    """
+    
+    def __init__(self, app, path_prefix: Optional[str] = None):
+        self.app = app
+        self.path_prefix = path_prefix if path_prefix is not None else settings.API_V1_PREFIX
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+        
+        timer = PhaseTimer()
+        token = _current_timer.set(timer)
+        status_code = 500
+        
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timer.server_timing().encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current_timer.reset(token)
+            phases = " ".join(
+                f"{name}={seconds * 1000:.1f}ms" for name, seconds in timer.phases.items()
+            )
+            logger.info(
+                f"Tiempos {scope['method']} {scope['path']} ({status_code}): "
+                f"{phases} total={timer.total() * 1000:.1f}ms"
+            )
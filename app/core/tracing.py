@@ -0,0 +1,224 @@
+"""
+Trazas correlacionadas por petición (spans exportados a JSON Lines)
+
+Cada webhook o sincronización abre una traza; las llamadas a APIs externas,
+las esperas entre reintentos y las renovaciones de token crean spans hijos.
+Los spans terminados se encolan y una tarea en segundo plano los escribe en
+TRACE_EXPORT_FILE (un objeto JSON por línea) para reconstruir offline el
+camino crítico de las peticiones lentas.
+"""
+import asyncio
+import json
+import os
+import time
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Optional, Dict, Any, List
+from app.core.config import settings
+from app.core.logger import logger, set_trace_id, reset_trace_id
+from app.core.memory import memory_registry, queue_usage
+
+
+class Span:
+    """Operación medida dentro de una traza"""
+    
+    __slots__ = (
+        "trace_id", "span_id", "parent_id", "name", "attributes",
+        "start_time", "duration", "status", "error", "_started"
+    )
+    
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start_time = time.time()
+        self.duration: Optional[float] = None
+        self.status = "ok"
+        self.error: Optional[str] = None
+        self._started = time.perf_counter()
+    
+    def set_attribute(self, key: str, value: Any):
+        """Añade o reemplaza un atributo del span"""
+        self.attributes[key] = value
+    
+    def finish(self, exc: Optional[BaseException] = None):
+        """Cierra el span, registrando el error si lo hubo"""
+        self.duration = time.perf_counter() - self._started
+        if exc is not None:
+            self.status = "error"
+            self.error = f"{type(exc).__name__}: {exc}"
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start_time,
+            "duration_ms": round((self.duration or 0.0) * 1000, 3),
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes
+        }
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    """Span activo en el contexto actual (None fuera de una traza)"""
+    return _current_span.get()
+
+
+def current_trace_id() -> Optional[str]:
+    """ID de la traza activa (None fuera de una traza)"""
+    active = _current_span.get()
+    return active.trace_id if active is not None else None
+
+
+class span:
+    """
+    Context manager que abre un span hijo del span activo
+    
+    Si no hay traza activa, el span abre una traza nueva (p. ej. en tareas
+    en segundo plano como el sondeo o la precarga).
+    
+    Uso:
+        with span("ghl.request", method="POST", endpoint="/contacts/upsert") as s:
+            response = await client.post(...)
+            s.set_attribute("status_code", response.status_code)
+    """
+    
+    __slots__ = ("span", "_token", "_trace_token")
+    
+    def __init__(self, name: str, new_trace: bool = False, **attributes):
+        parent = None if new_trace else _current_span.get()
+        if parent is not None:
+            self.span = Span(name, parent.trace_id, parent.span_id, attributes)
+        else:
+            self.span = Span(name, os.urandom(16).hex(), None, attributes)
+        self._token = None
+        self._trace_token = None
+    
+    def __enter__(self) -> Span:
+        self._token = _current_span.set(self.span)
+        if self.span.parent_id is None:
+            self._trace_token = set_trace_id(self.span.trace_id)
+        return self.span
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.span.finish(exc)
+        _current_span.reset(self._token)
+        if self._trace_token is not None:
+            reset_trace_id(self._trace_token)
+        span_exporter.export(self.span)
+        return False
+
+
+def start_trace(name: str, **attributes) -> span:
+    """
+    Abre una traza nueva (span raíz) para una petición entrante
+    
+    Uso:
+        with start_trace("webhook.nowcerts", event_type=payload.event_type):
+            return await process_nowcerts_event(payload)
+    """
+    return span(name, new_trace=True, **attributes)
+
+
+class JsonLinesSpanExporter:
+    """
+    Exporta spans terminados a un archivo JSON Lines
+    
+    export() solo encola (nunca bloquea la petición); la escritura a disco
+    se hace por lotes en una tarea en segundo plano y en un hilo aparte.
+    Si la cola se llena, los spans se descartan y se cuentan.
+    """
+    
+    def __init__(self, path: Optional[str] = None, max_queue: Optional[int] = None, batch_size: int = 256):
+        self.path = path if path is not None else settings.TRACE_EXPORT_FILE
+        self.max_queue = max_queue or settings.TRACE_EXPORT_MAX_QUEUE
+        self.batch_size = batch_size
+        self.exported = 0
+        self.dropped = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+    
+    @property
+    def enabled(self) -> bool:
+        return self._task is not None and not self._task.done()
+    
+    def start(self):
+        """Arranca la tarea de exportación (no hace nada si no hay archivo configurado)"""
+        if not self.path or self.enabled:
+            return
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Exportando trazas a {self.path}")
+    
+    def export(self, finished: Span):
+        """Encola un span terminado para su escritura"""
+        if not self.enabled:
+            return
+        try:
+            self._queue.put_nowait(finished)
+        except asyncio.QueueFull:
+            self.dropped += 1
+    
+    async def _run(self):
+        while True:
+            batch: List[Span] = [await self._queue.get()]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                lines = [json.dumps(item.to_dict(), default=str) for item in batch]
+                await asyncio.to_thread(self._write, lines)
+                self.exported += len(batch)
+            except Exception as e:
+                self.dropped += len(batch)
+                logger.warning(f"Error exportando {len(batch)} spans: {str(e)}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+    
+    def _write(self, lines: List[str]):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+    
+    async def stop(self, timeout: float = 5.0):
+        """
+        Escribe los spans pendientes y detiene la exportación
+        
+        Args:
+            timeout: Tiempo máximo para vaciar la cola
+        """
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Exportación de trazas cortada con {self._queue.qsize()} spans pendientes")
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+    
+    def stats(self) -> Dict[str, Any]:
+        """Estado del exportador"""
+        return {
+            "enabled": self.enabled,
+            "path": self.path,
+            "queued": self._queue.qsize() if self.enabled else 0,
+            "exported": self.exported,
+            "dropped": self.dropped
+        }
+
+
+# Instancia global del exportador de spans
+span_exporter = JsonLinesSpanExporter()
+memory_registry.register("tracing.export_queue", "queue", lambda: queue_usage(span_exporter._queue))
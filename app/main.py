@@ -1,77 +1,223 @@
 """
 Aplicación principal FastAPI para integración NowCerts + GoHighLevel
 """
+import time
+
+_IMPORT_STARTED = time.perf_counter()
+
+import asyncio
 from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from app.core.config import settings
-from app.api.v1 import api_router
 from app.core.logger import logger
 
-# Crear instancia de FastAPI
-app = FastAPI(
-    title=settings.APP_NAME,
-    description="Middleware para integración bidireccional entre NowCerts y GoHighLevel",
-    version=settings.APP_VERSION,
-    docs_url="/docs",
-    redoc_url="/redoc"
-)
-
-# Configurar CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=settings.CORS_ORIGINS,
-    allow_credentials=settings.CORS_ALLOW_CREDENTIALS,
-    allow_methods=settings.CORS_ALLOW_METHODS,
-    allow_headers=settings.CORS_ALLOW_HEADERS,
-)
-
-# Incluir routers
-app.include_router(api_router, prefix=settings.API_V1_PREFIX)
-
-
-@app.on_event("startup")
-async def startup_event():
-    """Eventos al iniciar la aplicación"""
-    logger.info(f"{settings.APP_NAME} v{settings.APP_VERSION} iniciada")
-    logger.info(f"Documentación disponible en /docs")
 
-
-@app.on_event("shutdown")
-async def shutdown_event():
-    """Eventos al cerrar la aplicación"""
-    logger.info("Cerrando aplicación...")
-
-
-@app.get("/")
-async def root():
+def create_app() -> FastAPI:
     """
-    Endpoint raíz con información de la API
+    Construye la aplicación FastAPI
+    
+    Los routers, middlewares y servicios se importan aquí (y no a nivel de
+    módulo) para que importar `app.main` sea barato; la precarga del token
+    y de los metadatos de GHL se lanza en el evento de arranque.
+    
+    Returns:
+        Aplicación FastAPI configurada
     """
-    return {
-        "message": settings.APP_NAME,
-        "version": settings.APP_VERSION,
-        "docs": "/docs",
-        "redoc": "/redoc",
-        "endpoints": {
-            "webhooks": {
-                "nowcerts": f"{settings.API_V1_PREFIX}/webhooks/nowcerts",
-                "ghl": f"{settings.API_V1_PREFIX}/webhooks/ghl"
-            },
-            "sync": {
-                "manual": f"{settings.API_V1_PREFIX}/sync/manual"
+    # Importaciones diferidas
+    from fastapi.middleware.cors import CORSMiddleware
+    from app.api.v1 import api_router
+    from app.core.admission import AdmissionMiddleware, admission_controller
+    from app.core.timing import TimingMiddleware
+    from app.core.request_body import BodySizeLimitMiddleware
+    from app.core.http_client import close_clients
+    from app.core.json_codec import response_class
+    from app.core.memory import memory_registry
+    from app.core.tracing import span_exporter
+    from app.core.payload_archive import payload_archive
+    from app.core.shutdown import graceful_shutdown
+    from app.core import idempotency
+    from app.services.contact_matching import contact_match_index
+    from app.services.contact_writer import contact_writer
+    from app.services.nowcerts_poller import nowcerts_poller
+    from app.services.opportunity_index import opportunity_index
+    from app.services.readiness import readiness_monitor
+    from app.services.sync_jobs import sync_jobs
+    from app.services.sync_journal import sync_journal
+    from app.services.warmup import startup_state, warm_up
+    
+    # Crear instancia de FastAPI
+    app = FastAPI(
+        title=settings.APP_NAME,
+        description="Middleware para integración bidireccional entre NowCerts y GoHighLevel",
+        version=settings.APP_VERSION,
+        docs_url="/docs",
+        redoc_url="/redoc",
+        default_response_class=response_class()
+    )
+    
+    # Configurar CORS
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=settings.CORS_ORIGINS,
+        allow_credentials=settings.CORS_ALLOW_CREDENTIALS,
+        allow_methods=settings.CORS_ALLOW_METHODS,
+        allow_headers=settings.CORS_ALLOW_HEADERS,
+    )
+    
+    # Límite de tamaño del body (413)
+    app.add_middleware(BodySizeLimitMiddleware)
+    
+    # Tiempos por fase (Server-Timing); solo mide peticiones admitidas
+    app.add_middleware(TimingMiddleware)
+    
+    # Control de admisión (se añade al final para ser el middleware más externo
+    # y rechazar antes de hacer cualquier otro trabajo)
+    app.add_middleware(AdmissionMiddleware)
+    
+    # Incluir routers
+    app.include_router(api_router, prefix=settings.API_V1_PREFIX)
+    
+    async def drain() -> bool:
+        """
+        Primera fase del cierre: /ready pasa a 503, se rechaza el trabajo
+        nuevo y se espera al que está en curso. Con `python run.py` se
+        ejecuta al recibir la señal, antes de que uvicorn cierre conexiones;
+        si no, al principio del evento shutdown.
+        """
+        admission_controller.draining = True
+        await nowcerts_poller.stop(timeout=graceful_shutdown.remaining())
+        # Los trabajos en segundo plano no sobreviven al reinicio: al
+        # cancelarlos terminan también sus streams SSE
+        await sync_jobs.stop(timeout=graceful_shutdown.remaining())
+        
+        idle = await admission_controller.drain(timeout=graceful_shutdown.remaining())
+        if not idle:
+            logger.warning(
+                f"Periodo de gracia agotado con {admission_controller.in_flight} "
+                "peticiones en curso; sus eventos no quedarán marcados como procesados"
+            )
+            try:
+                idempotency.save_pending()
+            except OSError as e:
+                logger.error(f"Error guardando los eventos sin terminar: {str(e)}")
+        return idle
+    
+    @app.on_event("startup")
+    async def startup_event():
+        """Eventos al iniciar la aplicación"""
+        logger.info(f"{settings.APP_NAME} v{settings.APP_VERSION} iniciada")
+        logger.info(f"Documentación disponible en /docs")
+        logger.info(f"Importación y construcción de la app: {startup_state.import_seconds:.3f}s")
+        idempotency.load_state()
+        graceful_shutdown.configure(drain)
+        span_exporter.start()
+        payload_archive.start()
+        
+        if settings.STARTUP_WARMUP_MODE == "blocking":
+            await warm_up()
+        elif settings.STARTUP_WARMUP_MODE == "background":
+            app.state.warmup_task = asyncio.create_task(warm_up())
+        else:
+            startup_state.ready = True
+        readiness_monitor.start()
+        memory_registry.start()
+        
+        if settings.NOWCERTS_POLL_ENABLED:
+            nowcerts_poller.start()
+    
+    @app.on_event("shutdown")
+    async def shutdown_event():
+        """
+        Cierre ordenado: drena (si la señal no lo hizo ya), envía las
+        escrituras pendientes, persiste el estado de idempotencia y cierra
+        los clientes HTTP, todo dentro del mismo periodo de gracia
+        """
+        logger.info("Cerrando aplicación...")
+        await graceful_shutdown.drain()
+        
+        warmup_task = getattr(app.state, "warmup_task", None)
+        if warmup_task is not None and not warmup_task.done():
+            warmup_task.cancel()
+        
+        await readiness_monitor.stop()
+        await memory_registry.stop()
+        
+        try:
+            await asyncio.wait_for(contact_writer.flush(), timeout=max(graceful_shutdown.remaining(), 1.0))
+        except Exception as e:
+            logger.error(f"Error enviando escrituras pendientes a GHL: {str(e)}")
+        
+        try:
+            idempotency.save_state()
+        except OSError as e:
+            logger.error(f"Error guardando el estado de idempotencia: {str(e)}")
+        
+        sync_journal.close()
+        opportunity_index.close()
+        contact_match_index.close()
+        await close_clients()
+        await payload_archive.stop()
+        await span_exporter.stop()
+        logger.info("Aplicación cerrada")
+    
+    @app.get("/")
+    async def root():
+        """
+        Endpoint raíz con información de la API
+        """
+        return {
+            "message": settings.APP_NAME,
+            "version": settings.APP_VERSION,
+            "docs": "/docs",
+            "redoc": "/redoc",
+            "endpoints": {
+                "webhooks": {
+                    "nowcerts": f"{settings.API_V1_PREFIX}/webhooks/nowcerts",
+                    "ghl": f"{settings.API_V1_PREFIX}/webhooks/ghl"
+                },
+                "sync": {
+                    "manual": f"{settings.API_V1_PREFIX}/sync/manual"
+                }
             }
         }
-    }
+    
+    @app.get("/health")
+    async def health_check():
+        """
+        Endpoint de health check
+        """
+        return {
+            "status": "healthy",
+            "service": settings.APP_NAME,
+            "version": settings.APP_VERSION
+        }
+    
+    @app.get("/ready")
+    async def readiness_check():
+        """
+        Endpoint de readiness: 503 hasta que la precarga haya terminado,
+        durante el cierre, sin token válido de NowCerts o con algún servicio
+        externo caído según las sondas en segundo plano (no hace I/O)
+        """
+        body = readiness_monitor.snapshot(
+            started=startup_state.ready,
+            draining=admission_controller.draining
+        )
+        body["startup"] = startup_state.to_dict()
+        return JSONResponse(status_code=200 if body["ready"] else 503, content=body)
+    
+    startup_state.import_seconds = time.perf_counter() - _IMPORT_STARTED
+    return app
 
 
-@app.get("/health")
-async def health_check():
+def __getattr__(name: str):
     """
-    Endpoint de health check
+    Construye `app` de forma perezosa para `uvicorn app.main:app`
+    
+    Con `uvicorn --factory app.main:create_app` no se usa.
     """
-    return {
-        "status": "healthy",
-        "service": settings.APP_NAME,
-        "version": settings.APP_VERSION
-    }
-
+    if name == "app":
+        application = create_app()
+        globals()["app"] = application
+        return application
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
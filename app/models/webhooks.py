@@ -1,29 +1,282 @@
 """
 Modelos para webhooks de NowCerts y GHL
 """
-from typing import Optional, Dict, Any, Literal
-from pydantic import BaseModel, Field
+from typing import Optional, Dict, Any, List, Literal, Union
+from pydantic import BaseModel, ConfigDict, Discriminator, Field, PrivateAttr, Tag, TypeAdapter
+from typing_extensions import Annotated
+
+
+def _private_raw(payload: BaseModel) -> Optional[Dict[str, Any]]:
+    # Acceso directo: `payload._raw` pasa por __getattr__ y cuesta varios µs
+    private = payload.__pydantic_private__
+    return private.get("_raw") if private else None
 
 
 class NowCertsWebhookPayload(BaseModel):
-    """Modelo para payload de webhook de NowCerts"""
+    """
+    Modelo para payload de webhook de NowCerts
+    
+    Es también el modelo de los tipos de evento sin esquema propio; los
+    demás (InsuredEvent, PolicyEvent, QuoteEvent) lo especializan con un
+    `data` tipado. Usar parse_nowcerts_event para validar.
+    """
     event_type: str = Field(..., description="Tipo de evento (INSURED_INSERT, POLICY_UPDATE, etc.)")
     timestamp: Optional[str] = Field(None, description="Timestamp del evento")
     data: Dict[str, Any] = Field(..., description="Datos del evento")
     
+    # Payload tal como llegó (ver raw_dict)
+    _raw: Optional[Dict[str, Any]] = PrivateAttr(None)
+    
     class Config:
         extra = "allow"  # Permitir campos adicionales
+    
+    def raw_dict(self) -> Dict[str, Any]:
+        """
+        Payload como diccionario, sin volcar el modelo
+        
+        Copia superficial del JSON recibido con los mismos valores que daba
+        model_dump() antes de tipar `data` (los IDs de idempotencia y el
+        archivo de payloads no cambian): los campos tipados pueden haberse
+        convertido (p. ej. premium "10" → 10.0), el JSON original no.
+        Solo se copia si hay que añadir campos por defecto: el resultado no
+        debe modificarse.
+        """
+        raw = _private_raw(self)
+        if raw is None:
+            return self.model_dump()
+        if "timestamp" in raw:
+            return raw
+        return {**raw, "timestamp": None}
+
+
+class _NowCertsData(BaseModel):
+    """Base de los datos tipados de NowCerts (acepta campos adicionales)"""
+    model_config = ConfigDict(extra="allow", coerce_numbers_to_str=True)
+    
+    id: Optional[str] = None
+
+
+class NowCertsAddress(BaseModel):
+    """Dirección de un asegurado de NowCerts"""
+    model_config = ConfigDict(extra="allow", coerce_numbers_to_str=True)
+    
+    street: Optional[str] = ""
+    city: Optional[str] = ""
+    state: Optional[str] = ""
+    zip: Optional[str] = ""
+
+
+class InsuredData(_NowCertsData):
+    """Datos de un asegurado de NowCerts"""
+    firstName: Optional[str] = ""
+    lastName: Optional[str] = ""
+    email: Optional[str] = ""
+    phone: Optional[str] = ""
+    address: Optional[NowCertsAddress] = None
+    source: Optional[str] = "NowCerts"
+
+
+class PolicyData(_NowCertsData):
+    """Datos de una póliza o cotización de NowCerts"""
+    policyNumber: Optional[str] = None
+    insuredDatabaseId: Optional[str] = None
+    insuredId: Optional[str] = None
+    policyType: Optional[str] = "General"
+    premium: Optional[float] = 0
+    carrier: Optional[str] = ""
+    effectiveDate: Optional[str] = ""
+    expirationDate: Optional[str] = ""
+    
+    @property
+    def insured_id(self) -> Optional[str]:
+        """ID del asegurado de NowCerts al que pertenece"""
+        return self.insuredDatabaseId or self.insuredId
+
+
+class InsuredEvent(NowCertsWebhookPayload):
+    """INSURED_INSERT / INSURED_UPDATE"""
+    data: InsuredData = Field(..., description="Datos del asegurado")
+
+
+class PolicyEvent(NowCertsWebhookPayload):
+    """POLICY_INSERT / POLICY_UPDATE"""
+    data: PolicyData = Field(..., description="Datos de la póliza")
+
+
+class QuoteEvent(NowCertsWebhookPayload):
+    """QUOTE_INSERT / QUOTE_UPDATE"""
+    data: PolicyData = Field(..., description="Datos de la cotización")
+
+
+_NOWCERTS_EVENT_KINDS = {
+    "INSURED_INSERT": "insured", "INSURED_UPDATE": "insured",
+    "POLICY_INSERT": "policy", "POLICY_UPDATE": "policy",
+    "QUOTE_INSERT": "quote", "QUOTE_UPDATE": "quote"
+}
+
+
+def _nowcerts_event_kind(value: Any) -> str:
+    event_type = value.get("event_type") if isinstance(value, dict) else getattr(value, "event_type", None)
+    return _NOWCERTS_EVENT_KINDS.get(str(event_type or "").upper(), "other")
+
+
+# Unión discriminada por event_type: solo se valida el esquema del tipo recibido
+NowCertsEvent = Annotated[
+    Union[
+        Annotated[InsuredEvent, Tag("insured")],
+        Annotated[PolicyEvent, Tag("policy")],
+        Annotated[QuoteEvent, Tag("quote")],
+        Annotated[NowCertsWebhookPayload, Tag("other")]
+    ],
+    Discriminator(_nowcerts_event_kind)
+]
+nowcerts_event_adapter: TypeAdapter = TypeAdapter(NowCertsEvent)
+
+
+_GHL_DEFAULT_FIELDS = ("event", "contact", "opportunity", "locationId")
 
 
 class GHLWebhookPayload(BaseModel):
-    """Modelo para payload de webhook de GHL"""
+    """
+    Modelo para payload de webhook de GHL
+    
+    Es también el modelo de los eventos sin contacto ni oportunidad; los
+    demás (GHLContactEvent, GHLOpportunityEvent) lo especializan. Usar
+    parse_ghl_event para validar.
+    """
     event: Optional[str] = Field(None, description="Tipo de evento")
     contact: Optional[Dict[str, Any]] = Field(None, description="Datos del contacto")
     opportunity: Optional[Dict[str, Any]] = Field(None, description="Datos de oportunidad")
     locationId: Optional[str] = Field(None, description="ID de la ubicación")
     
+    # Payload tal como llegó (ver raw_dict)
+    _raw: Optional[Dict[str, Any]] = PrivateAttr(None)
+    
     class Config:
         extra = "allow"
+    
+    def raw_dict(self) -> Dict[str, Any]:
+        """Payload como diccionario, sin volcar el modelo (ver NowCertsWebhookPayload.raw_dict)"""
+        raw = _private_raw(self)
+        if raw is None:
+            return self.model_dump()
+        missing = [field for field in _GHL_DEFAULT_FIELDS if field not in raw]
+        if not missing:
+            return raw
+        payload = dict(raw)
+        for field in missing:
+            payload[field] = None
+        return payload
+
+
+class GHLContact(BaseModel):
+    """Contacto de GHL"""
+    model_config = ConfigDict(extra="allow", coerce_numbers_to_str=True)
+    
+    id: Optional[str] = None
+    firstName: Optional[str] = ""
+    lastName: Optional[str] = ""
+    email: Optional[str] = ""
+    phone: Optional[str] = ""
+    address1: Optional[str] = ""
+    city: Optional[str] = ""
+    state: Optional[str] = ""
+    postalCode: Optional[str] = ""
+    source: Optional[str] = "GHL"
+    dateUpdated: Optional[str] = None
+
+
+class GHLOpportunity(BaseModel):
+    """Oportunidad de GHL"""
+    model_config = ConfigDict(extra="allow", coerce_numbers_to_str=True)
+    
+    id: Optional[str] = None
+    name: Optional[str] = None
+    monetaryValue: Optional[float] = 0
+    contactId: Optional[str] = None
+    # GHL envía una lista de {key/id, value}; se acepta también un diccionario
+    customFields: Union[Dict[str, Any], List[Dict[str, Any]], None] = None
+    dateUpdated: Optional[str] = None
+    
+    def custom_field(self, key: str, default: Any = None) -> Any:
+        """Valor de un campo personalizado por su clave"""
+        if isinstance(self.customFields, dict):
+            return self.customFields.get(key, default)
+        for field in self.customFields or []:
+            if field.get("key") == key or field.get("id") == key:
+                return field.get("value", default)
+        return default
+
+
+class GHLContactEvent(GHLWebhookPayload):
+    """Evento de GHL con datos de contacto"""
+    contact: GHLContact = Field(..., description="Datos del contacto")
+
+
+class GHLOpportunityEvent(GHLWebhookPayload):
+    """Evento de GHL con datos de oportunidad (y sin contacto)"""
+    opportunity: GHLOpportunity = Field(..., description="Datos de oportunidad")
+
+
+def _ghl_event_kind(value: Any) -> str:
+    get = value.get if isinstance(value, dict) else lambda name: getattr(value, name, None)
+    if get("contact"):
+        return "contact"
+    if get("opportunity"):
+        return "opportunity"
+    return "other"
+
+
+# Unión discriminada por contenido (contacto antes que oportunidad, como el procesamiento)
+GHLEvent = Annotated[
+    Union[
+        Annotated[GHLContactEvent, Tag("contact")],
+        Annotated[GHLOpportunityEvent, Tag("opportunity")],
+        Annotated[GHLWebhookPayload, Tag("other")]
+    ],
+    Discriminator(_ghl_event_kind)
+]
+ghl_event_adapter: TypeAdapter = TypeAdapter(GHLEvent)
+
+
+def parse_nowcerts_event(data: Any) -> NowCertsWebhookPayload:
+    """
+    Valida un evento de NowCerts con el modelo de su event_type
+    
+    Args:
+        data: Payload como diccionario, o un NowCertsWebhookPayload construido a mano
+            (se devuelve tal cual si ya se obtuvo con esta función)
+    
+    Raises:
+        ValidationError: Si el payload no cumple el esquema de su tipo
+    """
+    if isinstance(data, NowCertsWebhookPayload):
+        if _private_raw(data) is not None:
+            return data
+        data = data.model_dump()
+    payload = nowcerts_event_adapter.validate_python(data)
+    payload.__pydantic_private__["_raw"] = data
+    return payload
+
+
+def parse_ghl_event(data: Any) -> GHLWebhookPayload:
+    """
+    Valida un evento de GHL con el modelo de su contenido (contacto u oportunidad)
+    
+    Args:
+        data: Payload como diccionario, o un GHLWebhookPayload construido a mano
+            (se devuelve tal cual si ya se obtuvo con esta función)
+    
+    Raises:
+        ValidationError: Si el payload no cumple el esquema de su tipo
+    """
+    if isinstance(data, GHLWebhookPayload):
+        if _private_raw(data) is not None:
+            return data
+        data = data.model_dump()
+    payload = ghl_event_adapter.validate_python(data)
+    payload.__pydantic_private__["_raw"] = data
+    return payload
 
 
 class WebhookResponse(BaseModel):
@@ -47,6 +300,10 @@ class SyncRequest(BaseModel):
         description="Dirección de la sincronización"
     )
     data: Optional[Dict[str, Any]] = Field(None, description="Datos a sincronizar (opcional)")
+    include_related: bool = Field(
+        True,
+        description="Sin data: sincronizar también los registros relacionados de entity_id"
+    )
 
 
 class SyncResponse(BaseModel):
@@ -57,3 +314,38 @@ class SyncResponse(BaseModel):
     target_id: Optional[str] = Field(None, description="ID en el sistema destino")
     data: Optional[Dict[str, Any]] = Field(None, description="Datos sincronizados")
 
+
+class SyncJobRequest(BaseModel):
+    """Solicitud de un trabajo de sincronización en segundo plano"""
+    kind: Literal["entity", "import", "reconcile", "contact_index"] = Field(
+        ...,
+        description=(
+            "entity: entidad por ID con sus relacionados; import: importación masiva de "
+            "contactos; reconcile: plan de reparación (y opcionalmente aplicarlo); "
+            "contact_index: recargar el índice de emparejamiento de contactos"
+        )
+    )
+    source: Optional[Literal["nowcerts", "ghl"]] = Field(
+        None,
+        description="Sistema origen (entity e import)"
+    )
+    entity_type: Optional[Literal["contact", "policy", "quote", "opportunity"]] = Field(
+        None,
+        description="Tipo de entidad (entity)"
+    )
+    entity_id: Optional[str] = Field(None, description="ID de la entidad en el origen (entity)")
+    include_related: bool = Field(True, description="Incluir los registros relacionados (entity)")
+    contacts: Optional[List[Dict[str, Any]]] = Field(
+        None,
+        description="Contactos en el formato del origen (import)"
+    )
+    prefer: Literal["nowcerts", "ghl"] = Field(
+        "nowcerts",
+        description="Sistema que manda cuando un contacto difiere (reconcile)"
+    )
+    apply: bool = Field(False, description="Ejecutar el plan al terminar la comparación (reconcile)")
+    timeout_seconds: Optional[float] = Field(
+        None,
+        gt=0,
+        description="Tiempo máximo del trabajo (por defecto y como máximo SYNC_JOB_TIMEOUT_SECONDS)"
+    )
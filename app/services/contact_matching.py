@@ -0,0 +1,489 @@
+"""
+Emparejamiento de contactos entre NowCerts y GHL con un índice local
+
+Normaliza emails y teléfonos (E.164), guarda claves de bloqueo de cada
+contacto conocido en un SQLite local y puntúa los candidatos que comparten
+alguna clave, para encontrar la contraparte de un contacto sin buscarlo en
+la API del otro sistema.
+
+Uso (carga inicial del índice desde ambos sistemas):
+    python -m app.services.contact_matching --rebuild
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import time
+import unicodedata
+from typing import Optional, Dict, Any, List, Tuple
+from app.core.config import settings
+from app.core.logger import logger
+
+try:
+    import phonenumbers
+except ImportError:  # Dependencia opcional: sin ella se normaliza con reglas NANP
+    phonenumbers = None
+
+NOWCERTS = "nowcerts"
+GHL = "ghl"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS match_contacts (
+    system TEXT NOT NULL,
+    record_id TEXT NOT NULL,
+    email TEXT,
+    phone TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    postal_code TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (system, record_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS match_keys (
+    key TEXT NOT NULL,
+    system TEXT NOT NULL,
+    record_id TEXT NOT NULL,
+    PRIMARY KEY (key, system, record_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS match_keys_record
+    ON match_keys (system, record_id);
+"""
+
+_FIELDS = ("email", "phone", "first_name", "last_name", "postal_code")
+
+# Peso de cada coincidencia en la puntuación (se limita a 1.0)
+MATCH_WEIGHTS = {
+    "email": 0.6,
+    "phone": 0.5,
+    "last_name": 0.2,
+    "first_name": 0.1,
+    "postal_code": 0.1
+}
+
+# Datos distintos en ambos lados restan: probablemente son dos personas
+# (familia que comparte teléfono o email)
+CONFLICT_PENALTIES = {
+    "email": 0.3,
+    "last_name": 0.3,
+    "first_name": 0.2
+}
+
+
+def normalize_email(value: Any) -> Optional[str]:
+    """Email en minúsculas y sin espacios (None si no parece un email)"""
+    if not value:
+        return None
+    email = "".join(str(value).split()).lower()
+    return email if "@" in email else None
+
+
+def normalize_phone(value: Any, country_code: Optional[str] = None) -> Optional[str]:
+    """
+    Teléfono en formato E.164 (+<código de país><número>)
+    
+    Con `phonenumbers` instalado se valida con sus metadatos; sin él, los
+    números de 10 dígitos se consideran del país por defecto
+    (CONTACT_PHONE_COUNTRY_CODE) y un "00" inicial equivale a "+".
+    
+    Args:
+        value: Teléfono en cualquier formato (espacios, guiones, paréntesis, +1...)
+        country_code: Código de país por defecto (sin "+")
+    
+    Returns:
+        Teléfono E.164 o None si no se puede interpretar
+    """
+    if not value:
+        return None
+    raw = str(value).strip()
+    country_code = country_code or settings.CONTACT_PHONE_COUNTRY_CODE
+    
+    if phonenumbers is not None:
+        region = phonenumbers.region_code_for_country_code(int(country_code))
+        try:
+            parsed = phonenumbers.parse(raw, region)
+        except phonenumbers.NumberParseException:
+            return None
+        if not phonenumbers.is_possible_number(parsed):
+            return None
+        return phonenumbers.format_number(parsed, phonenumbers.PhoneNumberFormat.E164)
+    
+    digits = "".join(ch for ch in raw if ch.isdigit())
+    if raw.startswith("+"):
+        pass
+    elif raw.startswith("00"):
+        digits = digits[2:]
+    elif len(digits) == 10:
+        digits = country_code + digits
+    elif not (len(digits) == len(country_code) + 10 and digits.startswith(country_code)):
+        # Sin prefijo internacional y sin la longitud nacional: no se adivina
+        return None
+    return f"+{digits}" if 8 <= len(digits) <= 15 else None
+
+
+def normalize_name(value: Any) -> Optional[str]:
+    """Nombre sin acentos, en minúsculas y solo con letras y dígitos"""
+    if not value:
+        return None
+    decomposed = unicodedata.normalize("NFKD", str(value))
+    name = "".join(ch for ch in decomposed if ch.isalnum()).casefold()
+    return name or None
+
+
+def normalize_contact(contact: Dict[str, Any]) -> Dict[str, Optional[str]]:
+    """
+    Campos de emparejamiento normalizados de un contacto en formato GHL
+    
+    Returns:
+        email, phone (E.164), first_name, last_name y postal_code (5 primeros caracteres)
+    """
+    postal_code = "".join(str(contact.get("postalCode") or "").split())[:5].upper()
+    return {
+        "email": normalize_email(contact.get("email")),
+        "phone": normalize_phone(contact.get("phone")),
+        "first_name": normalize_name(contact.get("firstName")),
+        "last_name": normalize_name(contact.get("lastName")),
+        "postal_code": postal_code or None
+    }
+
+
+def blocking_keys(normalized: Dict[str, Optional[str]]) -> List[str]:
+    """
+    Claves de bloqueo: solo se puntúan los candidatos que comparten alguna
+    
+    email, teléfono y, para contactos sin ninguno de los dos o con datos
+    cambiados, apellido + inicial + código postal.
+    """
+    keys = []
+    if normalized["email"]:
+        keys.append(f"email:{normalized['email']}")
+    if normalized["phone"]:
+        keys.append(f"phone:{normalized['phone']}")
+    if normalized["last_name"] and normalized["first_name"] and normalized["postal_code"]:
+        keys.append(
+            f"name:{normalized['last_name']}|{normalized['first_name'][0]}|{normalized['postal_code']}"
+        )
+    return keys
+
+
+def _names_compatible(a: str, b: str) -> bool:
+    # Inicial o forma corta del otro (J. / Jose, Chris / Christopher)
+    return a.startswith(b) or b.startswith(a)
+
+
+def conflicts(a: Dict[str, Optional[str]], b: Dict[str, Optional[str]]) -> List[str]:
+    """Campos presentes en ambos contactos con valores incompatibles"""
+    found = []
+    for field in CONFLICT_PENALTIES:
+        if not a.get(field) or not b.get(field) or a[field] == b[field]:
+            continue
+        if field != "email" and _names_compatible(a[field], b[field]):
+            continue
+        found.append(field)
+    return found
+
+
+def score_match(a: Dict[str, Optional[str]], b: Dict[str, Optional[str]]) -> Tuple[float, List[str]]:
+    """
+    Puntuación (0-1) de que dos contactos normalizados sean la misma persona
+    
+    Returns:
+        (puntuación, campos que coinciden)
+    """
+    matched = [field for field in MATCH_WEIGHTS if a.get(field) and a.get(field) == b.get(field)]
+    score = sum(MATCH_WEIGHTS[field] for field in matched)
+    if (
+        "first_name" not in matched and a.get("first_name") and b.get("first_name")
+        and _names_compatible(a["first_name"], b["first_name"])
+    ):
+        # Inicial o forma corta (Jose / J.): medio peso
+        score += MATCH_WEIGHTS["first_name"] / 2
+    score -= sum(CONFLICT_PENALTIES[field] for field in conflicts(a, b))
+    return round(max(0.0, min(score, 1.0)), 3), matched
+
+
+def is_same_person(a: Dict[str, Optional[str]], b: Dict[str, Optional[str]], matched: List[str]) -> bool:
+    """
+    Si hay pruebas suficientes para tratar dos contactos como la misma persona
+    
+    Hace falta el mismo email, o el mismo teléfono y el mismo apellido, y
+    ningún dato incompatible: un teléfono o email compartido en una familia
+    no basta para actualizar a otra persona.
+    """
+    if conflicts(a, b):
+        return False
+    return "email" in matched or ("phone" in matched and "last_name" in matched)
+
+
+class ContactMatchIndex:
+    """
+    Índice local (SQLite) de contactos conocidos de NowCerts y GHL
+    
+    Cada contacto se guarda normalizado con sus claves de bloqueo y se
+    actualiza a medida que pasan eventos (upsert reemplaza las claves
+    anteriores). Buscar la contraparte es una consulta por clave de bloqueo
+    y una puntuación de los pocos candidatos, en el propio event loop.
+    """
+    
+    def __init__(self, path: Optional[str] = None, min_score: Optional[float] = None):
+        self.path = path if path is not None else settings.CONTACT_MATCH_INDEX_FILE
+        self.min_score = min_score if min_score is not None else settings.CONTACT_MATCH_MIN_SCORE
+        self._conn: Optional[sqlite3.Connection] = None
+        self.lookups = 0
+        self.matches = 0
+    
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            path = self.path or ":memory:"
+            if path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+            if path != ":memory:":
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+    
+    def close(self):
+        """Cierra la base de datos (se reabre sola si se vuelve a usar)"""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+    
+    def upsert(self, system: str, record_id: Optional[str], contact: Dict[str, Any]):
+        """
+        Registra o actualiza un contacto
+        
+        Args:
+            system: nowcerts o ghl
+            record_id: ID del contacto en ese sistema (None = no se indexa)
+            contact: Datos en formato GHL (firstName, email, phone, postalCode...)
+        """
+        if not record_id:
+            return
+        normalized = normalize_contact(contact)
+        conn = self._connection()
+        conn.execute("BEGIN")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO match_contacts (system, record_id, email, phone, first_name, "
+                "last_name, postal_code, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (system, record_id, *(normalized[field] for field in _FIELDS), time.time())
+            )
+            conn.execute("DELETE FROM match_keys WHERE system = ? AND record_id = ?", (system, record_id))
+            conn.executemany(
+                "INSERT OR IGNORE INTO match_keys (key, system, record_id) VALUES (?, ?, ?)",
+                [(key, system, record_id) for key in blocking_keys(normalized)]
+            )
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            conn.execute("ROLLBACK")
+            logger.warning(f"Error actualizando el índice de contactos: {str(e)}")
+    
+    def remove(self, system: str, record_id: str):
+        """Elimina un contacto del índice"""
+        conn = self._connection()
+        conn.execute("DELETE FROM match_contacts WHERE system = ? AND record_id = ?", (system, record_id))
+        conn.execute("DELETE FROM match_keys WHERE system = ? AND record_id = ?", (system, record_id))
+    
+    def candidates(self, contact: Dict[str, Any], system: str) -> List[Dict[str, Any]]:
+        """
+        Contactos de `system` que comparten alguna clave de bloqueo, puntuados
+        
+        Args:
+            contact: Contacto buscado, en formato GHL
+            system: Sistema donde se busca la contraparte
+        
+        Returns:
+            record_id, score, matched y datos normalizados, de mayor a menor puntuación
+        """
+        normalized = normalize_contact(contact)
+        keys = blocking_keys(normalized)
+        if not keys:
+            return []
+        rows = self._connection().execute(
+            f"SELECT c.record_id, {', '.join('c.' + field for field in _FIELDS)} "
+            "FROM match_contacts c JOIN ("
+            "SELECT DISTINCT record_id FROM match_keys "
+            f"WHERE system = ? AND key IN ({', '.join('?' * len(keys))})"
+            ") k ON c.record_id = k.record_id WHERE c.system = ?",
+            (system, *keys, system)
+        ).fetchall()
+        
+        results = []
+        for row in rows:
+            candidate = dict(zip(_FIELDS, row[1:]))
+            score, matched = score_match(normalized, candidate)
+            results.append({
+                "record_id": row[0],
+                "score": score,
+                "matched": matched,
+                "conflicts": conflicts(normalized, candidate),
+                "same_person": is_same_person(normalized, candidate, matched),
+                **candidate
+            })
+        results.sort(key=lambda item: item["score"], reverse=True)
+        return results
+    
+    def find_match(self, contact: Dict[str, Any], system: str) -> Optional[Dict[str, Any]]:
+        """
+        Mejor contraparte en `system` con puntuación >= CONTACT_MATCH_MIN_SCORE
+        
+        Solo cuentan los candidatos con pruebas suficientes (is_same_person),
+        y si dos empatan en la mejor puntuación no se elige ninguno: mejor
+        crear que actualizar a la persona equivocada.
+        
+        Returns:
+            Candidato (record_id, score, matched...) o None
+        """
+        self.lookups += 1
+        candidates = [candidate for candidate in self.candidates(contact, system) if candidate["same_person"]]
+        if not candidates or candidates[0]["score"] < self.min_score:
+            return None
+        if len(candidates) > 1 and candidates[1]["score"] == candidates[0]["score"]:
+            logger.warning(
+                f"Contraparte ambigua en {system}: {candidates[0]['record_id']} y "
+                f"{candidates[1]['record_id']} con puntuación {candidates[0]['score']}"
+            )
+            return None
+        self.matches += 1
+        return candidates[0]
+    
+    def counterpart(self, system: str, record_id: Optional[str], target: str) -> Optional[str]:
+        """
+        ID en `target` de un contacto indexado de `system`
+        
+        Returns:
+            record_id de la mejor contraparte o None
+        """
+        if not record_id:
+            return None
+        row = self._connection().execute(
+            f"SELECT {', '.join(_FIELDS)} FROM match_contacts WHERE system = ? AND record_id = ?",
+            (system, record_id)
+        ).fetchone()
+        if row is None:
+            return None
+        stored = dict(zip(_FIELDS, row))
+        contact = {
+            "email": stored["email"],
+            "phone": stored["phone"],
+            "firstName": stored["first_name"],
+            "lastName": stored["last_name"],
+            "postalCode": stored["postal_code"]
+        }
+        match = self.find_match(contact, target)
+        return match["record_id"] if match else None
+    
+    def stats(self) -> Dict[str, Any]:
+        """Contactos indexados por sistema, búsquedas y coincidencias"""
+        rows = self._connection().execute(
+            "SELECT system, COUNT(*) FROM match_contacts GROUP BY system"
+        ).fetchall()
+        return {
+            "path": self.path,
+            "contacts": dict(rows),
+            "lookups": self.lookups,
+            "matches": self.matches,
+            "min_score": self.min_score,
+            "phone_normalizer": "phonenumbers" if phonenumbers is not None else "nanp"
+        }
+
+
+# Instancia global del índice de emparejamiento
+contact_match_index = ContactMatchIndex()
+
+
+async def upsert_nowcerts_contact(
+    nowcerts_service,
+    contact: Dict[str, Any],
+    nowcerts_data: Dict[str, Any]
+) -> Dict[str, Any]:
+    """
+    Escribe en NowCerts un contacto de GHL actualizando su contraparte si existe
+    
+    Args:
+        nowcerts_service: NowCertsService
+        contact: Contacto en formato GHL (para buscar la contraparte)
+        nowcerts_data: Datos ya mapeados a formato NowCerts
+    
+    Returns:
+        Respuesta de NowCerts (con "id" aunque la API no lo devuelva al actualizar)
+    """
+    match = contact_match_index.find_match(contact, NOWCERTS)
+    if match is not None:
+        result = await nowcerts_service.update_contact(match["record_id"], nowcerts_data)
+        result = dict(result or {})
+        result.setdefault("id", match["record_id"])
+    else:
+        result = await nowcerts_service.create_contact(nowcerts_data)
+    contact_match_index.upsert(NOWCERTS, result.get("id"), contact)
+    return result
+
+
+async def rebuild(reconciler=None, progress=None) -> Dict[str, int]:
+    """
+    Carga en el índice todos los contactos de ambos sistemas
+    
+    Args:
+        reconciler: Reconciler cuyos recorridos paginados se reutilizan
+        progress: Se llama tras cada página con (contactos indexados, None, mensaje)
+    
+    Returns:
+        Contactos indexados por sistema
+    """
+    from app.models.webhooks import InsuredData, GHLContact
+    from app.services.mapper import DataMapper
+    from app.services.reconciliation import Reconciler
+    
+    reconciler = reconciler or Reconciler()
+    mapper = DataMapper()
+    counts = {NOWCERTS: 0, GHL: 0}
+    
+    async def _load(system: str, pages):
+        async for records in pages:
+            for record in records:
+                if system == NOWCERTS:
+                    insured = InsuredData.model_validate(record)
+                    contact_match_index.upsert(system, insured.id, mapper.insured_to_ghl_contact(insured))
+                else:
+                    ghl_contact = GHLContact.model_validate(record)
+                    contact_match_index.upsert(system, ghl_contact.id, ghl_contact.model_dump())
+                counts[system] += 1
+            if progress:
+                progress(sum(counts.values()), None, "Contactos indexados")
+    
+    await asyncio.gather(
+        _load(NOWCERTS, reconciler.nowcerts_pages()),
+        _load(GHL, reconciler.ghl_pages())
+    )
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rebuild", action="store_true", help="Cargar todos los contactos de ambos sistemas")
+    parser.add_argument("--email", help="Buscar candidatos por email")
+    parser.add_argument("--phone", help="Buscar candidatos por teléfono")
+    parser.add_argument("--system", choices=[NOWCERTS, GHL], default=NOWCERTS, help="Sistema donde buscar")
+    args = parser.parse_args()
+    
+    if args.rebuild:
+        from app.core.http_client import close_clients
+        from app.core.priority import BULK, lane
+        
+        async def _rebuild():
+            try:
+                with lane(BULK):
+                    return await rebuild()
+            finally:
+                await close_clients()
+        
+        print(asyncio.run(_rebuild()))
+    if args.email or args.phone:
+        for candidate in contact_match_index.candidates({"email": args.email, "phone": args.phone}, args.system):
+            print(candidate)
+    contact_match_index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""
+Escritor por lotes de contactos hacia GoHighLevel
+Agrupa las escrituras pendientes durante una ventana corta y las envía
+como upserts con paralelismo acotado
+"""
+import asyncio
+from typing import Optional, Dict, Any, List, Set
+from app.core.config import settings
+from app.core.logger import logger
+from app.core.memory import memory_registry, container_usage
+from app.core.priority import current_lane, highest_lane, lane
+from app.core.tracing import current_trace_id, start_trace, span
+from app.services.ghl_service import GHLService
+from app.services.sync_journal import contact_match_key
+
+
+class _PendingWrite:
+    """Escritura pendiente: datos combinados, futuros, trazas y carriles de quienes la esperan"""
+    
+    __slots__ = ("data", "futures", "trace_ids", "lanes")
+    
+    def __init__(self, data: Dict[str, Any]):
+        self.data = data
+        self.futures: List[asyncio.Future] = []
+        self.trace_ids: List[str] = []
+        self.lanes: List[str] = []
+
+
+class ContactBatchWriter:
+    """
+    Agrupa escrituras de contactos en GHL
+    
+    Las escrituras que llegan dentro de la misma ventana y corresponden al
+    mismo contacto (mismo email o teléfono) se combinan en un solo upsert,
+    de modo que una ráfaga de eventos del mismo asegurado cuesta una sola
+    llamada y nunca crea duplicados.
+    """
+    
+    def __init__(
+        self,
+        ghl_service: Optional[GHLService] = None,
+        window_seconds: Optional[float] = None,
+        max_batch_size: Optional[int] = None,
+        concurrency: Optional[int] = None
+    ):
+        self.ghl_service = ghl_service or GHLService()
+        self.window_seconds = (
+            window_seconds if window_seconds is not None else settings.GHL_BATCH_WINDOW_SECONDS
+        )
+        self.max_batch_size = max_batch_size or settings.GHL_BATCH_MAX_SIZE
+        self.concurrency = concurrency or settings.GHL_BATCH_CONCURRENCY
+        
+        self._pending: Dict[str, _PendingWrite] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        # Envíos de lotes llenos en curso (referencia fuerte hasta que terminan)
+        self._batch_tasks: Set[asyncio.Task] = set()
+        self._anonymous_seq = 0
+    
+    def _match_key(self, contact_data: Dict[str, Any]) -> str:
+        """
+        Calcula la clave de coincidencia de un contacto (email o teléfono)
+        
+        Args:
+            contact_data: Datos del contacto en formato GHL
+        
+        Returns:
+            Clave de coincidencia; los contactos sin email ni teléfono
+            reciben una clave única y no se combinan
+        """
+        key = contact_match_key(contact_data)
+        if key is not None:
+            return key
+        
+        self._anonymous_seq += 1
+        return f"anon:{self._anonymous_seq}"
+    
+    @staticmethod
+    def _merge(target: Dict[str, Any], update: Dict[str, Any]):
+        """Combina datos de contacto; los valores vacíos no sobrescriben"""
+        for key, value in update.items():
+            if value not in (None, "") or key not in target:
+                target[key] = value
+    
+    async def upsert(self, contact_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Encola un upsert de contacto y espera su resultado
+        
+        Args:
+            contact_data: Datos del contacto en formato GHL
+        
+        Returns:
+            Respuesta de GHL para el upsert (compartida si se combinó)
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        key = self._match_key(contact_data)
+        
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = _PendingWrite(dict(contact_data))
+            self._pending[key] = pending
+        else:
+            self._merge(pending.data, contact_data)
+        pending.futures.append(future)
+        pending.lanes.append(current_lane())
+        trace_id = current_trace_id()
+        if trace_id:
+            pending.trace_ids.append(trace_id)
+        
+        if len(self._pending) >= self.max_batch_size:
+            # Lote lleno: enviar de inmediato sin esperar la ventana
+            task = asyncio.create_task(self.flush())
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._on_flush_done)
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_after_window())
+            self._flush_task.add_done_callback(self._on_flush_done)
+        
+        return await future
+    
+    async def upsert_many(self, contacts: List[Dict[str, Any]]) -> List[Any]:
+        """
+        Encola varios upserts (backfills, importaciones)
+        
+        Args:
+            contacts: Lista de contactos en formato GHL
+        
+        Returns:
+            Resultados en el mismo orden; los errores se devuelven como excepciones
+        """
+        return await asyncio.gather(
+            *(self.upsert(contact) for contact in contacts),
+            return_exceptions=True
+        )
+    
+    def _on_flush_done(self, task: asyncio.Task):
+        """Suelta la tarea de envío y registra su error (nadie la espera)"""
+        self._batch_tasks.discard(task)
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is not None:
+            logger.error(f"Error enviando lote de contactos a GHL: {str(error)}", exc_info=error)
+    
+    async def _flush_after_window(self):
+        """Espera la ventana de agrupación y envía el lote"""
+        await asyncio.sleep(self.window_seconds)
+        await self.flush()
+    
+    async def flush(self):
+        """Envía todas las escrituras pendientes con paralelismo acotado"""
+        if not self._pending:
+            return
+        
+        batch = list(self._pending.values())
+        self._pending = {}
+        
+        merged = sum(len(pending.futures) for pending in batch) - len(batch)
+        logger.debug(
+            f"Enviando lote de {len(batch)} contactos a GHL "
+            f"({merged} escrituras combinadas)"
+        )
+        
+        semaphore = asyncio.Semaphore(self.concurrency)
+        
+        async def _write(pending: _PendingWrite):
+            async with semaphore:
+                try:
+                    # linked_traces enlaza el upsert con las peticiones que lo esperan;
+                    # va en el carril más prioritario de quienes lo esperan
+                    with lane(highest_lane(*pending.lanes)), span(
+                        "ghl.contact_upsert", linked_traces=pending.trace_ids
+                    ):
+                        result = await self.ghl_service.upsert_contact(pending.data)
+                except Exception as e:
+                    for future in pending.futures:
+                        if not future.done():
+                            future.set_exception(e)
+                    return
+            for future in pending.futures:
+                if not future.done():
+                    future.set_result(result)
+        
+        # El lote combina escrituras de varias peticiones: va en su propia traza
+        with start_trace("ghl.contact_batch", contacts=len(batch), merged=merged):
+            await asyncio.gather(*(_write(pending) for pending in batch))
+    
+    @property
+    def pending_count(self) -> int:
+        """Número de contactos pendientes de envío"""
+        return len(self._pending)
+
+
+# Instancia global del escritor de contactos
+contact_writer = ContactBatchWriter()
+memory_registry.register("ghl.contact_writer.pending", "queue", lambda: container_usage(
+    contact_writer._pending, contact_writer.max_batch_size
+))
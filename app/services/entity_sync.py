@@ -0,0 +1,334 @@
+"""
+Sincronización manual por ID de una entidad y sus registros relacionados
+Descarga la entidad del sistema origen junto con lo que cuelga de ella (un
+asegurado con sus pólizas y cotizaciones, un contacto de GHL con sus
+oportunidades) y lo sincroniza todo con el destino en una sola petición
+"""
+import asyncio
+import time
+from typing import Optional, Dict, Any, List, Callable, Awaitable
+from app.core.config import settings
+from app.core.logger import logger
+from app.models.webhooks import InsuredData, PolicyData, GHLContact, GHLOpportunity
+from app.services.contact_matching import contact_match_index, upsert_nowcerts_contact, NOWCERTS, GHL
+from app.services.contact_writer import contact_writer
+from app.services.ghl_service import GHLService
+from app.services.mapper import DataMapper
+from app.services.nowcerts_service import NowCertsService, parse_page
+from app.services.opportunity_writer import opportunity_writer
+from app.services.sync_journal import sync_journal, contact_match_key, contact_fingerprint
+
+# Avance de una sincronización larga: (registros hechos, total, mensaje)
+ProgressCallback = Callable[[int, Optional[int], str], None]
+
+# Colecciones relacionadas de un asegurado: tipo -> endpoint
+INSURED_RELATED = {
+    "policy": "/api/policies",
+    "quote": "/api/quotes"
+}
+
+
+def _unwrap(response: Any, key: Optional[str] = None) -> Dict[str, Any]:
+    """Registro de una respuesta ({key: {...}}, {"data": {...}} o el registro tal cual)"""
+    if isinstance(response, dict):
+        for name in (key, "data"):
+            if name and isinstance(response.get(name), dict):
+                return response[name]
+    return response or {}
+
+
+def _elapsed_ms(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000, 1)
+
+
+class EntitySync:
+    """
+    Sincroniza una entidad por ID con todo su grafo de registros
+    
+    Las descargas del origen van en paralelo (la entidad, sus pólizas y sus
+    cotizaciones, y las páginas de cada colección). Después se escribe
+    primero la entidad raíz, porque los registros relacionados necesitan su
+    ID en el destino, y luego los relacionados con un máximo de
+    SYNC_FANOUT_CONCURRENCY escrituras a la vez. Un registro que falla no
+    detiene al resto: cada uno devuelve su resultado y su tiempo.
+    """
+    
+    def __init__(
+        self,
+        nowcerts_service: Optional[NowCertsService] = None,
+        ghl_service: Optional[GHLService] = None,
+        concurrency: Optional[int] = None
+    ):
+        self.nowcerts_service = nowcerts_service or NowCertsService()
+        self.ghl_service = ghl_service or GHLService()
+        self.mapper = DataMapper()
+        self.concurrency = concurrency or settings.SYNC_FANOUT_CONCURRENCY
+        self.page_size = settings.NOWCERTS_POLL_PAGE_SIZE
+    
+    async def _list_insured_records(self, endpoint: str, insured_id: str) -> List[Dict[str, Any]]:
+        """Todas las páginas de una colección de un asegurado (las siguientes en paralelo)"""
+        response = await self.nowcerts_service.list_insured_records(
+            endpoint, insured_id, page=1, page_size=self.page_size
+        )
+        records, total = parse_page(response)
+        if total is not None and total > len(records) and len(records) == self.page_size:
+            pages = -(-total // self.page_size)
+            responses = await asyncio.gather(*[
+                self.nowcerts_service.list_insured_records(
+                    endpoint, insured_id, page=page, page_size=self.page_size
+                )
+                for page in range(2, pages + 1)
+            ])
+            for response in responses:
+                records.extend(parse_page(response)[0])
+        elif total is None:
+            page = 1
+            last = records
+            while len(last) == self.page_size:
+                page += 1
+                last, _ = parse_page(await self.nowcerts_service.list_insured_records(
+                    endpoint, insured_id, page=page, page_size=self.page_size
+                ))
+                records.extend(last)
+        return records
+    
+    async def _fan_out(
+        self,
+        records: List[Dict[str, Any]],
+        write: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]],
+        progress: Optional[ProgressCallback] = None,
+        label: str = "Registros relacionados sincronizados"
+    ) -> List[Dict[str, Any]]:
+        """Escribe los registros con paralelismo acotado; un resultado por registro"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        done = 0
+        if progress:
+            progress(0, len(records), label)
+        
+        async def _one(record: Dict[str, Any]) -> Dict[str, Any]:
+            nonlocal done
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    result = await write(record)
+                except Exception as e:
+                    # ExternalAPIError (HTTPException) lleva el mensaje en detail
+                    error = getattr(e, "detail", None) or str(e) or type(e).__name__
+                    logger.warning(f"Error sincronizando {record['type']} {record['id']}: {error}")
+                    result = {"status": "error", "error": error}
+                done += 1
+                if progress:
+                    progress(done, len(records), label)
+                return {"type": record["type"], "id": record["id"], **result, "elapsed_ms": _elapsed_ms(started)}
+        
+        return list(await asyncio.gather(*[_one(record) for record in records]))
+    
+    async def _insured_to_ghl(self, insured: InsuredData) -> Dict[str, Any]:
+        ghl_data = self.mapper.insured_to_ghl_contact(insured)
+        async with sync_journal.writing(
+            "contact", contact_match_key(ghl_data), "nowcerts", "ghl",
+            contact_fingerprint(ghl_data), source_id=insured.id
+        ) as write:
+            result = await contact_writer.upsert(ghl_data)
+            write.target_id = (result.get("contact") or result).get("id")
+        contact_match_index.upsert(NOWCERTS, insured.id, ghl_data)
+        contact_match_index.upsert(GHL, write.target_id, ghl_data)
+        return {"status": "synced", "target_id": write.target_id}
+    
+    async def _policy_to_ghl(self, kind: str, policy: PolicyData, contact_id: Optional[str]) -> Dict[str, Any]:
+        result = await opportunity_writer.upsert(kind, policy, contact_id=contact_id)
+        return {
+            "status": "skipped" if result["action"] == "skipped" else "synced",
+            "action": result["action"],
+            "target_id": result.get("opportunity_id"),
+            **({"message": result["message"]} if "message" in result else {})
+        }
+    
+    async def sync_nowcerts(
+        self,
+        entity_type: str,
+        entity_id: str,
+        include_related: bool = True,
+        progress: Optional[ProgressCallback] = None
+    ) -> Dict[str, Any]:
+        """
+        Sincroniza con GHL un asegurado (con sus pólizas y cotizaciones) o una póliza/cotización
+        
+        Args:
+            entity_type: contact, policy o quote
+            entity_id: ID en NowCerts
+            include_related: Incluir las pólizas y cotizaciones del asegurado
+            progress: Se llama tras cada registro relacionado escrito
+        
+        Returns:
+            root (resultado de la entidad), records (relacionados), timings
+        """
+        started = time.perf_counter()
+        
+        if entity_type in INSURED_RELATED:
+            fetch = self.nowcerts_service.get_policy if entity_type == "policy" else self.nowcerts_service.get_quote
+            policy = PolicyData.model_validate(_unwrap(await fetch(entity_id)))
+            fetch_ms = _elapsed_ms(started)
+            write_started = time.perf_counter()
+            root = {"type": entity_type, "id": entity_id, **await self._policy_to_ghl(entity_type, policy, None)}
+            root["elapsed_ms"] = _elapsed_ms(write_started)
+            return self._report(root, [], fetch_ms, started)
+        
+        # Asegurado y colecciones relacionadas, todo en paralelo
+        fetches = [self.nowcerts_service.get_contact(entity_id)]
+        if include_related:
+            fetches += [self._list_insured_records(endpoint, entity_id) for endpoint in INSURED_RELATED.values()]
+        responses = await asyncio.gather(*fetches)
+        fetch_ms = _elapsed_ms(started)
+        
+        insured = InsuredData.model_validate(_unwrap(responses[0]))
+        if not insured.id:
+            insured.id = entity_id
+        write_started = time.perf_counter()
+        root = {"type": "contact", "id": entity_id, **await self._insured_to_ghl(insured)}
+        root["elapsed_ms"] = _elapsed_ms(write_started)
+        
+        related = [
+            {"type": kind, "id": record.get("id") or record.get("policyNumber"), "data": record}
+            for kind, records in zip(INSURED_RELATED, responses[1:])
+            for record in records
+        ]
+        contact_id = root["target_id"]
+        records = await self._fan_out(
+            related,
+            lambda record: self._policy_to_ghl(
+                record["type"], PolicyData.model_validate(record["data"]), contact_id
+            ),
+            progress
+        )
+        return self._report(root, records, fetch_ms, started)
+    
+    async def sync_ghl(
+        self,
+        entity_type: str,
+        entity_id: str,
+        include_related: bool = True,
+        progress: Optional[ProgressCallback] = None
+    ) -> Dict[str, Any]:
+        """
+        Sincroniza con NowCerts un contacto de GHL (con sus oportunidades) o una oportunidad
+        
+        Las oportunidades creadas por la integración desde NowCerts se omiten.
+        
+        Args:
+            entity_type: contact u opportunity
+            entity_id: ID en GHL
+            include_related: Incluir las oportunidades del contacto
+            progress: Se llama tras cada registro relacionado escrito
+        
+        Returns:
+            root (resultado de la entidad), records (relacionados), timings
+        """
+        started = time.perf_counter()
+        
+        if entity_type == "opportunity":
+            opportunity = GHLOpportunity.model_validate(
+                _unwrap(await self.ghl_service.get_opportunity(entity_id), "opportunity")
+            )
+            fetch_ms = _elapsed_ms(started)
+            write_started = time.perf_counter()
+            root = {"type": "opportunity", "id": entity_id, **await self._opportunity_to_nowcerts(opportunity)}
+            root["elapsed_ms"] = _elapsed_ms(write_started)
+            return self._report(root, [], fetch_ms, started)
+        
+        fetches = [self.ghl_service.get_contact(entity_id)]
+        if include_related:
+            fetches.append(self.ghl_service.list_contact_opportunities(entity_id))
+        responses = await asyncio.gather(*fetches)
+        fetch_ms = _elapsed_ms(started)
+        
+        contact = GHLContact.model_validate(_unwrap(responses[0], "contact"))
+        write_started = time.perf_counter()
+        root = {"type": "contact", "id": entity_id, **await self._ghl_contact_to_nowcerts(contact)}
+        root["elapsed_ms"] = _elapsed_ms(write_started)
+        
+        opportunities = responses[1].get("opportunities", []) if include_related else []
+        records = await self._fan_out(
+            [{"type": "opportunity", "id": item.get("id"), "data": item} for item in opportunities],
+            lambda record: self._opportunity_to_nowcerts(GHLOpportunity.model_validate(record["data"])),
+            progress
+        )
+        return self._report(root, records, fetch_ms, started)
+    
+    async def import_contacts(
+        self,
+        source: str,
+        contacts: List[Dict[str, Any]],
+        progress: Optional[ProgressCallback] = None
+    ) -> Dict[str, Any]:
+        """
+        Importación masiva de contactos al otro sistema
+        
+        Cada contacto sigue el mismo camino que la sincronización por ID
+        (diario, índice de emparejamiento, upsert), con un máximo de
+        SYNC_FANOUT_CONCURRENCY escrituras a la vez.
+        
+        Args:
+            source: nowcerts (asegurados → GHL) o ghl (contactos → NowCerts)
+            contacts: Registros en el formato del sistema origen
+            progress: Se llama tras cada contacto escrito
+        
+        Returns:
+            summary (contactos por resultado), errors (los que fallaron) y timings
+        """
+        started = time.perf_counter()
+        model, write = (
+            (InsuredData, self._insured_to_ghl) if source == "nowcerts"
+            else (GHLContact, self._ghl_contact_to_nowcerts)
+        )
+        records = await self._fan_out(
+            [
+                {"type": "contact", "id": contact.get("id") or str(position), "data": contact}
+                for position, contact in enumerate(contacts)
+            ],
+            lambda record: write(model.model_validate(record["data"])),
+            progress,
+            "Contactos importados"
+        )
+        report = self._report({}, records, 0.0, started)
+        # Solo los fallidos: el resultado de una importación grande se conserva en memoria
+        return {
+            "summary": report["summary"],
+            "errors": [record for record in records if record["status"] == "error"],
+            "timings": {"total_ms": report["timings"]["total_ms"]}
+        }
+    
+    async def _ghl_contact_to_nowcerts(self, contact: GHLContact) -> Dict[str, Any]:
+        contact_dict = contact.model_dump()
+        contact_match_index.upsert(GHL, contact.id, contact_dict)
+        async with sync_journal.writing(
+            "contact", contact_match_key(contact_dict), "ghl", "nowcerts",
+            contact_fingerprint(contact_dict), source_id=contact.id
+        ) as write:
+            result = await upsert_nowcerts_contact(
+                self.nowcerts_service, contact_dict, self.mapper.ghl_contact_to_nowcerts(contact)
+            )
+            write.target_id = result.get("id")
+        return {"status": "synced", "target_id": write.target_id}
+    
+    async def _opportunity_to_nowcerts(self, opportunity: GHLOpportunity) -> Dict[str, Any]:
+        if opportunity_writer.owns(opportunity) is not None:
+            return {"status": "skipped", "message": "Oportunidad creada desde NowCerts"}
+        result = await self.nowcerts_service.create_quote(self.mapper.ghl_opportunity_to_nowcerts_quote(opportunity))
+        return {"status": "synced", "target_id": result.get("id")}
+    
+    @staticmethod
+    def _report(root: Dict[str, Any], records: List[Dict[str, Any]], fetch_ms: float, started: float) -> Dict[str, Any]:
+        summary: Dict[str, int] = {}
+        for record in records:
+            summary[record["status"]] = summary.get(record["status"], 0) + 1
+        return {
+            "root": root,
+            "records": records,
+            "summary": summary,
+            "timings": {"fetch_ms": fetch_ms, "total_ms": _elapsed_ms(started)}
+        }
+
+
+# Instancia global de la sincronización por ID
+entity_sync = EntitySync()
@@ -0,0 +1,308 @@
+"""
+Procesamiento de eventos de NowCerts y GHL
+Lógica compartida por los webhooks y por el sondeo incremental de NowCerts
+"""
+from typing import Optional, Set
+from app.models.webhooks import (
+    NowCertsWebhookPayload,
+    GHLWebhookPayload,
+    InsuredEvent,
+    PolicyEvent,
+    QuoteEvent,
+    GHLContactEvent,
+    GHLOpportunityEvent,
+    WebhookResponse,
+    parse_nowcerts_event,
+    parse_ghl_event
+)
+from app.services.nowcerts_service import NowCertsService
+from app.services.ghl_service import GHLService
+from app.services.mapper import DataMapper, NOWCERTS_MAPPED_FIELDS
+from app.services.contact_writer import contact_writer
+from app.services.contact_matching import contact_match_index, upsert_nowcerts_contact, NOWCERTS, GHL
+from app.services.opportunity_writer import opportunity_writer
+from app.services.sync_journal import (
+    sync_journal,
+    contact_match_key,
+    contact_fingerprint,
+    CONTACT_SYNC_FIELDS
+)
+from app.core.json_codec import dumps
+from app.core.payload_archive import payload_archive
+from app.core.idempotency import (
+    generate_event_id,
+    is_duplicate,
+    begin_processing,
+    mark_event_processed,
+    key_field_paths
+)
+from app.core.logger import logger, log_payload, log_response
+from app.core.config import settings
+from app.core.exceptions import DuplicateEventError, EventNotReadyError
+from app.core.timing import phase, mark_validated
+
+nowcerts_service = NowCertsService()
+ghl_service = GHLService()
+mapper = DataMapper()
+
+
+def nowcerts_payload_paths() -> Set[str]:
+    """
+    Campos de un evento de NowCerts que usa el procesamiento
+    
+    Incluye los que leen los mapeos y los que forman la clave semántica;
+    son los que se conservan al proyectar payloads grandes.
+    
+    Returns:
+        Rutas con puntos (p. ej. "data.email")
+    """
+    paths = {"event_type", "timestamp"}
+    paths.update(f"data.{field}" for field in NOWCERTS_MAPPED_FIELDS)
+    paths.update(key_field_paths("nowcerts"))
+    return paths
+
+
+def _archive(source: str, event_id: str, payload_dict: dict, raw_body: Optional[bytes]):
+    """Archiva el body recibido (o el payload reconstruido si no hay body crudo)"""
+    if payload_archive.enabled:
+        with phase("archive"):
+            if raw_body is not None:
+                payload_archive.append(source, event_id, raw_body)
+            else:
+                payload_archive.append(source, event_id, dumps(payload_dict), raw=False)
+
+
+async def process_nowcerts_event(
+    payload: NowCertsWebhookPayload,
+    raw_body: Optional[bytes] = None
+) -> WebhookResponse:
+    """
+    Procesa un evento de NowCerts y lo sincroniza con GHL
+    
+    Eventos soportados:
+    - INSURED_INSERT / INSURED_UPDATE: Sincroniza contactos con GHL
+    - POLICY_INSERT / POLICY_UPDATE: Crea/actualiza oportunidades en GHL
+    - QUOTE_INSERT / QUOTE_UPDATE: Crea/actualiza oportunidades en GHL
+      (una llamada por evento con el índice de oportunidades)
+    
+    Args:
+        payload: Evento de NowCerts (webhook o registro obtenido por sondeo),
+            validado con parse_nowcerts_event
+        raw_body: Body tal como se recibió, para el archivo de payloads
+    
+    Returns:
+        Respuesta con el resultado del procesamiento
+    
+    Raises:
+        DuplicateEventError: Si el evento ya fue procesado
+        EventNotReadyError: Si es una póliza/cotización cuyo asegurado aún no
+            está en GHL (no se marca como procesado, para aceptar la reentrega)
+    """
+    mark_validated()
+    payload = parse_nowcerts_event(payload)
+    
+    # Log del payload recibido (el JSON recibido, sin volcar el modelo)
+    with phase("dump"):
+        payload_dict = payload.raw_dict()
+    with phase("log"):
+        log_payload("NOWCERTS_WEBHOOK", payload_dict, "incoming")
+    
+    # Generar ID del evento y verificar duplicados
+    with phase("idempotency"):
+        event_id = generate_event_id(payload_dict, "nowcerts")
+        duplicate = is_duplicate(event_id)
+    if duplicate:
+        logger.warning(f"Evento duplicado detectado: {event_id}")
+        raise DuplicateEventError(f"Evento ya procesado: {event_id}")
+    begin_processing(event_id, "nowcerts")
+    _archive("nowcerts", event_id, payload_dict, raw_body)
+    
+    # Procesar según el tipo de evento (el modelo ya lo resolvió al validar)
+    event_type = payload.event_type.upper()
+    result_data = None
+    
+    if isinstance(payload, InsuredEvent):
+        # Sincronizar contacto con GHL
+        contact_data = payload.data
+        with phase("map"):
+            ghl_contact_data = mapper.insured_to_ghl_contact(contact_data)
+            entity_key = contact_match_key(ghl_contact_data)
+            content_hash = contact_fingerprint(ghl_contact_data)
+        # El índice de emparejamiento sigue cada cambio, también los ecos
+        contact_match_index.upsert(NOWCERTS, contact_data.id, ghl_contact_data)
+        
+        if sync_journal.is_echo("contact", entity_key, "nowcerts", content_hash):
+            # Es nuestra propia escritura en NowCerts volviendo: no reenviarla a GHL
+            sync_journal.record_echo(
+                "contact", entity_key, "nowcerts", content_hash,
+                source_id=contact_data.id, event_id=event_id
+            )
+            logger.info(f"Eco de escritura propia en NowCerts descartado: {entity_key}")
+            result_data = {"message": "Eco de una escritura de la integración; no se reenvía"}
+        else:
+            # Upsert (coincidencia por email/teléfono) para INSERT y UPDATE;
+            # el escritor por lotes combina ráfagas del mismo contacto
+            async with sync_journal.writing(
+                "contact", entity_key, "nowcerts", "ghl", content_hash,
+                source_id=contact_data.id, event_id=event_id
+            ) as write:
+                with phase("ghl_write"):
+                    result = await contact_writer.upsert(ghl_contact_data)
+                contact = result.get("contact") or result
+                write.target_id = contact.get("id")
+            contact_match_index.upsert(GHL, write.target_id, ghl_contact_data)
+            
+            result_data = result
+            logger.info(f"Contacto sincronizado con GHL: {contact.get('id', 'N/A')}")
+    
+    elif isinstance(payload, (PolicyEvent, QuoteEvent)):
+        # Crear/actualizar oportunidad en GHL: el índice de oportunidades
+        # decide entre update (ya existe; también un INSERT repetido) y create
+        kind = "policy" if isinstance(payload, PolicyEvent) else "quote"
+        with phase("ghl_write"):
+            result_data = await opportunity_writer.upsert(kind, payload.data)
+        
+        if result_data["action"] == "skipped" and result_data.get("retryable"):
+            # Llegó antes que su asegurado: sin marcarlo, la reentrega de
+            # NowCerts (o el siguiente sondeo) lo procesará
+            logger.info(f"Oportunidad de {kind} pendiente, se reintentará: {result_data['message']}")
+            raise EventNotReadyError(
+                result_data["message"], retry_after=settings.OPPORTUNITY_PENDING_RETRY_AFTER_SECONDS
+            )
+        elif result_data["action"] == "skipped":
+            logger.warning(f"Oportunidad de {kind} no sincronizada: {result_data['message']}")
+        else:
+            logger.info(
+                f"Oportunidad {result_data['action']} en GHL para {kind} "
+                f"{result_data['number']}: {result_data.get('opportunity_id') or 'N/A'}"
+            )
+    
+    else:
+        logger.warning(f"Tipo de evento no soportado: {event_type}")
+        result_data = {"message": f"Evento {event_type} no procesado"}
+    
+    # Marcar evento como procesado
+    mark_event_processed(event_id)
+    
+    # Log de respuesta
+    with phase("log"):
+        log_response("NOWCERTS_WEBHOOK", result_data or {}, "outgoing")
+    
+    return WebhookResponse(
+        success=True,
+        message=f"Evento {event_type} procesado exitosamente",
+        event_id=event_id,
+        data=result_data
+    )
+
+
+async def process_ghl_event(
+    payload: GHLWebhookPayload,
+    raw_body: Optional[bytes] = None
+) -> WebhookResponse:
+    """
+    Procesa un evento de GHL y lo sincroniza con NowCerts
+    
+    Eventos soportados:
+    - Contactos: Sincroniza con NowCerts como asegurados
+    - Oportunidades: Puede crear cotizaciones en NowCerts
+    
+    Args:
+        payload: Evento de GHL, validado con parse_ghl_event
+        raw_body: Body tal como se recibió, para el archivo de payloads
+    
+    Returns:
+        Respuesta con el resultado del procesamiento
+    
+    Raises:
+        DuplicateEventError: Si el evento ya fue procesado
+    """
+    mark_validated()
+    payload = parse_ghl_event(payload)
+    
+    # Log del payload recibido (el JSON recibido, sin volcar el modelo)
+    with phase("dump"):
+        payload_dict = payload.raw_dict()
+    with phase("log"):
+        log_payload("GHL_WEBHOOK", payload_dict, "incoming")
+    
+    # Generar ID del evento y verificar duplicados
+    with phase("idempotency"):
+        event_id = generate_event_id(payload_dict, "ghl")
+        duplicate = is_duplicate(event_id)
+    if duplicate:
+        logger.warning(f"Evento duplicado detectado: {event_id}")
+        raise DuplicateEventError(f"Evento ya procesado: {event_id}")
+    begin_processing(event_id, "ghl")
+    _archive("ghl", event_id, payload_dict, raw_body)
+    
+    result_data = None
+    
+    # Procesar según el tipo de evento
+    if isinstance(payload, GHLContactEvent):
+        # Sincronizar contacto con NowCerts
+        contact_data = payload.contact
+        with phase("map"):
+            nowcerts_contact_data = mapper.ghl_contact_to_nowcerts(contact_data)
+            contact_dict = contact_data.model_dump(include=set(CONTACT_SYNC_FIELDS))
+            entity_key = contact_match_key(contact_dict)
+            content_hash = contact_fingerprint(contact_dict)
+        contact_match_index.upsert(GHL, contact_data.id, contact_dict)
+        
+        if sync_journal.is_echo("contact", entity_key, "ghl", content_hash):
+            # Es nuestra propia escritura en GHL volviendo: no reenviarla a NowCerts
+            sync_journal.record_echo(
+                "contact", entity_key, "ghl", content_hash,
+                source_id=contact_data.id, event_id=event_id
+            )
+            logger.info(f"Eco de escritura propia en GHL descartado: {entity_key}")
+            result_data = {"message": "Eco de una escritura de la integración; no se reenvía"}
+        else:
+            # Actualizar la contraparte en NowCerts si el índice local la
+            # encuentra; si no, crear el contacto
+            async with sync_journal.writing(
+                "contact", entity_key, "ghl", "nowcerts", content_hash,
+                source_id=contact_data.id, event_id=event_id
+            ) as write:
+                with phase("nowcerts_write"):
+                    result = await upsert_nowcerts_contact(
+                        nowcerts_service, contact_dict, nowcerts_contact_data
+                    )
+                write.target_id = result.get("id")
+            result_data = result
+            logger.info(f"Contacto sincronizado con NowCerts: {result.get('id', 'N/A')}")
+    
+    elif isinstance(payload, GHLOpportunityEvent):
+        # Crear cotización en NowCerts basada en la oportunidad
+        opportunity_data = payload.opportunity
+        
+        if opportunity_writer.owns(opportunity_data) is not None:
+            # La creamos nosotros a partir de una póliza/cotización de NowCerts
+            logger.info(f"Oportunidad {opportunity_data.id or 'N/A'} gestionada desde NowCerts; se ignora")
+            result_data = {"message": "Oportunidad creada desde NowCerts; no se crea cotización"}
+        else:
+            # Mapear oportunidad a cotización (simplificado)
+            with phase("map"):
+                quote_data = mapper.ghl_opportunity_to_nowcerts_quote(opportunity_data)
+            
+            result = await nowcerts_service.create_quote(quote_data)
+            result_data = result
+            logger.info(f"Cotización creada en NowCerts: {result.get('id', 'N/A')}")
+    
+    else:
+        logger.warning("Webhook de GHL sin datos de contacto u oportunidad")
+        result_data = {"message": "No se procesó ningún dato"}
+    
+    # Marcar evento como procesado
+    mark_event_processed(event_id)
+    
+    # Log de respuesta
+    with phase("log"):
+        log_response("GHL_WEBHOOK", result_data or {}, "outgoing")
+    
+    return WebhookResponse(
+        success=True,
+        message="Evento de GHL procesado exitosamente",
+        event_id=event_id,
+        data=result_data
+    )
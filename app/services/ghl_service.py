@@ -6,12 +6,21 @@ from typing import Optional, Dict, Any
 from app.core.config import settings
 from app.core.exceptions import ExternalAPIError, ExternalAPIConnectionError
 from app.core.logger import logger
+from app.core.memory import memory_registry, container_usage
 from app.core.retry import retry_with_backoff
+from app.core.adaptive_limiter import get_limiter
+from app.core.http_client import get_client, send_request
+from app.core.json_codec import loads
+from app.core.singleflight import COALESCED_METHODS, read_key, upstream_reads
+from app.core.tracing import span
 
 
 class GHLService:
     """Servicio para manejar operaciones con GoHighLevel API"""
     
+    # Metadatos de la ubicación compartidos entre instancias (pipelines, etc.)
+    _metadata_cache: Dict[str, Any] = {}
+    
     def __init__(self):
         self.base_url = settings.GHL_BASE_URL
         self.api_key = settings.GHL_API_KEY
@@ -31,7 +40,8 @@ class GHLService:
         method: str,
         endpoint: str,
         json_data: Optional[Dict[str, Any]] = None,
-        params: Optional[Dict[str, Any]] = None
+        params: Optional[Dict[str, Any]] = None,
+        coalesce: Optional[bool] = None
     ) -> Dict[str, Any]:
         """
         Realiza una petición a la API de GHL con reintentos
@@ -41,34 +51,33 @@ class GHLService:
             endpoint: Endpoint relativo de la API
             json_data: Datos JSON para el body (opcional)
             params: Parámetros de query (opcional)
+            coalesce: Compartir la llamada con peticiones idénticas en curso
+                (por defecto solo GET); el resultado compartido es de solo lectura
         
         Returns:
             Respuesta JSON de la API
         """
         url = f"{self.base_url}{endpoint}"
+        limiter = get_limiter("ghl")
+        attempt = 0
         
         async def _execute_request():
+            nonlocal attempt
+            attempt += 1
             headers = self._get_headers()
+            client = get_client("ghl")
             
-            async with httpx.AsyncClient(timeout=30.0) as client:
+            with span("ghl.request", method=method, endpoint=endpoint, attempt=attempt) as request_span:
                 try:
-                    if method.upper() == "GET":
-                        response = await client.get(url, headers=headers, params=params)
-                    elif method.upper() == "POST":
-                        response = await client.post(url, json=json_data, headers=headers, params=params)
-                    elif method.upper() == "PUT":
-                        response = await client.put(url, json=json_data, headers=headers, params=params)
-                    elif method.upper() == "DELETE":
-                        response = await client.delete(url, headers=headers, params=params)
-                    else:
-                        raise ExternalAPIError(
-                            status_code=400,
-                            detail=f"Método {method} no soportado",
-                            service_name=self.service_name
-                        )
+                    response = await send_request(
+                        client, method, url, self.service_name,
+                        headers=headers, json_data=json_data, params=params,
+                        limiter=limiter
+                    )
+                    request_span.set_attribute("status_code", response.status_code)
                     
                     response.raise_for_status()
-                    return response.json()
+                    return loads(response.content)
                 
                 except httpx.HTTPStatusError as e:
                     error_detail = e.response.text if e.response.text else str(e)
@@ -84,6 +93,12 @@ class GHLService:
                         service_name=self.service_name
                     )
         
+        if coalesce is None:
+            coalesce = method.upper() in COALESCED_METHODS
+        if coalesce:
+            key = read_key(method, url, self.location_id, params, json_data)
+            return await upstream_reads.do(key, lambda: retry_with_backoff(_execute_request))
+        
         return await retry_with_backoff(_execute_request)
     
     async def create_contact(self, contact_data: Dict[str, Any]) -> Dict[str, Any]:
@@ -115,6 +130,63 @@ class GHLService:
         params = {"locationId": self.location_id} if self.location_id else None
         return await self._make_request("PUT", endpoint, contact_data, params)
     
+    async def get_contact(self, contact_id: str) -> Dict[str, Any]:
+        """
+        Obtiene un contacto de GHL
+        
+        Args:
+            contact_id: ID del contacto
+        
+        Returns:
+            Respuesta de GHL ({"contact": {...}})
+        """
+        return await self._make_request("GET", f"/contacts/{contact_id}")
+    
+    async def list_contacts(
+        self,
+        limit: int = 100,
+        start_after_id: Optional[str] = None,
+        start_after: Optional[Any] = None
+    ) -> Dict[str, Any]:
+        """
+        Obtiene una página de contactos de la ubicación
+        
+        Args:
+            limit: Contactos por página
+            start_after_id: Cursor (meta.startAfterId de la página anterior)
+            start_after: Cursor (meta.startAfter de la página anterior)
+        
+        Returns:
+            Respuesta de GHL ({"contacts": [...], "meta": {...}})
+        """
+        params: Dict[str, Any] = {"limit": limit}
+        if self.location_id:
+            params["locationId"] = self.location_id
+        if start_after_id:
+            params["startAfterId"] = start_after_id
+        if start_after is not None:
+            params["startAfter"] = start_after
+        return await self._make_request("GET", "/contacts/", params=params)
+    
+    async def upsert_contact(self, contact_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Crea o actualiza un contacto en GHL (coincidencia por email/teléfono)
+        
+        GHL aplica la regla de duplicados de la ubicación: si existe un contacto
+        con el mismo email o teléfono lo actualiza, si no lo crea.
+        
+        Args:
+            contact_data: Datos del contacto
+        
+        Returns:
+            Respuesta de GHL ({"new": bool, "contact": {...}})
+        """
+        endpoint = "/contacts/upsert"
+        payload = dict(contact_data)
+        if self.location_id:
+            payload.setdefault("locationId", self.location_id)
+        return await self._make_request("POST", endpoint, payload)
+    
     async def create_opportunity(
         self,
         contact_id: str,
@@ -156,4 +228,53 @@ class GHLService:
         endpoint = f"/opportunities/{opportunity_id}"
         params = {"locationId": self.location_id} if self.location_id else None
         return await self._make_request("PUT", endpoint, opportunity_data, params)
+    
+    async def get_opportunity(self, opportunity_id: str) -> Dict[str, Any]:
+        """
+        Obtiene una oportunidad de GHL
+        
+        Args:
+            opportunity_id: ID de la oportunidad
+        
+        Returns:
+            Respuesta de GHL ({"opportunity": {...}})
+        """
+        return await self._make_request("GET", f"/opportunities/{opportunity_id}")
+    
+    async def list_contact_opportunities(self, contact_id: str, limit: int = 100) -> Dict[str, Any]:
+        """
+        Obtiene las oportunidades de un contacto de GHL
+        
+        Args:
+            contact_id: ID del contacto
+            limit: Máximo de oportunidades
+        
+        Returns:
+            Respuesta de GHL ({"opportunities": [...]})
+        """
+        params: Dict[str, Any] = {"contact_id": contact_id, "limit": limit}
+        if self.location_id:
+            params["location_id"] = self.location_id
+        return await self._make_request("GET", "/opportunities/search", params=params)
+    
+    async def get_pipelines(self, force_refresh: bool = False) -> Dict[str, Any]:
+        """
+        Obtiene los pipelines de oportunidades de la ubicación (con cache)
+        
+        Args:
+            force_refresh: Si es True, ignora el cache
+        
+        Returns:
+            Respuesta de GHL con la lista de pipelines
+        """
+        if not force_refresh and "pipelines" in self._metadata_cache:
+            return self._metadata_cache["pipelines"]
+        
+        endpoint = "/opportunities/pipelines"
+        params = {"locationId": self.location_id} if self.location_id else None
+        result = await self._make_request("GET", endpoint, params=params)
+        GHLService._metadata_cache["pipelines"] = result
+        return result
+
 
+memory_registry.register("ghl.metadata_cache", "cache", lambda: container_usage(GHLService._metadata_cache))
@@ -3,10 +3,60 @@ Mapeo de datos entre NowCerts y GoHighLevel
 """
 from typing import Dict, Any, Optional
 from app.core.logger import logger
+from app.models.webhooks import (
+    InsuredData,
+    NowCertsAddress,
+    PolicyData,
+    GHLContact,
+    GHLOpportunity
+)
+
+# Campos de NowCerts que leen los mapeos hacia GHL (contacto y oportunidad);
+# al proyectar payloads grandes solo se conservan estos. Mantener al día
+# si los mapeos usan campos nuevos.
+NOWCERTS_MAPPED_FIELDS = (
+    "firstName", "lastName", "email", "phone", "address", "source",
+    "policyType", "policyNumber", "premium", "carrier",
+    "effectiveDate", "expirationDate",
+    "id", "insuredDatabaseId", "insuredId"
+)
+
+_EMPTY_ADDRESS = NowCertsAddress()
 
 
 class DataMapper:
-    """Mapea datos entre los formatos de NowCerts y GHL"""
+    """
+    Mapea datos entre los formatos de NowCerts y GHL
+    
+    Los métodos tipados (insured_to_ghl_contact, ...) reciben los modelos de
+    app.models.webhooks ya validados; los que reciben diccionarios los
+    validan primero y delegan en ellos.
+    """
+    
+    @staticmethod
+    def ghl_contact_to_nowcerts(contact: GHLContact) -> Dict[str, Any]:
+        """
+        Convierte un contacto de GHL a formato NowCerts
+        
+        Args:
+            contact: Contacto de GHL
+        
+        Returns:
+            Datos en formato NowCerts
+        """
+        return {
+            "firstName": contact.firstName,
+            "lastName": contact.lastName,
+            "email": contact.email,
+            "phone": contact.phone,
+            "address": {
+                "street": contact.address1,
+                "city": contact.city,
+                "state": contact.state,
+                "zip": contact.postalCode
+            },
+            "source": contact.source
+        }
     
     @staticmethod
     def ghl_to_nowcerts_contact(ghl_data: Dict[str, Any]) -> Dict[str, Any]:
@@ -19,18 +69,31 @@ class DataMapper:
         Returns:
             Datos en formato NowCerts
         """
+        return DataMapper.ghl_contact_to_nowcerts(GHLContact.model_validate(ghl_data))
+    
+    @staticmethod
+    def insured_to_ghl_contact(insured: InsuredData) -> Dict[str, Any]:
+        """
+        Convierte un asegurado de NowCerts a contacto de GHL
+        
+        Args:
+            insured: Datos del asegurado
+        
+        Returns:
+            Datos en formato GHL
+        """
+        address = insured.address or _EMPTY_ADDRESS
+        
         return {
-            "firstName": ghl_data.get("firstName", ""),
-            "lastName": ghl_data.get("lastName", ""),
-            "email": ghl_data.get("email", ""),
-            "phone": ghl_data.get("phone", ""),
-            "address": {
-                "street": ghl_data.get("address1", ""),
-                "city": ghl_data.get("city", ""),
-                "state": ghl_data.get("state", ""),
-                "zip": ghl_data.get("postalCode", "")
-            },
-            "source": ghl_data.get("source", "GHL")
+            "firstName": insured.firstName,
+            "lastName": insured.lastName,
+            "email": insured.email,
+            "phone": insured.phone,
+            "address1": address.street,
+            "city": address.city,
+            "state": address.state,
+            "postalCode": address.zip,
+            "source": insured.source
         }
     
     @staticmethod
@@ -44,37 +107,25 @@ class DataMapper:
         Returns:
             Datos en formato GHL
         """
-        address = nowcerts_data.get("address", {})
-        
-        return {
-            "firstName": nowcerts_data.get("firstName", ""),
-            "lastName": nowcerts_data.get("lastName", ""),
-            "email": nowcerts_data.get("email", ""),
-            "phone": nowcerts_data.get("phone", ""),
-            "address1": address.get("street", ""),
-            "city": address.get("city", ""),
-            "state": address.get("state", ""),
-            "postalCode": address.get("zip", ""),
-            "source": nowcerts_data.get("source", "NowCerts")
-        }
+        return DataMapper.insured_to_ghl_contact(InsuredData.model_validate(nowcerts_data))
     
     @staticmethod
-    def nowcerts_to_ghl_opportunity(
-        nowcerts_data: Dict[str, Any],
+    def policy_to_ghl_opportunity(
+        policy: PolicyData,
         contact_id: Optional[str] = None
     ) -> Dict[str, Any]:
         """
-        Convierte datos de póliza/cotización de NowCerts a oportunidad en GHL
+        Convierte una póliza/cotización de NowCerts a oportunidad en GHL
         
         Args:
-            nowcerts_data: Datos de póliza o cotización desde NowCerts
+            policy: Datos de la póliza o cotización
             contact_id: ID del contacto en GHL (opcional)
         
         Returns:
             Datos de oportunidad en formato GHL
         """
         # Mapear tipo de póliza a pipeline/stage
-        policy_type = nowcerts_data.get("policyType", "General")
+        policy_type = policy.policyType
         
         # Mapeo básico de tipos de póliza
         pipeline_mapping = {
@@ -88,10 +139,10 @@ class DataMapper:
         pipeline_name = pipeline_mapping.get(policy_type, "General Insurance")
         
         opportunity = {
-            "name": f"{policy_type} Policy - {nowcerts_data.get('policyNumber', 'N/A')}",
+            "name": f"{policy_type} Policy - {policy.policyNumber or 'N/A'}",
             "pipelineId": None,  # Debe configurarse según el setup de GHL
             "pipelineStageId": None,  # Debe configurarse según el setup de GHL
-            "monetaryValue": nowcerts_data.get("premium", 0),
+            "monetaryValue": policy.premium,
             "customFields": [
                 {
                     "key": "policy_type",
@@ -99,23 +150,23 @@ class DataMapper:
                 },
                 {
                     "key": "policy_number",
-                    "value": nowcerts_data.get("policyNumber", "")
+                    "value": policy.policyNumber or ""
                 },
                 {
                     "key": "carrier",
-                    "value": nowcerts_data.get("carrier", "")
+                    "value": policy.carrier
                 },
                 {
                     "key": "effective_date",
-                    "value": nowcerts_data.get("effectiveDate", "")
+                    "value": policy.effectiveDate
                 },
                 {
                     "key": "expiration_date",
-                    "value": nowcerts_data.get("expirationDate", "")
+                    "value": policy.expirationDate
                 },
                 {
                     "key": "premium",
-                    "value": str(nowcerts_data.get("premium", 0))
+                    "value": str(policy.premium)
                 }
             ]
         }
@@ -124,4 +175,38 @@ class DataMapper:
             opportunity["contactId"] = contact_id
         
         return opportunity
-
+    
+    @staticmethod
+    def nowcerts_to_ghl_opportunity(
+        nowcerts_data: Dict[str, Any],
+        contact_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Convierte datos de póliza/cotización de NowCerts a oportunidad en GHL
+        
+        Args:
+            nowcerts_data: Datos de póliza o cotización desde NowCerts
+            contact_id: ID del contacto en GHL (opcional)
+        
+        Returns:
+            Datos de oportunidad en formato GHL
+        """
+        return DataMapper.policy_to_ghl_opportunity(PolicyData.model_validate(nowcerts_data), contact_id)
+    
+    @staticmethod
+    def ghl_opportunity_to_nowcerts_quote(opportunity: GHLOpportunity) -> Dict[str, Any]:
+        """
+        Convierte una oportunidad de GHL a cotización de NowCerts (simplificado)
+        
+        Args:
+            opportunity: Oportunidad de GHL
+        
+        Returns:
+            Datos de cotización en formato NowCerts
+        """
+        return {
+            "policyType": opportunity.custom_field("policy_type", "General"),
+            "premium": opportunity.monetaryValue,
+            "carrier": opportunity.custom_field("carrier", ""),
+            "source": "GHL"
+        }
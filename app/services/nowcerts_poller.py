@@ -0,0 +1,337 @@
+"""
+Sondeo incremental de cambios en NowCerts (CDC basado en marca de agua)
+Complementa los webhooks para agencias que no pueden configurarlos y
+recupera eventos perdidos en la entrega de webhooks
+"""
+import asyncio
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, List, Tuple
+from pydantic import ValidationError
+from app.core.config import settings
+from app.core.exceptions import DuplicateEventError, EventNotReadyError
+from app.core.logger import logger
+from app.core.priority import BULK, lane
+from app.core.storage import atomic_write_json, read_json
+from app.core.tracing import start_trace
+from app.models.webhooks import parse_nowcerts_event
+from app.services.event_processor import process_nowcerts_event
+from app.services.nowcerts_service import NowCertsService, parse_page
+
+# Colecciones sondeadas: nombre -> (endpoint, tipo de evento equivalente).
+# El sondeo no distingue altas de cambios; la clave de idempotencia de estos
+# tipos no incluye INSERT/UPDATE (ver app.core.idempotency.DEFAULT_KEY_FIELDS)
+POLL_COLLECTIONS: Dict[str, Tuple[str, str]] = {
+    "insureds": ("/api/contacts", "INSURED_UPDATE"),
+    "policies": ("/api/policies", "POLICY_UPDATE"),
+    "quotes": ("/api/quotes", "QUOTE_UPDATE")
+}
+
+# Campos de fecha de modificación de un registro, en orden de preferencia
+CHANGED_AT_FIELDS = ("modifiedDate", "changeDate", "lastModified")
+
+
+def _changed_at(record: Dict[str, Any]) -> Optional[str]:
+    for field in CHANGED_AT_FIELDS:
+        value = record.get(field)
+        if value:
+            return str(value)
+    return None
+
+
+def parse_changed_at(value: Optional[str]) -> Optional[datetime]:
+    """
+    Fecha de modificación como datetime con zona (UTC si no la trae)
+    
+    Acepta "Z" o "+00:00" y cualquier número de decimales en los segundos
+    (.NET envía 7); comparar las cadenas tal cual ordenaría mal formatos
+    mezclados.
+    
+    Returns:
+        datetime o None si no se puede interpretar
+    """
+    if not value:
+        return None
+    text = value.strip().replace(" ", "T", 1)
+    if text.endswith(("Z", "z")):
+        text = text[:-1] + "+00:00"
+    date_part, sep, time_part = text.partition("T")
+    if "." in time_part:
+        # fromisoformat (antes de 3.11) solo admite 3 o 6 decimales
+        seconds, _, rest = time_part.partition(".")
+        digits = len(rest) - len(rest.lstrip("0123456789"))
+        time_part = f"{seconds}.{rest[:digits][:6].ljust(6, '0')}{rest[digits:]}"
+    try:
+        parsed = datetime.fromisoformat(date_part + sep + time_part)
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo is not None else parsed.replace(tzinfo=timezone.utc)
+
+
+def _earliest_failure(failed: List[str]) -> Optional[str]:
+    """Fecha del fallido que frena la marca de agua (primero las que no se interpretan)"""
+    if not failed:
+        return None
+    unparseable = [value for value in failed if parse_changed_at(value) is None]
+    if unparseable:
+        return min(unparseable)
+    return min(failed, key=parse_changed_at)
+
+
+class NowCertsPoller:
+    """
+    Sondea NowCerts en segundo plano buscando registros modificados
+    
+    Por cada colección pide los registros modificados desde la marca de agua
+    guardada, descarga varias páginas a la vez y envía cada registro por el
+    mismo camino que los webhooks (process_nowcerts_event). La clave de
+    idempotencia (tipo de entidad, ID y fecha de modificación) no depende de
+    INSERT/UPDATE, así que lo que ya llegó por webhook se descarta. La marca
+    de agua se guarda de forma atómica, se ordena por fecha (no por texto) y
+    solo avanza hasta el primer registro fallido; las páginas siguientes se
+    procesan igualmente (la idempotencia descarta lo ya hecho al repetirlas).
+    Si el mismo registro frena la marca de agua NOWCERTS_POLL_MAX_STUCK_ROUNDS
+    vueltas seguidas, se registra en el log y se deja atrás.
+    
+    El intervalo se adapta al ritmo de cambios: se acorta cuando hay cambios
+    (al mínimo si hay más de una página) y se alarga cuando no los hay.
+    """
+    
+    def __init__(
+        self,
+        nowcerts_service: Optional[NowCertsService] = None,
+        state_file: Optional[str] = None
+    ):
+        self.nowcerts_service = nowcerts_service or NowCertsService()
+        self.state_file = state_file or settings.NOWCERTS_POLL_STATE_FILE
+        self.min_interval = settings.NOWCERTS_POLL_MIN_INTERVAL_SECONDS
+        self.max_interval = settings.NOWCERTS_POLL_MAX_INTERVAL_SECONDS
+        self.page_size = settings.NOWCERTS_POLL_PAGE_SIZE
+        self.concurrency = settings.NOWCERTS_POLL_CONCURRENCY
+        self.max_stuck_rounds = settings.NOWCERTS_POLL_MAX_STUCK_ROUNDS
+        
+        self.interval = self.min_interval
+        self.watermarks: Dict[str, str] = (
+            read_json(self.state_file, default={}) if self.state_file else {}
+        ) or {}
+        self.last_poll: Dict[str, Any] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._stop_event: Optional[asyncio.Event] = None
+        # Colección -> (fecha del registro que frena la marca de agua, vueltas seguidas)
+        self._stuck: Dict[str, Tuple[str, int]] = {}
+    
+    def start(self):
+        """Arranca el sondeo en segundo plano"""
+        if self._task is not None and not self._task.done():
+            return
+        self._stop_event = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logger.info("Sondeo incremental de NowCerts iniciado")
+    
+    async def stop(self, timeout: float = 10.0):
+        """
+        Detiene el sondeo, esperando a que termine la vuelta en curso
+        
+        Args:
+            timeout: Tiempo máximo de espera antes de cancelar
+        """
+        if self._task is None:
+            return
+        self._stop_event.set()
+        try:
+            await asyncio.wait_for(self._task, timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Sondeo de NowCerts cancelado durante el cierre")
+        self._task = None
+    
+    async def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                changes, busy = await self.poll_once()
+                self._adapt_interval(changes, busy)
+            except Exception as e:
+                logger.error(f"Error en el sondeo de NowCerts: {str(e)}", exc_info=True)
+                self.interval = min(self.max_interval, self.interval * 2)
+            
+            try:
+                await asyncio.wait_for(self._stop_event.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+    
+    def _adapt_interval(self, changes: int, busy: bool):
+        if busy:
+            self.interval = self.min_interval
+        elif changes:
+            self.interval = max(self.min_interval, self.interval / 2)
+        else:
+            self.interval = min(self.max_interval, self.interval * settings.NOWCERTS_POLL_IDLE_BACKOFF)
+    
+    async def poll_once(self) -> Tuple[int, bool]:
+        """
+        Ejecuta una vuelta de sondeo sobre todas las colecciones
+        
+        Returns:
+            (registros modificados encontrados, True si alguna colección tenía más de una página)
+        """
+        started = datetime.now(timezone.utc)
+        total_changes = 0
+        busy = False
+        collections: Dict[str, Any] = {}
+        
+        for name, (endpoint, event_type) in POLL_COLLECTIONS.items():
+            # El sondeo es tráfico de fondo: no debe retrasar a los webhooks
+            with lane(BULK):
+                changes, pages = await self._poll_collection(name, endpoint, event_type)
+            total_changes += changes
+            busy = busy or pages > 1
+            collections[name] = {"changes": changes, "pages": pages}
+        
+        self.last_poll = {
+            "started_at": started.isoformat(),
+            "duration_seconds": (datetime.now(timezone.utc) - started).total_seconds(),
+            "changes": total_changes,
+            "collections": collections
+        }
+        if total_changes:
+            logger.info(f"Sondeo de NowCerts: {total_changes} registros modificados")
+        return total_changes, busy
+    
+    async def _poll_collection(self, name: str, endpoint: str, event_type: str) -> Tuple[int, int]:
+        since = self.watermarks.get(name)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        changed: List[str] = []
+        failed: List[Optional[str]] = []
+        
+        async def _process(record: Dict[str, Any]):
+            changed_at = _changed_at(record)
+            try:
+                payload = parse_nowcerts_event({
+                    "event_type": event_type,
+                    "timestamp": changed_at,
+                    "data": record
+                })
+            except ValidationError as e:
+                # Reintentarlo no lo arreglaría: se descarta sin frenar la marca de agua
+                logger.warning(
+                    f"Registro sondeado de {name} no válido, se descarta: {e.error_count()} errores"
+                )
+                if changed_at:
+                    changed.append(changed_at)
+                return
+            async with semaphore:
+                try:
+                    with start_trace("poll.nowcerts", collection=name, event_type=event_type):
+                        await process_nowcerts_event(payload)
+                except DuplicateEventError:
+                    pass
+                except EventNotReadyError as e:
+                    # Póliza antes que su asegurado: la marca de agua no avanza y se reintenta
+                    logger.info(f"Registro sondeado de {name} pendiente: {e.detail}")
+                    failed.append(changed_at)
+                    return
+                except Exception as e:
+                    logger.warning(f"Error procesando registro sondeado de {name}: {str(e)}")
+                    failed.append(changed_at)
+                    return
+            if changed_at:
+                changed.append(changed_at)
+        
+        async def _fetch(page: int) -> List[Dict[str, Any]]:
+            async with semaphore:
+                response = await self.nowcerts_service.list_changed_records(
+                    endpoint, since, page=page, page_size=self.page_size
+                )
+            return parse_page(response)[0]
+        
+        # La primera página indica (si la API lo informa) cuántas hay en total
+        first = await self.nowcerts_service.list_changed_records(
+            endpoint, since, page=1, page_size=self.page_size
+        )
+        records, total = parse_page(first)
+        page_count = 1
+        count = len(records)
+        await asyncio.gather(*(_process(record) for record in records))
+        
+        next_page = 2
+        more = len(records) >= self.page_size
+        # Un registro fallido solo frena la marca de agua, no el resto de páginas
+        while more:
+            if total is not None:
+                last_page = -(-total // self.page_size)
+                window = list(range(next_page, min(next_page + self.concurrency, last_page + 1)))
+            else:
+                window = list(range(next_page, next_page + self.concurrency))
+            if not window:
+                break
+            
+            # Descargar una ventana de páginas a la vez y procesarla antes de
+            # pedir la siguiente, para acotar la memoria
+            pages = await asyncio.gather(*(_fetch(page) for page in window))
+            for page_records in pages:
+                await asyncio.gather(*(_process(record) for record in page_records))
+                count += len(page_records)
+                if page_records:
+                    page_count += 1
+                if len(page_records) < self.page_size:
+                    more = False
+            next_page += len(window)
+        
+        self._advance_watermark(name, changed, failed)
+        return count, page_count
+    
+    def _advance_watermark(self, name: str, changed: List[str], failed: List[Optional[str]]):
+        # Reintentar desde el primer registro fallido en la siguiente vuelta;
+        # los fallidos sin fecha no frenan la marca de agua
+        failed = [value for value in failed if value]
+        blocking = _earliest_failure(failed)
+        if blocking is not None and self._still_stuck(name, blocking):
+            logger.error(
+                f"Sondeo de {name}: el registro con fecha {blocking} falla desde hace "
+                f"{self.max_stuck_rounds} vueltas; se omite para que la marca de agua avance"
+            )
+            failed = [value for value in failed if value != blocking]
+            blocking = _earliest_failure(failed)
+        if blocking is None:
+            self._stuck.pop(name, None)
+        
+        if blocking is not None:
+            # Una fecha que no se puede interpretar no permite avanzar con seguridad
+            if parse_changed_at(blocking) is None:
+                return
+            watermark = blocking
+        elif changed:
+            changed_dates = [(parse_changed_at(value), value) for value in changed]
+            changed_dates = [item for item in changed_dates if item[0] is not None]
+            if not changed_dates:
+                return
+            watermark = max(changed_dates)[1]
+        else:
+            return
+        
+        if watermark == self.watermarks.get(name):
+            return
+        self.watermarks[name] = watermark
+        if self.state_file:
+            atomic_write_json(self.state_file, self.watermarks)
+    
+    def _still_stuck(self, name: str, blocking: str) -> bool:
+        """Cuenta otra vuelta frenada por `blocking`; True al llegar al máximo"""
+        previous, rounds = self._stuck.get(name, (None, 0))
+        rounds = rounds + 1 if previous == blocking else 1
+        if rounds >= self.max_stuck_rounds:
+            self._stuck.pop(name, None)
+            return True
+        self._stuck[name] = (blocking, rounds)
+        return False
+    
+    def stats(self) -> Dict[str, Any]:
+        """Estado actual del sondeo"""
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "interval_seconds": self.interval,
+            "watermarks": dict(self.watermarks),
+            "last_poll": self.last_poll
+        }
+
+
+# Instancia global del sondeo de NowCerts
+nowcerts_poller = NowCertsPoller()
@@ -2,14 +2,29 @@
 Servicio para interactuar con la API de NowCerts
 """
 import httpx
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
 from app.core.config import settings
 from app.core.exceptions import ExternalAPIError, ExternalAPIConnectionError
 from app.core.logger import logger
 from app.core.retry import retry_with_backoff
+from app.core.timing import phase
+from app.core.adaptive_limiter import get_limiter
+from app.core.http_client import get_client, send_request
+from app.core.json_codec import loads
+from app.core.singleflight import COALESCED_METHODS, read_key, upstream_reads
+from app.core.tracing import span
 from app.services.token_manager import token_manager
 
 
+def parse_page(response: Any) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    """Normaliza una página de NowCerts a (registros, total si se conoce)"""
+    if isinstance(response, list):
+        return response, None
+    records = response.get("data") or response.get("value") or response.get("items") or []
+    total = response.get("totalCount", response.get("total"))
+    return records, int(total) if total is not None else None
+
+
 class NowCertsService:
     """Servicio para manejar operaciones con NowCerts API"""
     
@@ -19,7 +34,8 @@ class NowCertsService:
     
     async def _get_headers(self) -> Dict[str, str]:
         """Obtiene los headers necesarios para las peticiones"""
-        access_token = await token_manager.get_access_token()
+        with phase("token"):
+            access_token = await token_manager.get_access_token()
         return {
             "Authorization": f"Bearer {access_token}",
             "Content-Type": "application/json"
@@ -29,7 +45,9 @@ class NowCertsService:
         self,
         method: str,
         endpoint: str,
-        json_data: Optional[Dict[str, Any]] = None
+        json_data: Optional[Dict[str, Any]] = None,
+        params: Optional[Dict[str, Any]] = None,
+        coalesce: Optional[bool] = None
     ) -> Dict[str, Any]:
         """
         Realiza una petición a la API de NowCerts con reintentos
@@ -38,50 +56,49 @@ class NowCertsService:
             method: Método HTTP (GET, POST, PUT, DELETE)
             endpoint: Endpoint relativo de la API
             json_data: Datos JSON para el body (opcional)
+            params: Parámetros de query (opcional)
+            coalesce: Compartir la llamada con peticiones idénticas en curso
+                (por defecto solo GET); el resultado compartido es de solo lectura
         
         Returns:
             Respuesta JSON de la API
         """
         url = f"{self.base_url}{endpoint}"
+        limiter = get_limiter("nowcerts")
+        attempt = 0
         
         async def _execute_request():
-            headers = await self._get_headers()
+            nonlocal attempt
+            attempt += 1
             
-            async with httpx.AsyncClient(timeout=30.0) as client:
+            with span("nowcerts.request", method=method, endpoint=endpoint, attempt=attempt) as request_span:
+                headers = await self._get_headers()
+                client = get_client("nowcerts")
+                
                 try:
-                    if method.upper() == "GET":
-                        response = await client.get(url, headers=headers)
-                    elif method.upper() == "POST":
-                        response = await client.post(url, json=json_data, headers=headers)
-                    elif method.upper() == "PUT":
-                        response = await client.put(url, json=json_data, headers=headers)
-                    elif method.upper() == "DELETE":
-                        response = await client.delete(url, headers=headers)
-                    else:
-                        raise ExternalAPIError(
-                            status_code=400,
-                            detail=f"Método {method} no soportado",
-                            service_name=self.service_name
-                        )
+                    response = await send_request(
+                        client, method, url, self.service_name,
+                        headers=headers, json_data=json_data, params=params,
+                        limiter=limiter
+                    )
                     
                     # Si es 401, intentar renovar token y reintentar
                     if response.status_code == 401:
                         logger.warning("Token expirado, renovando...")
+                        request_span.set_attribute("token_refreshed", True)
                         await token_manager.get_access_token(force_refresh=True)
                         headers = await self._get_headers()
                         
                         # Reintentar la petición
-                        if method.upper() == "GET":
-                            response = await client.get(url, headers=headers)
-                        elif method.upper() == "POST":
-                            response = await client.post(url, json=json_data, headers=headers)
-                        elif method.upper() == "PUT":
-                            response = await client.put(url, json=json_data, headers=headers)
-                        elif method.upper() == "DELETE":
-                            response = await client.delete(url, headers=headers)
+                        response = await send_request(
+                            client, method, url, self.service_name,
+                            headers=headers, json_data=json_data, params=params,
+                            limiter=limiter
+                        )
+                    request_span.set_attribute("status_code", response.status_code)
                     
                     response.raise_for_status()
-                    return response.json()
+                    return loads(response.content)
                 
                 except httpx.HTTPStatusError as e:
                     error_detail = e.response.text if e.response.text else str(e)
@@ -97,6 +114,12 @@ class NowCertsService:
                         service_name=self.service_name
                     )
         
+        if coalesce is None:
+            coalesce = method.upper() in COALESCED_METHODS
+        if coalesce:
+            key = read_key(method, url, token_manager.username, params, json_data)
+            return await upstream_reads.do(key, lambda: retry_with_backoff(_execute_request))
+        
         return await retry_with_backoff(_execute_request)
     
     async def create_contact(self, contact_data: Dict[str, Any]) -> Dict[str, Any]:
@@ -173,4 +196,85 @@ class NowCertsService:
             Cotización actualizada
         """
         return await self._make_request("PUT", f"/api/quotes/{quote_id}", quote_data)
-
+    
+    async def get_contact(self, contact_id: str) -> Dict[str, Any]:
+        """
+        Obtiene un contacto/asegurado de NowCerts
+        
+        Args:
+            contact_id: ID del asegurado
+        
+        Returns:
+            Asegurado
+        """
+        return await self._make_request("GET", f"/api/contacts/{contact_id}")
+    
+    async def get_policy(self, policy_id: str) -> Dict[str, Any]:
+        """
+        Obtiene una póliza de NowCerts
+        
+        Args:
+            policy_id: ID de la póliza
+        
+        Returns:
+            Póliza
+        """
+        return await self._make_request("GET", f"/api/policies/{policy_id}")
+    
+    async def get_quote(self, quote_id: str) -> Dict[str, Any]:
+        """
+        Obtiene una cotización de NowCerts
+        
+        Args:
+            quote_id: ID de la cotización
+        
+        Returns:
+            Cotización
+        """
+        return await self._make_request("GET", f"/api/quotes/{quote_id}")
+    
+    async def list_insured_records(
+        self,
+        endpoint: str,
+        insured_id: str,
+        page: int = 1,
+        page_size: int = 100
+    ) -> Dict[str, Any]:
+        """
+        Obtiene una página de registros de un asegurado (pólizas, cotizaciones)
+        
+        Args:
+            endpoint: Endpoint de la colección (/api/policies, /api/quotes)
+            insured_id: ID del asegurado
+            page: Número de página (desde 1)
+            page_size: Registros por página
+        
+        Returns:
+            Respuesta JSON de la API (lista o {"data": [...], "totalCount": N})
+        """
+        params = {"insuredDatabaseId": insured_id, "page": page, "pageSize": page_size}
+        return await self._make_request("GET", endpoint, params=params)
+    
+    async def list_changed_records(
+        self,
+        endpoint: str,
+        modified_since: Optional[str],
+        page: int = 1,
+        page_size: int = 100
+    ) -> Dict[str, Any]:
+        """
+        Obtiene una página de registros modificados desde una fecha
+        
+        Args:
+            endpoint: Endpoint de la colección (/api/contacts, /api/policies, ...)
+            modified_since: Fecha ISO 8601 (None para traer todo)
+            page: Número de página (desde 1)
+            page_size: Registros por página
+        
+        Returns:
+            Respuesta JSON de la API (lista o {"data": [...], "totalCount": N})
+        """
+        params: Dict[str, Any] = {"page": page, "pageSize": page_size}
+        if modified_since:
+            params["modifiedSince"] = modified_since
+        return await self._make_request("GET", endpoint, params=params)
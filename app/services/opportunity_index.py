@@ -0,0 +1,151 @@
+"""
+Índice de pólizas y cotizaciones de NowCerts → oportunidades de GHL
+Permite actualizar la oportunidad de una póliza con una sola llamada, sin
+buscarla en GHL
+"""
+import os
+import sqlite3
+import time
+from typing import Optional, Dict, Any
+from app.core.config import settings
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS opportunity_index (
+    kind TEXT NOT NULL,
+    number TEXT NOT NULL,
+    opportunity_id TEXT NOT NULL,
+    contact_id TEXT,
+    nowcerts_id TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (kind, number)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS opportunity_index_opportunity
+    ON opportunity_index (opportunity_id);
+"""
+
+_COLUMNS = (
+    "kind", "number", "opportunity_id", "contact_id", "nowcerts_id", "created_at", "updated_at"
+)
+
+
+class OpportunityIndex:
+    """
+    Correspondencia persistente (SQLite) póliza/cotización → oportunidad
+    
+    La clave es el tipo (policy o quote) y el número de póliza de NowCerts
+    (o su ID si no tiene número). Se rellena al crear la oportunidad y se
+    consulta con una búsqueda por clave primaria, en el propio event loop
+    (mismo modo WAL sin fsync por commit que el diario de sincronización).
+    """
+    
+    def __init__(self, path: Optional[str] = None):
+        self.path = path if path is not None else settings.OPPORTUNITY_INDEX_FILE
+        self._conn: Optional[sqlite3.Connection] = None
+        self.hits = 0
+        self.misses = 0
+    
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            path = self.path or ":memory:"
+            if path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+            if path != ":memory:":
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+    
+    def close(self):
+        """Cierra la base de datos (se reabre sola si se vuelve a usar)"""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+    
+    def get(self, kind: str, number: str) -> Optional[Dict[str, Any]]:
+        """
+        Oportunidad de una póliza o cotización
+        
+        Args:
+            kind: policy o quote
+            number: Número de póliza (o ID de NowCerts)
+        
+        Returns:
+            Entrada del índice o None si aún no tiene oportunidad
+        """
+        row = self._connection().execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM opportunity_index WHERE kind = ? AND number = ?",
+            (kind, number)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return dict(zip(_COLUMNS, row))
+    
+    def find_by_opportunity(self, opportunity_id: str) -> Optional[Dict[str, Any]]:
+        """Entrada del índice de una oportunidad de GHL (None si no la creamos nosotros)"""
+        row = self._connection().execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM opportunity_index WHERE opportunity_id = ? LIMIT 1",
+            (opportunity_id,)
+        ).fetchone()
+        return dict(zip(_COLUMNS, row)) if row else None
+    
+    def put(
+        self,
+        kind: str,
+        number: str,
+        opportunity_id: str,
+        contact_id: Optional[str] = None,
+        nowcerts_id: Optional[str] = None
+    ):
+        """
+        Registra (o reemplaza) la oportunidad de una póliza o cotización
+        
+        Args:
+            kind: policy o quote
+            number: Número de póliza (o ID de NowCerts)
+            opportunity_id: ID de la oportunidad en GHL
+            contact_id: ID del contacto de GHL asociado
+            nowcerts_id: ID de la póliza o cotización en NowCerts
+        """
+        now = time.time()
+        self._connection().execute(
+            "INSERT INTO opportunity_index (kind, number, opportunity_id, contact_id, nowcerts_id, "
+            "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (kind, number) DO UPDATE SET opportunity_id = excluded.opportunity_id, "
+            "contact_id = excluded.contact_id, nowcerts_id = excluded.nowcerts_id, "
+            "updated_at = excluded.updated_at",
+            (kind, number, opportunity_id, contact_id, nowcerts_id, now, now)
+        )
+    
+    def touch(self, kind: str, number: str):
+        """Anota una actualización de la oportunidad"""
+        self._connection().execute(
+            "UPDATE opportunity_index SET updated_at = ? WHERE kind = ? AND number = ?",
+            (time.time(), kind, number)
+        )
+    
+    def forget(self, kind: str, number: str):
+        """Elimina la entrada (p. ej. si la oportunidad ya no existe en GHL)"""
+        self._connection().execute(
+            "DELETE FROM opportunity_index WHERE kind = ? AND number = ?",
+            (kind, number)
+        )
+    
+    def stats(self) -> Dict[str, Any]:
+        """Entradas por tipo y aciertos del índice"""
+        rows = self._connection().execute(
+            "SELECT kind, COUNT(*) FROM opportunity_index GROUP BY kind"
+        ).fetchall()
+        return {
+            "path": self.path,
+            "entries": dict(rows),
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+# Instancia global del índice de oportunidades
+opportunity_index = OpportunityIndex()
@@ -0,0 +1,218 @@
+"""
+Upsert de oportunidades de GHL a partir de pólizas y cotizaciones de NowCerts
+Con el índice de oportunidades, cada evento de póliza cuesta una sola
+llamada a GHL y sin búsquedas
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, Set, Tuple, AsyncIterator
+from app.core.config import settings
+from app.core.exceptions import ExternalAPIError
+from app.core.logger import logger
+from app.core.memory import memory_registry, container_usage
+from app.models.webhooks import PolicyData, GHLOpportunity
+from app.services.contact_matching import contact_match_index, NOWCERTS, GHL
+from app.services.ghl_service import GHLService
+from app.services.mapper import DataMapper
+from app.services.opportunity_index import opportunity_index
+from app.services.sync_journal import sync_journal
+
+# Pólizas a la espera de su asegurado que se recuerdan (las más antiguas salen primero)
+_MAX_PENDING = 10000
+
+
+class OpportunityWriter:
+    """
+    Crea o actualiza la oportunidad de GHL de una póliza o cotización
+    
+    - Si la póliza ya está en el índice: update_opportunity (una llamada),
+      tanto para UPDATE como para un INSERT repetido.
+    - Si no: create_opportunity con el contacto de GHL del asegurado, que
+      sale del diario de sincronización (la escritura que sincronizó el
+      asegurado) o, si el diario no lo tiene, del índice de emparejamiento
+      de contactos, y se guarda la oportunidad en el índice.
+    
+    Los eventos de una misma póliza se serializan, de modo que dos INSERT
+    simultáneos crean una sola oportunidad.
+    
+    Una póliza cuyo asegurado aún no tiene contacto se puede reintentar
+    durante OPPORTUNITY_PENDING_RETRY_AFTER_SECONDS ×
+    OPPORTUNITY_PENDING_MAX_RETRIES desde la primera vez que se vio; pasado
+    ese plazo (o si no tiene asegurado) se omite sin reintento.
+    """
+    
+    def __init__(self, ghl_service: Optional[GHLService] = None):
+        self.ghl_service = ghl_service or GHLService()
+        self.mapper = DataMapper()
+        self._locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+        self._lock_users: Dict[Tuple[str, str], int] = {}
+        # Nombres de las oportunidades que se están creando: su webhook puede
+        # llegar antes de que el índice tenga el ID
+        self._creating: Set[str] = set()
+        # Primera vez que se vio cada póliza a la espera de su asegurado
+        self._pending_since: Dict[Tuple[str, str], float] = {}
+    
+    @asynccontextmanager
+    async def _locked(self, key: Tuple[str, str]) -> AsyncIterator[None]:
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._lock_users[key] = self._lock_users.get(key, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._lock_users[key] -= 1
+            if not self._lock_users[key]:
+                del self._lock_users[key]
+                del self._locks[key]
+    
+    def owns(self, opportunity: GHLOpportunity) -> Optional[Dict[str, Any]]:
+        """
+        Indica si una oportunidad de GHL la gestiona la integración
+        
+        Args:
+            opportunity: Oportunidad recibida de GHL
+        
+        Returns:
+            Entrada del índice (o {"pending": True} si se está creando) o None
+        """
+        if opportunity.id:
+            entry = opportunity_index.find_by_opportunity(opportunity.id)
+            if entry is not None:
+                return entry
+        if opportunity.name and opportunity.name in self._creating:
+            return {"pending": True}
+        return None
+    
+    async def upsert(
+        self,
+        kind: str,
+        policy: PolicyData,
+        contact_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Crea o actualiza la oportunidad de una póliza o cotización
+        
+        Args:
+            kind: policy o quote
+            policy: Datos de la póliza o cotización
+            contact_id: Contacto de GHL (opcional; por defecto el del asegurado)
+        
+        Returns:
+            action (created, updated o skipped), opportunity_id, number y
+            respuesta de GHL (o message si se omitió)
+        """
+        number = policy.policyNumber or policy.id
+        if not number:
+            return {"action": "skipped", "message": f"{kind} sin número ni ID: no se puede indexar"}
+        
+        key = (kind, number)
+        async with self._locked(key):
+            opportunity_data = self.mapper.policy_to_ghl_opportunity(policy)
+            entry = opportunity_index.get(kind, number)
+            
+            if entry is not None:
+                update_data = {
+                    name: value for name, value in opportunity_data.items() if value is not None
+                }
+                try:
+                    result = await self.ghl_service.update_opportunity(
+                        entry["opportunity_id"], update_data
+                    )
+                except ExternalAPIError as e:
+                    if e.status_code != 404:
+                        raise
+                    # Borrada en GHL: se vuelve a crear
+                    logger.warning(
+                        f"Oportunidad {entry['opportunity_id']} de {kind} {number} no existe en GHL; "
+                        "se crea de nuevo"
+                    )
+                    opportunity_index.forget(kind, number)
+                    contact_id = contact_id or entry["contact_id"]
+                else:
+                    opportunity_index.touch(kind, number)
+                    return {
+                        "action": "updated",
+                        "opportunity_id": entry["opportunity_id"],
+                        "number": number,
+                        "result": result
+                    }
+            
+            contact_id = (
+                contact_id
+                or sync_journal.counterpart_id("contact", NOWCERTS, policy.insured_id)
+                or contact_match_index.counterpart(NOWCERTS, policy.insured_id, GHL)
+            )
+            if not contact_id:
+                return self._skip_without_contact(kind, key, policy)
+            self._pending_since.pop(key, None)
+            
+            name = opportunity_data["name"]
+            self._creating.add(name)
+            try:
+                result = await self.ghl_service.create_opportunity(contact_id, opportunity_data)
+                opportunity = result.get("opportunity") or result
+                opportunity_id = opportunity.get("id")
+                if opportunity_id:
+                    opportunity_index.put(kind, number, opportunity_id, contact_id, policy.id)
+                else:
+                    logger.warning(f"GHL no devolvió el ID de la oportunidad de {kind} {number}")
+            finally:
+                self._creating.discard(name)
+            
+            return {
+                "action": "created",
+                "opportunity_id": opportunity_id,
+                "number": number,
+                "result": result
+            }
+    
+    def _skip_without_contact(self, kind: str, key: Tuple[str, str], policy: PolicyData) -> Dict[str, Any]:
+        number = key[1]
+        if not policy.insured_id:
+            return {
+                "action": "skipped",
+                "number": number,
+                "message": f"{kind} {number} sin asegurado: no hay contacto para la oportunidad"
+            }
+        
+        now = time.monotonic()
+        if key not in self._pending_since and len(self._pending_since) >= _MAX_PENDING:
+            del self._pending_since[next(iter(self._pending_since))]
+        first_seen = self._pending_since.setdefault(key, now)
+        window = settings.OPPORTUNITY_PENDING_RETRY_AFTER_SECONDS * settings.OPPORTUNITY_PENDING_MAX_RETRIES
+        if now - first_seen >= window:
+            del self._pending_since[key]
+            logger.warning(
+                f"El asegurado {policy.insured_id} de {kind} {number} sigue sin contacto en GHL "
+                f"tras {window:g}s; se deja de reintentar"
+            )
+            return {
+                "action": "skipped",
+                "number": number,
+                "message": (
+                    f"El asegurado {policy.insured_id} no se sincronizó con GHL en {window:g}s: "
+                    "no hay contacto para la oportunidad"
+                )
+            }
+        
+        # Se resuelve solo cuando llegue el asegurado: quien llama puede reintentar
+        return {
+            "action": "skipped",
+            "number": number,
+            "retryable": True,
+            "message": (
+                f"El asegurado {policy.insured_id} aún no está sincronizado con GHL: "
+                "no hay contacto para la oportunidad"
+            )
+        }
+
+
+# Instancia global del escritor de oportunidades
+opportunity_writer = OpportunityWriter()
+memory_registry.register("ghl.opportunity_writer.locks", "cache", lambda: container_usage(opportunity_writer._locks))
+memory_registry.register(
+    "ghl.opportunity_writer.pending", "cache", lambda: container_usage(opportunity_writer._pending_since)
+)
@@ -0,0 +1,176 @@
+"""
+Reproducción de payloads archivados (app.core.payload_archive)
+
+Envía los payloads seleccionados por el pipeline de procesamiento a un
+ritmo controlado: en el propio proceso (para reprocesar tras corregir un
+mapeo; hace las llamadas reales a NowCerts/GHL en el carril masivo) o
+contra una instancia en marcha por HTTP (pruebas de carga realistas).
+
+Uso:
+    python -m app.services.payload_replay --list
+    python -m app.services.payload_replay --since 2024-05-01T00:00 --until 2024-05-02T00:00 --rate 20
+    python -m app.services.payload_replay --event-id nowcerts_ab12... --event-id ghl_cd34...
+    python -m app.services.payload_replay --url http://localhost:8000 --rate 200 --concurrency 50
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, List
+from app.core.config import settings
+from app.core.exceptions import DuplicateEventError
+from app.core.json_codec import loads
+from app.core.payload_archive import ArchivedRecord, iter_records, list_segments
+from app.core.priority import BULK, lane
+
+
+def _parse_time(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+async def _process_local(record: ArchivedRecord) -> str:
+    # Importación tardía: --list y el modo HTTP no necesitan los servicios
+    from app.models.webhooks import parse_nowcerts_event, parse_ghl_event
+    from app.services.event_processor import process_nowcerts_event, process_ghl_event
+    
+    data = loads(record["body"])
+    try:
+        with lane(BULK):
+            if record["source"] == "nowcerts":
+                await process_nowcerts_event(parse_nowcerts_event(data))
+            else:
+                await process_ghl_event(parse_ghl_event(data))
+    except DuplicateEventError:
+        return "duplicate"
+    return "ok"
+
+
+async def replay(
+    records,
+    rate: float = 0.0,
+    concurrency: int = 10,
+    url: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Reproduce registros archivados
+    
+    Args:
+        records: Iterable de registros (iter_records)
+        rate: Eventos por segundo (0 = sin límite)
+        concurrency: Eventos en curso a la vez
+        url: Base de una instancia en marcha; None = procesar en este proceso
+    
+    Returns:
+        Contadores por resultado, duración, ritmo conseguido y latencias
+    """
+    import httpx
+    from app.core.http_client import close_clients
+    
+    counts: Dict[str, int] = {}
+    latencies: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+    client = httpx.AsyncClient(timeout=settings.HTTP_TIMEOUT_SECONDS) if url else None
+    tasks = set()
+    
+    async def _one(record: ArchivedRecord):
+        started = time.perf_counter()
+        try:
+            if client is not None:
+                response = await client.post(
+                    f"{url.rstrip('/')}{settings.API_V1_PREFIX}/webhooks/{record['source']}",
+                    content=record["body"],
+                    headers={"Content-Type": "application/json"}
+                )
+                outcome = "ok" if response.status_code < 400 else (
+                    "duplicate" if response.status_code == 409 else f"http_{response.status_code}"
+                )
+            else:
+                outcome = await _process_local(record)
+        except Exception as e:
+            outcome = f"error_{type(e).__name__}"
+        finally:
+            semaphore.release()
+        latencies.append(time.perf_counter() - started)
+        counts[outcome] = counts.get(outcome, 0) + 1
+    
+    started = time.perf_counter()
+    sent = 0
+    try:
+        for record in records:
+            if rate:
+                # Ritmo fijo respecto al inicio: los retrasos no se acumulan
+                delay = started + sent / rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await semaphore.acquire()
+            task = asyncio.create_task(_one(record))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            sent += 1
+        if tasks:
+            await asyncio.gather(*tasks)
+    finally:
+        if client is not None:
+            await client.aclose()
+        else:
+            await close_clients()
+    
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "events": sent,
+        "results": counts,
+        "elapsed_seconds": round(elapsed, 3),
+        "events_per_second": round(sent / elapsed, 1) if elapsed else None,
+        "latency_ms": {
+            "p50": round(latencies[len(latencies) // 2] * 1000, 1),
+            "p95": round(latencies[int(len(latencies) * 0.95)] * 1000, 1),
+            "max": round(latencies[-1] * 1000, 1)
+        } if latencies else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dir", default=settings.PAYLOAD_ARCHIVE_DIR, help="Directorio del archivo")
+    parser.add_argument("--list", action="store_true", help="Listar los segmentos y salir")
+    parser.add_argument("--segment", action="append", help="Solo estos segmentos (repetible)")
+    parser.add_argument("--since", help="Desde (ISO 8601, UTC si no lleva zona)")
+    parser.add_argument("--until", help="Hasta, excluida (ISO 8601)")
+    parser.add_argument("--event-id", action="append", help="Solo estos eventos (repetible)")
+    parser.add_argument("--source", action="append", choices=["nowcerts", "ghl"], help="Solo estas fuentes")
+    parser.add_argument("--rate", type=float, default=0.0, help="Eventos por segundo (0 = sin límite)")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--url", help="Enviar por HTTP a esta instancia en vez de procesar aquí")
+    args = parser.parse_args()
+    
+    if not args.dir:
+        parser.error("Indique --dir o configure PAYLOAD_ARCHIVE_DIR")
+    
+    if args.list:
+        for segment, first, last, count in list_segments(args.dir):
+            print(
+                f"{segment.name}  {count:>8} eventos  "
+                f"{datetime.fromtimestamp(first, timezone.utc).isoformat()} → "
+                f"{datetime.fromtimestamp(last, timezone.utc).isoformat()}"
+            )
+        return
+    
+    records = iter_records(
+        args.dir,
+        since=_parse_time(args.since),
+        until=_parse_time(args.until),
+        event_ids=args.event_id,
+        sources=args.source,
+        segments=args.segment
+    )
+    print(asyncio.run(replay(records, args.rate, args.concurrency, args.url)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+Sondas de readiness de los servicios externos
+Una tarea en segundo plano comprueba NowCerts y GHL periódicamente y
+guarda el resultado; /ready solo lee ese resultado y nunca hace I/O
+"""
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, Callable, Awaitable
+from app.core.adaptive_limiter import limiter_stats
+from app.core.admission import admission_controller
+from app.core.config import settings
+from app.core.http_client import pool_stats
+from app.core.logger import logger
+from app.services.contact_writer import contact_writer
+from app.services.ghl_service import GHLService
+from app.services.nowcerts_service import NowCertsService
+from app.services.token_manager import token_manager
+
+
+class UpstreamProbe:
+    """
+    Resultado acumulado de las sondas de un servicio externo
+    
+    El estado del breaker se deriva de las sondas: "open" tras
+    READINESS_FAILURE_THRESHOLD fallos seguidos, "closed" con la primera
+    sonda correcta y "unknown" antes de la primera sonda.
+    """
+    
+    def __init__(self, name: str, check: Callable[[], Awaitable[Any]]):
+        self.name = name
+        self.check = check
+        self.consecutive_failures = 0
+        self.last_success: Optional[str] = None
+        self.last_error: Optional[str] = None
+        self.last_latency_ms: Optional[float] = None
+        self.probed = False
+    
+    @property
+    def breaker_state(self) -> str:
+        if not self.probed:
+            return "unknown"
+        if self.consecutive_failures >= settings.READINESS_FAILURE_THRESHOLD:
+            return "open"
+        return "closed"
+    
+    async def run(self):
+        """Ejecuta la sonda y actualiza el estado"""
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.check(), timeout=settings.READINESS_PROBE_TIMEOUT_SECONDS)
+        except Exception as e:
+            self.consecutive_failures += 1
+            self.last_error = getattr(e, "detail", None) or str(e) or type(e).__name__
+            if self.consecutive_failures == settings.READINESS_FAILURE_THRESHOLD:
+                logger.warning(f"Sonda de {self.name} falló {self.consecutive_failures} veces: {self.last_error}")
+        else:
+            if self.consecutive_failures >= settings.READINESS_FAILURE_THRESHOLD:
+                logger.info(f"Sonda de {self.name} recuperada")
+            self.consecutive_failures = 0
+            self.last_error = None
+            self.last_success = datetime.now(timezone.utc).isoformat()
+        finally:
+            self.probed = True
+            self.last_latency_ms = round((time.perf_counter() - started) * 1000, 1)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "breaker": self.breaker_state,
+            "consecutive_failures": self.consecutive_failures,
+            "last_success": self.last_success,
+            "last_error": self.last_error,
+            "last_latency_ms": self.last_latency_ms
+        }
+
+
+async def _probe_nowcerts():
+    # Un listado de una fila: comprueba la API (no solo el token en cache) y, de
+    # paso, renueva el token si está por expirar para que las peticiones reales
+    # nunca paguen la renovación
+    await NowCertsService().list_changed_records("/api/contacts", None, page=1, page_size=1)
+
+
+async def _probe_ghl():
+    await GHLService().get_pipelines(force_refresh=True)
+
+
+class ReadinessMonitor:
+    """Refresca periódicamente las sondas y compone el estado de /ready"""
+    
+    def __init__(self):
+        self.probes: Dict[str, UpstreamProbe] = {}
+        if settings.NOWCERTS_USERNAME and settings.NOWCERTS_PASSWORD:
+            self.probes["nowcerts"] = UpstreamProbe("nowcerts", _probe_nowcerts)
+        if settings.GHL_API_KEY:
+            self.probes["ghl"] = UpstreamProbe("ghl", _probe_ghl)
+        self.interval = settings.READINESS_PROBE_INTERVAL_SECONDS
+        self._task: Optional[asyncio.Task] = None
+    
+    def start(self):
+        """Arranca las sondas en segundo plano"""
+        if self._task is not None and not self._task.done():
+            return
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Detiene las sondas"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+    
+    async def _run(self):
+        while True:
+            await self.probe_all()
+            await asyncio.sleep(self.interval)
+    
+    async def probe_all(self):
+        """Ejecuta todas las sondas en paralelo"""
+        await asyncio.gather(*(probe.run() for probe in self.probes.values()))
+    
+    def snapshot(self, started: bool, draining: bool) -> Dict[str, Any]:
+        """
+        Estado de readiness a partir del último resultado de las sondas (sin I/O)
+        
+        Args:
+            started: La precarga del arranque terminó
+            draining: La aplicación está cerrándose
+        
+        Returns:
+            Diccionario con status, ready y el detalle de cada componente
+        """
+        token = token_manager.token_status()
+        upstreams = {name: probe.to_dict() for name, probe in self.probes.items()}
+        
+        reasons = []
+        if draining:
+            reasons.append("draining")
+        if not started:
+            reasons.append("starting")
+        if "nowcerts" in self.probes and not token["valid"]:
+            reasons.append("nowcerts_token_invalid")
+        for name, probe in self.probes.items():
+            if probe.breaker_state == "open":
+                reasons.append(f"{name}_unreachable")
+        
+        if draining:
+            status_text = "draining"
+        elif not started:
+            status_text = "starting"
+        else:
+            status_text = "ready" if not reasons else "degraded"
+        
+        admission = admission_controller.stats()
+        return {
+            "status": status_text,
+            "ready": not reasons,
+            "reasons": reasons,
+            "nowcerts_token": token,
+            "upstreams": upstreams,
+            "http_pools": pool_stats(),
+            "upstream_limits": limiter_stats(),
+            "queues": {
+                "admission_in_flight": admission["in_flight"],
+                "admission_queued": admission["queued"],
+                "ghl_pending_writes": contact_writer.pending_count
+            }
+        }
+
+
+# Instancia global del monitor de readiness
+readiness_monitor = ReadinessMonitor()
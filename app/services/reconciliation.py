@@ -0,0 +1,470 @@
+"""
+Reconciliación de contactos entre NowCerts y GHL (detección de divergencias)
+
+Recorre los contactos de ambos sistemas, los normaliza al formato de GHL
+con DataMapper y los resume en un árbol de hashes por buckets: solo los
+buckets cuyo hash difiere se comparan registro a registro. El resultado es
+un plan de reparación (JSON Lines, una acción por línea) que se puede
+revisar y ejecutar después.
+
+Uso:
+    python -m app.services.reconciliation --plan drift.jsonl
+    python -m app.services.reconciliation --plan drift.jsonl --prefer ghl
+    python -m app.services.reconciliation --apply drift.jsonl --concurrency 8
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from typing import Optional, Dict, Any, List, AsyncIterator, Iterator, Tuple, Callable
+from pydantic import ValidationError
+from app.core.config import settings
+from app.core.logger import logger
+from app.core.priority import BULK, lane
+from app.models.webhooks import InsuredData, GHLContact
+from app.services.ghl_service import GHLService
+from app.services.mapper import DataMapper
+from app.services.nowcerts_service import NowCertsService, parse_page
+from app.services.sync_journal import (
+    sync_journal,
+    contact_match_key,
+    contact_fingerprint,
+    CONTACT_SYNC_FIELDS
+)
+
+NOWCERTS = "nowcerts"
+GHL = "ghl"
+
+# Hijos por nodo del árbol de hashes: 4096 hojas → 256 → 16 → raíz
+TREE_FANOUT = 16
+
+_DIGEST_BYTES = 16
+_DIGEST_MASK = (1 << (_DIGEST_BYTES * 8)) - 1
+
+
+def bucket_of(key: str, buckets: int) -> int:
+    """Bucket de una clave de coincidencia (reparto uniforme por hash)"""
+    digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % buckets
+
+
+def _record_digest(key: str, content_hash: str) -> int:
+    digest = hashlib.blake2b(f"{key}\0{content_hash}".encode(), digest_size=_DIGEST_BYTES).digest()
+    return int.from_bytes(digest, "big")
+
+
+class HashTree:
+    """
+    Árbol de hashes (estilo Merkle) sobre buckets de registros
+    
+    Cada hoja resume los registros de su bucket con una suma modular de sus
+    hashes y un contador: no depende del orden de llegada, se actualiza en
+    O(1) por registro y los duplicados no se anulan (como con XOR). Los
+    niveles superiores hashean grupos de TREE_FANOUT nodos.
+    """
+    
+    def __init__(self, buckets: int):
+        self.buckets = buckets
+        self.sums = [0] * buckets
+        self.counts = [0] * buckets
+    
+    def add(self, bucket: int, digest: int):
+        self.sums[bucket] = (self.sums[bucket] + digest) & _DIGEST_MASK
+        self.counts[bucket] += 1
+    
+    def levels(self) -> List[List[bytes]]:
+        """Niveles del árbol, de las hojas (0) a la raíz"""
+        level = [
+            total.to_bytes(_DIGEST_BYTES, "big") + count.to_bytes(8, "big")
+            for total, count in zip(self.sums, self.counts)
+        ]
+        levels = [level]
+        while len(level) > 1:
+            level = [
+                hashlib.blake2b(b"".join(level[i:i + TREE_FANOUT]), digest_size=_DIGEST_BYTES).digest()
+                for i in range(0, len(level), TREE_FANOUT)
+            ]
+            levels.append(level)
+        return levels
+
+
+def diff_buckets(a: HashTree, b: HashTree) -> Tuple[List[int], int]:
+    """
+    Buckets que difieren entre dos árboles, bajando solo por las ramas distintas
+    
+    Returns:
+        (buckets distintos, nodos comparados)
+    """
+    levels_a, levels_b = a.levels(), b.levels()
+    candidates = [0]
+    compared = 0
+    for depth in range(len(levels_a) - 1, -1, -1):
+        compared += len(candidates)
+        mismatched = [i for i in candidates if levels_a[depth][i] != levels_b[depth][i]]
+        if depth == 0:
+            return mismatched, compared
+        width = len(levels_a[depth - 1])
+        candidates = [
+            child for i in mismatched
+            for child in range(i * TREE_FANOUT, min((i + 1) * TREE_FANOUT, width))
+        ]
+    return [], compared
+
+
+class Reconciler:
+    """
+    Compara los contactos de NowCerts y GHL y genera un plan de reparación
+    
+    Ambos sistemas se recorren a la vez (las páginas de NowCerts de
+    RECONCILE_PAGE_CONCURRENCY en RECONCILE_PAGE_CONCURRENCY; GHL pagina por
+    cursor). Cada registro se guarda normalizado en un SQLite temporal en
+    disco y suma su hash a la hoja de su bucket, así que la memoria no crece
+    con el número de registros. Después se comparan los árboles y solo se
+    leen del disco los buckets distintos.
+    """
+    
+    def __init__(
+        self,
+        nowcerts_service: Optional[NowCertsService] = None,
+        ghl_service: Optional[GHLService] = None,
+        buckets: Optional[int] = None,
+        page_concurrency: Optional[int] = None,
+        workdir: Optional[str] = None,
+        progress: Optional[Callable[[int, Optional[int], str], None]] = None
+    ):
+        self.nowcerts_service = nowcerts_service or NowCertsService()
+        self.ghl_service = ghl_service or GHLService()
+        self.mapper = DataMapper()
+        self.buckets = buckets or settings.RECONCILE_BUCKETS
+        self.page_concurrency = page_concurrency or settings.RECONCILE_PAGE_CONCURRENCY
+        self.page_size = settings.NOWCERTS_POLL_PAGE_SIZE
+        self.workdir = workdir
+        self.progress = progress
+        self.trees = {NOWCERTS: HashTree(self.buckets), GHL: HashTree(self.buckets)}
+        self.counts: Dict[str, Dict[str, int]] = {
+            side: {"records": 0, "pages": 0, "unmatched": 0, "invalid": 0} for side in (NOWCERTS, GHL)
+        }
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_path: Optional[str] = None
+    
+    def _open_spill(self):
+        fd, self._db_path = tempfile.mkstemp(prefix="reconcile-", suffix=".db", dir=self.workdir)
+        os.close(fd)
+        self._db = sqlite3.connect(self._db_path, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=OFF")
+        self._db.execute("PRAGMA synchronous=OFF")
+        self._db.execute(
+            "CREATE TABLE records (side TEXT, bucket INTEGER, key TEXT, content_hash TEXT, "
+            "source_id TEXT, data TEXT)"
+        )
+    
+    def _close_spill(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+        if self._db_path:
+            os.unlink(self._db_path)
+            self._db_path = None
+    
+    def _normalize(self, side: str, record: Dict[str, Any]) -> Tuple[Optional[str], Dict[str, Any]]:
+        if side == NOWCERTS:
+            insured = InsuredData.model_validate(record)
+            contact = self.mapper.insured_to_ghl_contact(insured)
+            source_id = insured.id
+        else:
+            ghl_contact = GHLContact.model_validate(record)
+            contact = ghl_contact.model_dump()
+            source_id = ghl_contact.id
+        return source_id, {field: contact.get(field) for field in CONTACT_SYNC_FIELDS}
+    
+    def _ingest(self, side: str, records: List[Dict[str, Any]]):
+        counts = self.counts[side]
+        tree = self.trees[side]
+        rows = []
+        for record in records:
+            try:
+                source_id, contact = self._normalize(side, record)
+            except ValidationError:
+                counts["invalid"] += 1
+                continue
+            key = contact_match_key(contact)
+            if key is None:
+                # Sin email ni teléfono no se puede emparejar con el otro sistema
+                counts["unmatched"] += 1
+                continue
+            content_hash = contact_fingerprint(contact)
+            bucket = bucket_of(key, self.buckets)
+            tree.add(bucket, _record_digest(key, content_hash))
+            rows.append((side, bucket, key, content_hash, source_id, json.dumps(contact)))
+        self._db.executemany("INSERT INTO records VALUES (?, ?, ?, ?, ?, ?)", rows)
+        counts["records"] += len(rows)
+        counts["pages"] += 1
+    
+    async def nowcerts_pages(self) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Todos los contactos de NowCerts, página a página (PAGE_CONCURRENCY páginas a la vez)"""
+        async def _fetch(page: int) -> Any:
+            return await self.nowcerts_service.list_changed_records(
+                "/api/contacts", None, page=page, page_size=self.page_size
+            )
+        
+        records, total = parse_page(await _fetch(1))
+        yield records
+        if total is not None:
+            pages = -(-total // self.page_size)
+            for start in range(2, pages + 1, self.page_concurrency):
+                responses = await asyncio.gather(*[
+                    _fetch(page) for page in range(start, min(start + self.page_concurrency, pages + 1))
+                ])
+                for response in responses:
+                    yield parse_page(response)[0]
+        else:
+            page = 1
+            while len(records) == self.page_size:
+                page += 1
+                records, _ = parse_page(await _fetch(page))
+                yield records
+    
+    async def ghl_pages(self) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Todos los contactos de GHL, página a página (paginación por cursor)"""
+        start_after_id = None
+        start_after = None
+        while True:
+            response = await self.ghl_service.list_contacts(
+                limit=self.page_size, start_after_id=start_after_id, start_after=start_after
+            )
+            contacts = response.get("contacts") or []
+            yield contacts
+            meta = response.get("meta") or {}
+            if len(contacts) < self.page_size or not meta.get("startAfterId"):
+                return
+            start_after_id = meta["startAfterId"]
+            start_after = meta.get("startAfter")
+    
+    async def _scan_side(self, side: str):
+        pages = self.nowcerts_pages() if side == NOWCERTS else self.ghl_pages()
+        async for records in pages:
+            self._ingest(side, records)
+            if self.progress:
+                read = self.counts[NOWCERTS]["records"] + self.counts[GHL]["records"]
+                self.progress(read, None, "Contactos leídos de NowCerts y GHL")
+            if self.counts[side]["pages"] % 100 == 0:
+                logger.info(f"Reconciliación: {self.counts[side]['records']} registros leídos de {side}")
+    
+    def _bucket_rows(self, bucket: int) -> Dict[str, Dict[str, List[Tuple[str, Optional[str], str]]]]:
+        by_key: Dict[str, Dict[str, List[Tuple[str, Optional[str], str]]]] = {}
+        for side, key, content_hash, source_id, data in self._db.execute(
+            "SELECT side, key, content_hash, source_id, data FROM records WHERE bucket = ?", (bucket,)
+        ):
+            by_key.setdefault(key, {NOWCERTS: [], GHL: []})[side].append((content_hash, source_id, data))
+        return by_key
+    
+    def _actions(self, key: str, sides: Dict[str, list], prefer: str, drift: Dict[str, int]) -> Iterator[Dict[str, Any]]:
+        nowcerts_rows, ghl_rows = sides[NOWCERTS], sides[GHL]
+        if len(nowcerts_rows) > 1 or len(ghl_rows) > 1:
+            drift["duplicate_keys"] += 1
+        if nowcerts_rows and ghl_rows and {row[0] for row in nowcerts_rows} & {row[0] for row in ghl_rows}:
+            return
+        
+        nowcerts_row = nowcerts_rows[0] if nowcerts_rows else None
+        ghl_row = ghl_rows[0] if ghl_rows else None
+        if ghl_row is None:
+            reason = "missing_in_ghl"
+        elif nowcerts_row is None:
+            reason = "missing_in_nowcerts"
+        else:
+            reason = "content_mismatch"
+        drift[reason] += 1
+        
+        base = {
+            "reason": reason,
+            "key": key,
+            "nowcerts_id": nowcerts_row[1] if nowcerts_row else None,
+            "ghl_id": ghl_row[1] if ghl_row else None
+        }
+        if reason == "missing_in_ghl" or (reason == "content_mismatch" and prefer == NOWCERTS):
+            yield {
+                "action": "upsert_ghl_contact",
+                **base,
+                "content_hash": nowcerts_row[0],
+                "data": json.loads(nowcerts_row[2])
+            }
+        else:
+            ghl_contact = GHLContact.model_validate(json.loads(ghl_row[2]))
+            yield {
+                "action": "create_nowcerts_contact" if nowcerts_row is None else "update_nowcerts_contact",
+                **base,
+                "content_hash": ghl_row[0],
+                "data": self.mapper.ghl_contact_to_nowcerts(ghl_contact)
+            }
+    
+    async def run(self, plan_path: str, prefer: str = NOWCERTS) -> Dict[str, Any]:
+        """
+        Recorre ambos sistemas y escribe el plan de reparación
+        
+        Args:
+            plan_path: Archivo JSON Lines del plan
+            prefer: Sistema que manda cuando un contacto difiere (nowcerts o ghl);
+                los que faltan en un lado siempre se crean en ese lado
+        
+        Returns:
+            Resumen: registros por sistema, buckets distintos, divergencias y tiempos
+        """
+        started = time.perf_counter()
+        self._open_spill()
+        try:
+            with lane(BULK):
+                await asyncio.gather(self._scan_side(NOWCERTS), self._scan_side(GHL))
+            scan_seconds = time.perf_counter() - started
+            
+            self._db.execute("CREATE INDEX records_bucket ON records (bucket)")
+            mismatched, nodes_compared = diff_buckets(self.trees[NOWCERTS], self.trees[GHL])
+            
+            drift = {"missing_in_ghl": 0, "missing_in_nowcerts": 0, "content_mismatch": 0, "duplicate_keys": 0}
+            actions = 0
+            with open(plan_path, "w", encoding="utf-8") as f:
+                for bucket in mismatched:
+                    for key, sides in self._bucket_rows(bucket).items():
+                        for action in self._actions(key, sides, prefer, drift):
+                            f.write(json.dumps(action, ensure_ascii=False) + "\n")
+                            actions += 1
+        finally:
+            self._close_spill()
+        
+        return {
+            "records": self.counts,
+            "buckets": self.buckets,
+            "mismatched_buckets": len(mismatched),
+            "tree_nodes_compared": nodes_compared,
+            "drift": drift,
+            "actions": actions,
+            "plan": plan_path,
+            "scan_seconds": round(scan_seconds, 1),
+            "elapsed_seconds": round(time.perf_counter() - started, 1)
+        }
+
+
+async def apply_plan(
+    plan_path: str,
+    concurrency: Optional[int] = None,
+    nowcerts_service: Optional[NowCertsService] = None,
+    ghl_service: Optional[GHLService] = None,
+    progress: Optional[Callable[[int, Optional[int], str], None]] = None
+) -> Dict[str, Any]:
+    """
+    Ejecuta un plan de reparación
+    
+    Cada escritura se anota en el diario de sincronización, de modo que los
+    webhooks que provoca se reconocen como eco y no vuelven al otro sistema.
+    
+    Args:
+        plan_path: Archivo JSON Lines generado por Reconciler.run
+        concurrency: Escrituras a la vez (por defecto SYNC_FANOUT_CONCURRENCY)
+        progress: Se llama tras cada acción ejecutada
+    
+    Returns:
+        Acciones ejecutadas por resultado
+    """
+    nowcerts_service = nowcerts_service or NowCertsService()
+    ghl_service = ghl_service or GHLService()
+    semaphore = asyncio.Semaphore(concurrency or settings.SYNC_FANOUT_CONCURRENCY)
+    results: Dict[str, int] = {}
+    tasks = set()
+    total = 0
+    if progress:
+        with open(plan_path, "r", encoding="utf-8") as f:
+            total = sum(1 for line in f if line.strip())
+        progress(0, total, "Acciones del plan ejecutadas")
+    
+    async def _apply(action: Dict[str, Any]):
+        try:
+            if action["action"] == "upsert_ghl_contact":
+                async with sync_journal.writing(
+                    "contact", action["key"], NOWCERTS, GHL, action["content_hash"],
+                    source_id=action["nowcerts_id"]
+                ) as write:
+                    result = await ghl_service.upsert_contact(action["data"])
+                    write.target_id = (result.get("contact") or result).get("id")
+            else:
+                async with sync_journal.writing(
+                    "contact", action["key"], GHL, NOWCERTS, action["content_hash"],
+                    source_id=action["ghl_id"]
+                ) as write:
+                    if action["action"] == "create_nowcerts_contact":
+                        result = await nowcerts_service.create_contact(action["data"])
+                    else:
+                        result = await nowcerts_service.update_contact(action["nowcerts_id"], action["data"])
+                    write.target_id = result.get("id") or action["nowcerts_id"]
+            outcome = f"{action['action']}:ok"
+        except Exception as e:
+            logger.warning(f"Error aplicando {action['action']} a {action['key']}: {getattr(e, 'detail', None) or str(e)}")
+            outcome = f"{action['action']}:error"
+        finally:
+            semaphore.release()
+        results[outcome] = results.get(outcome, 0) + 1
+        if progress:
+            progress(sum(results.values()), total, "Acciones del plan ejecutadas")
+    
+    try:
+        with lane(BULK), open(plan_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                await semaphore.acquire()
+                task = asyncio.create_task(_apply(json.loads(line)))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+    except asyncio.CancelledError:
+        # Cancelado (p. ej. un trabajo de sincronización): no dejar escrituras huérfanas
+        for task in tasks:
+            task.cancel()
+        raise
+    return results
+
+
+async def _run_plan(plan_path: str, prefer: str, workdir: Optional[str]) -> Dict[str, Any]:
+    from app.core.http_client import close_clients
+    
+    try:
+        return await Reconciler(workdir=workdir).run(plan_path, prefer)
+    finally:
+        await close_clients()
+
+
+async def _apply_plan(plan_path: str, concurrency: Optional[int]) -> Dict[str, Any]:
+    from app.core.http_client import close_clients
+    
+    try:
+        return await apply_plan(plan_path, concurrency)
+    finally:
+        await close_clients()
+        sync_journal.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument("--plan", help="Comparar ambos sistemas y escribir el plan en este archivo")
+    action.add_argument("--apply", help="Ejecutar un plan generado con --plan")
+    parser.add_argument(
+        "--prefer", choices=[NOWCERTS, GHL], default=NOWCERTS,
+        help="Sistema que manda cuando un contacto difiere"
+    )
+    parser.add_argument("--concurrency", type=int, help="Escrituras a la vez al aplicar")
+    parser.add_argument("--workdir", help="Directorio del archivo temporal de comparación")
+    args = parser.parse_args()
+    
+    if args.plan:
+        result = asyncio.run(_run_plan(args.plan, args.prefer, args.workdir))
+    else:
+        result = asyncio.run(_apply_plan(args.apply, args.concurrency))
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
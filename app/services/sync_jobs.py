@@ -0,0 +1,304 @@
+"""
+Trabajos de sincronización en segundo plano
+Las sincronizaciones largas (un asegurado con todo su grafo, importaciones
+masivas, reconciliaciones) se ejecutan fuera de la petición HTTP: la API
+devuelve el ID del trabajo y el avance se consulta o se sigue por SSE
+"""
+import asyncio
+import os
+import time
+import uuid
+from typing import Optional, Dict, Any, List, Callable, Awaitable
+from app.core.config import settings
+from app.core.exceptions import JobQueueFullError
+from app.core.logger import logger
+from app.core.memory import memory_registry, container_usage
+from app.core.priority import BULK, lane
+from app.core.tracing import start_trace
+from app.models.webhooks import SyncJobRequest
+from app.services.contact_matching import rebuild as rebuild_contact_index
+from app.services.entity_sync import entity_sync
+from app.services.reconciliation import Reconciler, apply_plan
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+TIMED_OUT = "timed_out"
+
+FINISHED = (SUCCEEDED, FAILED, CANCELLED, TIMED_OUT)
+
+
+class SyncJob:
+    """Estado de un trabajo: los cambios despiertan a quien sigue su avance"""
+    
+    def __init__(self, request: SyncJobRequest, timeout: float):
+        self.id = uuid.uuid4().hex
+        self.request = request
+        self.timeout = timeout
+        self.status = QUEUED
+        self.progress: Dict[str, Any] = {"done": 0, "total": None, "message": "En cola"}
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.files: List[str] = []
+        self.version = 0
+        self._changed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+    
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+    
+    def _notify(self):
+        self.version += 1
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+    
+    def report(self, done: int, total: Optional[int] = None, message: Optional[str] = None):
+        """
+        Anota el avance del trabajo
+        
+        Args:
+            done: Registros procesados
+            total: Total de registros (None si aún no se conoce)
+            message: Fase en curso
+        """
+        self.progress = {
+            "done": done,
+            "total": total,
+            "message": message or self.progress["message"]
+        }
+        self._notify()
+    
+    def _set_status(self, status: str, error: Optional[str] = None):
+        self.status = status
+        if status == RUNNING:
+            self.started_at = time.time()
+            self.progress["message"] = "En curso"
+        elif status in FINISHED:
+            self.finished_at = time.time()
+            self.error = error
+        self._notify()
+    
+    async def wait_for_change(self, version: int, timeout: float) -> bool:
+        """
+        Espera a que el trabajo cambie respecto a `version`
+        
+        Returns:
+            True si cambió, False si pasó el tiempo sin cambios
+        """
+        if self.version != version:
+            return True
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+    
+    def snapshot(self, include_result: bool = True) -> Dict[str, Any]:
+        """Estado del trabajo (sin los contactos de una importación)"""
+        snapshot = {
+            "id": self.id,
+            "kind": self.request.kind,
+            "params": self.request.model_dump(exclude_none=True, exclude_defaults=True, exclude={"contacts"}),
+            "status": self.status,
+            "progress": dict(self.progress),
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "timeout_seconds": self.timeout
+        }
+        if self.request.contacts is not None:
+            snapshot["params"]["contacts"] = len(self.request.contacts)
+        if include_result:
+            snapshot["result"] = self.result
+        return snapshot
+
+
+async def _run_entity(job: SyncJob) -> Dict[str, Any]:
+    request = job.request
+    sync = entity_sync.sync_nowcerts if request.source == "nowcerts" else entity_sync.sync_ghl
+    return await sync(request.entity_type, request.entity_id, request.include_related, job.report)
+
+
+async def _run_import(job: SyncJob) -> Dict[str, Any]:
+    return await entity_sync.import_contacts(job.request.source, job.request.contacts, job.report)
+
+
+async def _run_reconcile(job: SyncJob) -> Dict[str, Any]:
+    os.makedirs(settings.SYNC_JOBS_DIR, exist_ok=True)
+    plan_path = os.path.join(settings.SYNC_JOBS_DIR, f"{job.id}.plan.jsonl")
+    job.files.append(plan_path)
+    result = await Reconciler(workdir=settings.SYNC_JOBS_DIR, progress=job.report).run(
+        plan_path, job.request.prefer
+    )
+    if job.request.apply and result["actions"]:
+        result["applied"] = await apply_plan(plan_path, progress=job.report)
+    return result
+
+
+async def _run_contact_index(job: SyncJob) -> Dict[str, Any]:
+    return {"contacts": await rebuild_contact_index(progress=job.report)}
+
+
+# Ejecución de cada tipo de trabajo
+_RUNNERS: Dict[str, Callable[[SyncJob], Awaitable[Dict[str, Any]]]] = {
+    "entity": _run_entity,
+    "import": _run_import,
+    "reconcile": _run_reconcile,
+    "contact_index": _run_contact_index
+}
+
+
+class SyncJobManager:
+    """
+    Ejecutor acotado de trabajos de sincronización
+    
+    Como mucho SYNC_JOBS_CONCURRENCY trabajos se ejecutan a la vez, en el
+    carril BULK, y hay un máximo de SYNC_JOBS_MAX_PENDING sin terminar
+    (en cola o en curso); más allá se rechazan con 429. Cada trabajo tiene
+    su tiempo máximo y se puede cancelar. Los terminados se conservan
+    SYNC_JOB_RETENTION_SECONDS para consultar su resultado.
+    
+    Los trabajos viven en memoria: un reinicio cancela los que estén en curso.
+    """
+    
+    def __init__(
+        self,
+        concurrency: Optional[int] = None,
+        max_pending: Optional[int] = None,
+        timeout_seconds: Optional[float] = None,
+        retention_seconds: Optional[float] = None
+    ):
+        self.concurrency = concurrency or settings.SYNC_JOBS_CONCURRENCY
+        self.max_pending = max_pending or settings.SYNC_JOBS_MAX_PENDING
+        self.timeout_seconds = timeout_seconds or settings.SYNC_JOB_TIMEOUT_SECONDS
+        self.retention_seconds = (
+            retention_seconds if retention_seconds is not None else settings.SYNC_JOB_RETENTION_SECONDS
+        )
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._jobs: Dict[str, SyncJob] = {}
+    
+    @property
+    def pending_count(self) -> int:
+        """Trabajos en cola o en curso"""
+        return sum(1 for job in self._jobs.values() if not job.finished)
+    
+    def submit(self, request: SyncJobRequest) -> SyncJob:
+        """
+        Encola un trabajo y devuelve enseguida
+        
+        Args:
+            request: Tipo de trabajo y parámetros (ya validados)
+        
+        Returns:
+            Trabajo en estado queued
+        
+        Raises:
+            JobQueueFullError: Si hay SYNC_JOBS_MAX_PENDING trabajos sin terminar
+        """
+        self.purge()
+        if self.pending_count >= self.max_pending:
+            raise JobQueueFullError(
+                f"Hay {self.max_pending} trabajos de sincronización pendientes; inténtalo más tarde"
+            )
+        
+        timeout = min(request.timeout_seconds or self.timeout_seconds, self.timeout_seconds)
+        job = SyncJob(request, timeout)
+        self._jobs[job.id] = job
+        job._task = asyncio.create_task(self._run(job))
+        logger.info(f"Trabajo de sincronización {job.id} ({request.kind}) encolado")
+        return job
+    
+    async def _run(self, job: SyncJob):
+        try:
+            async with self._semaphore:
+                job._set_status(RUNNING)
+                with lane(BULK), start_trace("sync.job", kind=job.request.kind, job_id=job.id):
+                    job.result = await asyncio.wait_for(_RUNNERS[job.request.kind](job), timeout=job.timeout)
+            job._set_status(SUCCEEDED)
+            logger.info(f"Trabajo de sincronización {job.id} terminado")
+        except asyncio.CancelledError:
+            job._set_status(CANCELLED, "Cancelado")
+            logger.info(f"Trabajo de sincronización {job.id} cancelado")
+        except asyncio.TimeoutError:
+            job._set_status(TIMED_OUT, f"Tiempo máximo agotado ({job.timeout:g}s)")
+            logger.warning(f"Trabajo de sincronización {job.id} cancelado por tiempo ({job.timeout:g}s)")
+        except Exception as e:
+            # ExternalAPIError (HTTPException) lleva el mensaje en detail
+            error = getattr(e, "detail", None) or str(e) or type(e).__name__
+            job._set_status(FAILED, error)
+            logger.error(f"Error en el trabajo de sincronización {job.id}: {error}", exc_info=True)
+    
+    def get(self, job_id: str) -> Optional[SyncJob]:
+        """Trabajo por ID (None si no existe o ya se purgó)"""
+        self.purge()
+        return self._jobs.get(job_id)
+    
+    def list_jobs(self, status: Optional[str] = None) -> List[SyncJob]:
+        """Trabajos conservados, del más antiguo al más reciente"""
+        self.purge()
+        return [job for job in self._jobs.values() if status is None or job.status == status]
+    
+    def cancel(self, job_id: str) -> Optional[SyncJob]:
+        """
+        Cancela un trabajo en cola o en curso
+        
+        Returns:
+            El trabajo (sin cambios si ya había terminado) o None si no existe
+        """
+        job = self._jobs.get(job_id)
+        if job is not None and not job.finished and job._task is not None:
+            job._task.cancel()
+        return job
+    
+    def purge(self):
+        """Olvida los trabajos terminados hace más de SYNC_JOB_RETENTION_SECONDS"""
+        cutoff = time.time() - self.retention_seconds
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            for path in self._jobs.pop(job_id).files:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+    
+    async def stop(self, timeout: float = 10.0):
+        """
+        Cancela los trabajos sin terminar y espera a que se detengan
+        
+        Args:
+            timeout: Tiempo máximo de espera
+        """
+        tasks = [job._task for job in self._jobs.values() if not job.finished and job._task is not None]
+        if not tasks:
+            return
+        logger.info(f"Cancelando {len(tasks)} trabajos de sincronización...")
+        for task in tasks:
+            task.cancel()
+        await asyncio.wait(tasks, timeout=timeout)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Trabajos conservados por estado"""
+        by_status: Dict[str, int] = {}
+        for job in self._jobs.values():
+            by_status[job.status] = by_status.get(job.status, 0) + 1
+        return {
+            "concurrency": self.concurrency,
+            "max_pending": self.max_pending,
+            "pending": self.pending_count,
+            "jobs": by_status
+        }
+
+
+# Instancia global del gestor de trabajos
+sync_jobs = SyncJobManager()
+memory_registry.register("sync_jobs.jobs", "cache", lambda: container_usage(sync_jobs._jobs))
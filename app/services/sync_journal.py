@@ -0,0 +1,340 @@
+"""
+Diario de sincronización por entidad y supresión de ecos
+Registra qué lado escribió cada entidad por última vez, cuándo y con qué
+contenido, para reconocer los webhooks que solo devuelven nuestras propias
+escrituras (eco) y cortar el bucle NowCerts → GHL → NowCerts
+"""
+import hashlib
+import os
+import sqlite3
+import time
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, List, Set, Tuple, AsyncIterator
+from app.core.config import settings
+from app.core.json_codec import canonical_dumps
+from app.core.logger import logger
+from app.core.memory import memory_registry, container_usage
+from app.services.contact_matching import normalize_email, normalize_phone
+
+# Campos de contacto (formato GHL) que se sincronizan en ambos sentidos;
+# el resto (IDs, fechas, etiquetas) cambia al escribir y no cuenta para el eco
+CONTACT_SYNC_FIELDS = (
+    "firstName", "lastName", "email", "phone",
+    "address1", "city", "state", "postalCode"
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sync_journal (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    entity_type TEXT NOT NULL,
+    entity_key TEXT NOT NULL,
+    action TEXT NOT NULL,
+    origin TEXT NOT NULL,
+    target TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    source_id TEXT,
+    target_id TEXT,
+    event_id TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sync_journal_entity
+    ON sync_journal (entity_type, entity_key, id);
+CREATE INDEX IF NOT EXISTS sync_journal_created
+    ON sync_journal (created_at);
+CREATE INDEX IF NOT EXISTS sync_journal_source
+    ON sync_journal (source_id);
+CREATE INDEX IF NOT EXISTS sync_journal_target
+    ON sync_journal (target_id);
+"""
+
+_COLUMNS = (
+    "id", "entity_type", "entity_key", "action", "origin", "target",
+    "content_hash", "source_id", "target_id", "event_id", "created_at"
+)
+
+# Cada cuántas escrituras se purgan las entradas fuera de retención
+_PRUNE_EVERY = 1000
+
+
+def contact_match_key(contact_data: Dict[str, Any]) -> Optional[str]:
+    """
+    Clave de coincidencia de un contacto en formato GHL (email o teléfono)
+    
+    Es la misma en ambos sistemas, por lo que identifica la entidad en el diario.
+    
+    Returns:
+        "email:<email>", "phone:<E.164>" o None si no tiene ninguno
+    """
+    email = normalize_email(contact_data.get("email"))
+    if email:
+        return f"email:{email}"
+    
+    phone = normalize_phone(contact_data.get("phone"))
+    if phone:
+        return f"phone:{phone}"
+    return None
+
+
+def contact_fingerprint(contact_data: Dict[str, Any]) -> str:
+    """
+    Hash del contenido sincronizado de un contacto en formato GHL
+    
+    Normaliza espacios, mayúsculas del email y formato del teléfono (E.164)
+    para que el mismo contacto dé el mismo hash visto desde NowCerts o desde GHL.
+    """
+    normalized = {}
+    for field in CONTACT_SYNC_FIELDS:
+        value = contact_data.get(field)
+        value = "" if value is None else str(value).strip()
+        if field == "email":
+            value = value.lower()
+        elif field == "phone":
+            value = normalize_phone(value) or "".join(ch for ch in value if ch.isdigit())
+        normalized[field] = value
+    return hashlib.sha256(canonical_dumps(normalized)).hexdigest()[:32]
+
+
+class JournalWrite:
+    """Escritura en curso: el llamador completa target_id con la respuesta"""
+    
+    __slots__ = ("entity_type", "entity_key", "origin", "target", "content_hash",
+                 "source_id", "target_id", "event_id")
+    
+    def __init__(
+        self,
+        entity_type: str,
+        entity_key: str,
+        origin: str,
+        target: str,
+        content_hash: str,
+        source_id: Optional[str],
+        event_id: Optional[str]
+    ):
+        self.entity_type = entity_type
+        self.entity_key = entity_key
+        self.origin = origin
+        self.target = target
+        self.content_hash = content_hash
+        self.source_id = source_id
+        self.target_id: Optional[str] = None
+        self.event_id = event_id
+
+
+class SyncJournal:
+    """
+    Diario persistente (SQLite) de las escrituras de la integración
+    
+    Un evento entrante del sistema S sobre la entidad E es un eco si dentro
+    de SYNC_ECHO_WINDOW_SECONDS escribimos en S esa misma entidad con el
+    mismo contenido. Las escrituras se anotan como pendientes antes de la
+    llamada, porque el webhook del eco puede llegar antes que la respuesta.
+    
+    SQLite en modo WAL sin fsync por commit: cada consulta o inserción usa
+    índices y cuesta microsegundos, así que se hace en el propio event loop.
+    """
+    
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        echo_window: Optional[float] = None,
+        retention_days: Optional[float] = None
+    ):
+        self.path = path if path is not None else settings.SYNC_JOURNAL_FILE
+        self.echo_window = (
+            echo_window if echo_window is not None else settings.SYNC_ECHO_WINDOW_SECONDS
+        )
+        self.retention_seconds = (
+            retention_days if retention_days is not None else settings.SYNC_JOURNAL_RETENTION_DAYS
+        ) * 86400
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pending: Set[Tuple[str, str, str, str]] = set()
+        self._writes_since_prune = 0
+        self.echoes_suppressed = 0
+    
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            path = self.path or ":memory:"
+            if path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+            if path != ":memory:":
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SCHEMA)
+            self.prune()
+        return self._conn
+    
+    def close(self):
+        """Cierra la base de datos (se reabre sola si se vuelve a usar)"""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+    
+    def prune(self) -> int:
+        """Elimina las entradas anteriores a SYNC_JOURNAL_RETENTION_DAYS"""
+        cursor = self._connection().execute(
+            "DELETE FROM sync_journal WHERE created_at < ?",
+            (time.time() - self.retention_seconds,)
+        )
+        self._writes_since_prune = 0
+        return cursor.rowcount
+    
+    def _insert(self, action: str, write: JournalWrite):
+        # La escritura en el sistema destino ya se hizo: un fallo del diario
+        # solo se registra (se pierde la supresión del eco, no el dato)
+        try:
+            self._connection().execute(
+                "INSERT INTO sync_journal (entity_type, entity_key, action, origin, target, "
+                "content_hash, source_id, target_id, event_id, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    write.entity_type, write.entity_key, action, write.origin, write.target,
+                    write.content_hash, write.source_id, write.target_id, write.event_id,
+                    time.time()
+                )
+            )
+        except sqlite3.Error as e:
+            logger.error(f"Error escribiendo en el diario de sincronización: {str(e)}")
+            return
+        self._writes_since_prune += 1
+        if self._writes_since_prune >= _PRUNE_EVERY:
+            self.prune()
+    
+    def is_echo(self, entity_type: str, entity_key: Optional[str], system: str, content_hash: str) -> bool:
+        """
+        Indica si un evento del sistema `system` solo devuelve una escritura nuestra
+        
+        Args:
+            entity_type: Tipo de entidad (contact, ...)
+            entity_key: Clave de la entidad (None = no identificable, nunca es eco)
+            system: Sistema que envía el evento (nowcerts, ghl)
+            content_hash: Hash del contenido del evento
+        """
+        if entity_key is None:
+            return False
+        if (entity_type, entity_key, system, content_hash) in self._pending:
+            return True
+        row = self._connection().execute(
+            "SELECT 1 FROM sync_journal WHERE entity_type = ? AND entity_key = ? "
+            "AND action = 'write' AND target = ? AND content_hash = ? AND created_at >= ? LIMIT 1",
+            (entity_type, entity_key, system, content_hash, time.time() - self.echo_window)
+        ).fetchone()
+        return row is not None
+    
+    def record_echo(
+        self,
+        entity_type: str,
+        entity_key: str,
+        system: str,
+        content_hash: str,
+        source_id: Optional[str] = None,
+        event_id: Optional[str] = None
+    ):
+        """Anota en el historial un eco descartado"""
+        self.echoes_suppressed += 1
+        self._insert("echo_suppressed", JournalWrite(
+            entity_type, entity_key, system, system, content_hash, source_id, event_id
+        ))
+    
+    @asynccontextmanager
+    async def writing(
+        self,
+        entity_type: str,
+        entity_key: Optional[str],
+        origin: str,
+        target: str,
+        content_hash: str,
+        source_id: Optional[str] = None,
+        event_id: Optional[str] = None
+    ) -> AsyncIterator[JournalWrite]:
+        """
+        Envuelve una escritura en `target` y la registra si termina bien
+        
+        Sin entity_key (contacto sin email ni teléfono) se registra con la
+        clave "id:<source_id>": no habrá supresión de ecos, pero counterpart_id
+        enlaza igualmente los IDs de ambos sistemas.
+        
+        Uso:
+            async with sync_journal.writing("contact", key, "nowcerts", "ghl", h) as write:
+                result = await ghl_service.upsert_contact(data)
+                write.target_id = result["contact"]["id"]
+        """
+        if entity_key is None:
+            # Sin clave de contenido no hay supresión de ecos, pero la escritura
+            # se registra igual para enlazar el ID de origen con el de destino
+            write = JournalWrite(
+                entity_type, f"id:{source_id}" if source_id else "", origin, target,
+                content_hash, source_id, event_id
+            )
+            yield write
+            if source_id:
+                self._insert("write", write)
+            return
+        
+        write = JournalWrite(entity_type, entity_key, origin, target, content_hash, source_id, event_id)
+        pending = (entity_type, entity_key, target, content_hash)
+        self._pending.add(pending)
+        try:
+            yield write
+            self._insert("write", write)
+        finally:
+            self._pending.discard(pending)
+    
+    def counterpart_id(self, entity_type: str, system: str, entity_id: Optional[str]) -> Optional[str]:
+        """
+        ID en el otro sistema de una entidad que ya sincronizamos
+        
+        Sale de la escritura más reciente que la enlazó, en cualquier sentido
+        (dentro de SYNC_JOURNAL_RETENTION_DAYS), sin llamar a ninguna API.
+        
+        Args:
+            entity_type: Tipo de entidad (contact, ...)
+            system: Sistema del ID conocido (nowcerts, ghl)
+            entity_id: ID en ese sistema
+        
+        Returns:
+            ID en el otro sistema o None si no hay escritura que los enlace
+        """
+        if not entity_id:
+            return None
+        row = self._connection().execute(
+            "SELECT CASE WHEN origin = ? THEN target_id ELSE source_id END FROM sync_journal "
+            "WHERE entity_type = ? AND action = 'write' AND target_id IS NOT NULL "
+            "AND source_id IS NOT NULL "
+            "AND ((origin = ? AND source_id = ?) OR (target = ? AND target_id = ?)) "
+            "ORDER BY id DESC LIMIT 1",
+            (system, entity_type, system, entity_id, system, entity_id)
+        ).fetchone()
+        return row[0] if row else None
+    
+    def history(self, entity_type: str, entity_key: str, limit: int = 50) -> List[Dict[str, Any]]:
+        """
+        Historial de sincronización de una entidad, de más reciente a más antiguo
+        
+        Args:
+            entity_type: Tipo de entidad
+            entity_key: Clave de la entidad (p. ej. "email:ana@example.com")
+            limit: Máximo de entradas
+        """
+        rows = self._connection().execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM sync_journal "
+            "WHERE entity_type = ? AND entity_key = ? ORDER BY id DESC LIMIT ?",
+            (entity_type, entity_key, limit)
+        ).fetchall()
+        return [dict(zip(_COLUMNS, row)) for row in rows]
+    
+    def stats(self) -> Dict[str, Any]:
+        """Entradas guardadas, escrituras pendientes y ecos descartados"""
+        entries = self._connection().execute("SELECT COUNT(*) FROM sync_journal").fetchone()[0]
+        return {
+            "path": self.path,
+            "entries": entries,
+            "pending_writes": len(self._pending),
+            "echoes_suppressed": self.echoes_suppressed,
+            "echo_window_seconds": self.echo_window
+        }
+
+
+# Instancia global del diario de sincronización
+sync_journal = SyncJournal()
+memory_registry.register("sync_journal.pending_writes", "queue", lambda: container_usage(sync_journal._pending))
@@ -0,0 +1,130 @@
+"""
+Caché cifrada en disco de los tokens de NowCerts
+Permite que un reinicio o un despliegue con varias réplicas reutilice el
+token vigente en vez de hacer login de nuevo
+"""
+import base64
+import hashlib
+import json
+import os
+import time
+from typing import Optional, Dict, Any
+from app.core.config import settings
+from app.core.logger import logger
+from app.core.storage import FileLock, atomic_write_bytes
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:  # Dependencia opcional: sin ella la caché queda deshabilitada
+    Fernet = None
+    InvalidToken = None
+
+# Iteraciones de PBKDF2 al derivar la clave de las credenciales (una vez por proceso)
+_KDF_ITERATIONS = 200_000
+
+
+def _derive_key() -> bytes:
+    """
+    Clave Fernet derivada de las credenciales de NowCerts
+    
+    Quien puede leer las credenciales puede hacer login igualmente, así que
+    el token en disco no queda más expuesto que ellas; todas las réplicas con
+    las mismas credenciales comparten la caché sin configurar nada más.
+    """
+    secret = "\0".join(
+        value or "" for value in (
+            settings.NOWCERTS_USERNAME,
+            settings.NOWCERTS_PASSWORD,
+            settings.NOWCERTS_CLIENT_SECRET
+        )
+    ).encode()
+    salt = f"nowcerts-token-cache:{settings.NOWCERTS_BASE_URL}".encode()
+    raw = hashlib.pbkdf2_hmac("sha256", secret, salt, _KDF_ITERATIONS, dklen=32)
+    return base64.urlsafe_b64encode(raw)
+
+
+class TokenCache:
+    """
+    Tokens de NowCerts guardados cifrados (Fernet) en NOWCERTS_TOKEN_CACHE_FILE
+    
+    La escritura es atómica (archivo temporal + rename, permisos 0600) y un
+    bloqueo de archivo serializa las renovaciones entre procesos: la réplica
+    que llega tarde encuentra el token que acaba de guardar otra y no hace
+    login. Los tokens se guardan junto al usuario y la URL base para no usar
+    nunca el token de otra cuenta.
+    """
+    
+    def __init__(self, path: Optional[str] = None, key: Optional[str] = None):
+        self.path = path if path is not None else settings.NOWCERTS_TOKEN_CACHE_FILE
+        self._key = key if key is not None else settings.NOWCERTS_TOKEN_CACHE_KEY
+        self._fernet = None
+        self.hits = 0
+        self.writes = 0
+        
+        if self.path and Fernet is None:
+            logger.warning(
+                "NOWCERTS_TOKEN_CACHE_FILE configurado pero 'cryptography' no está "
+                "instalado: la caché de tokens queda deshabilitada"
+            )
+            self.path = None
+    
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+    
+    def _cipher(self):
+        if self._fernet is None:
+            self._fernet = Fernet(self._key.encode() if self._key else _derive_key())
+        return self._fernet
+    
+    def _owner(self) -> Dict[str, Any]:
+        return {"base_url": settings.NOWCERTS_BASE_URL, "username": settings.NOWCERTS_USERNAME}
+    
+    def lock(self) -> FileLock:
+        """Bloqueo entre procesos para renovar el token"""
+        return FileLock(self.path, timeout=settings.NOWCERTS_TOKEN_CACHE_LOCK_TIMEOUT_SECONDS)
+    
+    def load(self) -> Optional[Dict[str, Any]]:
+        """
+        Lee los tokens guardados
+        
+        Returns:
+            access_token, refresh_token y expires_at (epoch), o None si no hay
+            caché, no se puede descifrar o es de otra cuenta
+        """
+        if not self.enabled or not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, "rb") as f:
+                data = json.loads(self._cipher().decrypt(f.read()))
+        except (OSError, ValueError, InvalidToken) as e:
+            logger.warning(f"Caché de tokens ilegible, se ignora: {type(e).__name__}")
+            return None
+        if data.get("owner") != self._owner():
+            return None
+        self.hits += 1
+        return data
+    
+    def save(self, access_token: str, refresh_token: Optional[str], expires_at: float):
+        """
+        Guarda los tokens (cifrados, escritura atómica)
+        
+        Args:
+            access_token: Token de acceso
+            refresh_token: Token de renovación (si lo hay)
+            expires_at: Expiración del access token (epoch)
+        """
+        if not self.enabled:
+            return
+        payload = json.dumps({
+            "owner": self._owner(),
+            "access_token": access_token,
+            "refresh_token": refresh_token,
+            "expires_at": expires_at,
+            "saved_at": time.time()
+        }).encode()
+        try:
+            atomic_write_bytes(self.path, self._cipher().encrypt(payload), mode=0o600)
+            self.writes += 1
+        except (OSError, ValueError) as e:
+            logger.warning(f"No se pudo guardar la caché de tokens: {str(e)}")
@@ -2,6 +2,7 @@
 Gestor de tokens para NowCerts
 Maneja access_token, refresh_token y renovación automática
 """
+import asyncio
 import time
 from typing import Optional, Dict, Any
 from datetime import datetime, timedelta
@@ -9,6 +10,9 @@ import httpx
 from app.core.config import settings
 from app.core.exceptions import TokenExpiredError, ExternalAPIError, ExternalAPIConnectionError
 from app.core.logger import logger
+from app.core.http_client import get_client
+from app.core.tracing import span
+from app.services.token_cache import TokenCache
 
 
 class TokenManager:
@@ -24,6 +28,8 @@ class TokenManager:
         self._access_token: Optional[str] = None
         self._refresh_token: Optional[str] = None
         self._token_expires_at: Optional[datetime] = None
+        self._refresh_lock: Optional[asyncio.Lock] = None
+        self._cache = TokenCache()
     
     async def _login(self) -> Dict[str, Any]:
         """
@@ -44,25 +50,26 @@ class TokenManager:
             payload["client_id"] = self.client_id
             payload["client_secret"] = self.client_secret
         
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            try:
-                response = await client.post(url, json=payload)
-                response.raise_for_status()
-                return response.json()
-            
-            except httpx.HTTPStatusError as e:
-                error_detail = e.response.text if e.response.text else str(e)
-                raise ExternalAPIError(
-                    status_code=e.response.status_code,
-                    detail=f"Error en login de NowCerts: {error_detail}",
-                    service_name="NowCerts"
-                )
-            
-            except httpx.RequestError as e:
-                raise ExternalAPIConnectionError(
-                    detail=f"Error de conexión en login de NowCerts: {str(e)}",
-                    service_name="NowCerts"
-                )
+        client = get_client("nowcerts")
+        
+        try:
+            response = await client.post(url, json=payload)
+            response.raise_for_status()
+            return response.json()
+        
+        except httpx.HTTPStatusError as e:
+            error_detail = e.response.text if e.response.text else str(e)
+            raise ExternalAPIError(
+                status_code=e.response.status_code,
+                detail=f"Error en login de NowCerts: {error_detail}",
+                service_name="NowCerts"
+            )
+        
+        except httpx.RequestError as e:
+            raise ExternalAPIConnectionError(
+                detail=f"Error de conexión en login de NowCerts: {str(e)}",
+                service_name="NowCerts"
+            )
     
     async def _refresh_access_token(self) -> Dict[str, Any]:
         """
@@ -81,81 +88,169 @@ class TokenManager:
             "refresh_token": self._refresh_token
         }
         
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            try:
-                response = await client.post(url, json=payload)
-                response.raise_for_status()
-                return response.json()
-            
-            except httpx.HTTPStatusError as e:
-                # Si el refresh falla, hacer login completo
-                if e.response.status_code == 401:
-                    logger.warning("Refresh token expirado, realizando login completo")
-                    return await self._login()
-                else:
-                    error_detail = e.response.text if e.response.text else str(e)
-                    raise ExternalAPIError(
-                        status_code=e.response.status_code,
-                        detail=f"Error al refrescar token: {error_detail}",
-                        service_name="NowCerts"
-                    )
-            
-            except httpx.RequestError as e:
-                raise ExternalAPIConnectionError(
-                    detail=f"Error de conexión al refrescar token: {str(e)}",
+        client = get_client("nowcerts")
+        
+        try:
+            response = await client.post(url, json=payload)
+            response.raise_for_status()
+            return response.json()
+        
+        except httpx.HTTPStatusError as e:
+            # Si el refresh falla, hacer login completo
+            if e.response.status_code == 401:
+                logger.warning("Refresh token expirado, realizando login completo")
+                return await self._login()
+            else:
+                error_detail = e.response.text if e.response.text else str(e)
+                raise ExternalAPIError(
+                    status_code=e.response.status_code,
+                    detail=f"Error al refrescar token: {error_detail}",
                     service_name="NowCerts"
                 )
+        
+        except httpx.RequestError as e:
+            raise ExternalAPIConnectionError(
+                detail=f"Error de conexión al refrescar token: {str(e)}",
+                service_name="NowCerts"
+            )
     
-    async def get_access_token(self, force_refresh: bool = False) -> str:
+    def _needs_refresh(self, force_refresh: bool = False) -> bool:
+        """Indica si el token actual debe renovarse"""
+        return (
+            force_refresh or
+            not self._access_token or
+            not self._token_expires_at or
+            (self._token_expires_at - datetime.now()).total_seconds()
+            < settings.TOKEN_REFRESH_BUFFER_SECONDS
+        )
+    
+    async def _renew_token(self, force_refresh: bool = False):
         """
-        Obtiene un access_token válido, renovándolo si es necesario
+        Renueva los tokens (refresh si es posible, si no login completo)
         
         Args:
-            force_refresh: Si es True, fuerza la renovación del token
-        
-        Returns:
-            Access token válido
+            force_refresh: Si es True, omite el refresh y hace login completo
         """
+        logger.info("Renovando token de NowCerts...")
         now = datetime.now()
-        buffer_seconds = settings.TOKEN_REFRESH_BUFFER_SECONDS
-        
-        # Verificar si necesitamos renovar el token
-        needs_refresh = (
-            force_refresh or
-            not self._access_token or
-            not self._token_expires_at or
-            (self._token_expires_at - now).total_seconds() < buffer_seconds
-        )
         
-        if needs_refresh:
-            logger.info("Renovando token de NowCerts...")
-            
+        with span("nowcerts.token_renew", force_refresh=force_refresh) as renew_span:
             if self._refresh_token and not force_refresh:
                 # Intentar refrescar primero
+                renew_span.set_attribute("mode", "refresh")
                 try:
                     token_data = await self._refresh_access_token()
                 except Exception as e:
                     logger.warning(f"Error al refrescar token, haciendo login completo: {str(e)}")
+                    renew_span.set_attribute("mode", "login")
                     token_data = await self._login()
             else:
                 # Hacer login completo
+                renew_span.set_attribute("mode", "login")
                 token_data = await self._login()
+        
+        # Actualizar tokens
+        self._access_token = token_data.get("access_token")
+        self._refresh_token = token_data.get("refresh_token")
+        
+        # Calcular expiración (asumir 1 hora si no se especifica)
+        expires_in = token_data.get("expires_in", 3600)
+        self._token_expires_at = now + timedelta(seconds=expires_in)
+        
+        logger.info(f"Token renovado exitosamente. Expira en {expires_in} segundos")
+    
+    def _load_cached_token(self, stale_token: Optional[str]) -> bool:
+        """
+        Adopta el token de la caché en disco si es más nuevo y sigue vigente
+        
+        Args:
+            stale_token: Token que se quiere sustituir (el de la caché debe ser otro)
+        
+        Returns:
+            True si ya no hace falta renovar
+        """
+        cached = self._cache.load()
+        if not cached or not cached.get("access_token") or cached["access_token"] == stale_token:
+            return False
+        
+        self._access_token = cached["access_token"]
+        self._refresh_token = cached.get("refresh_token")
+        self._token_expires_at = datetime.fromtimestamp(cached["expires_at"])
+        if self._needs_refresh():
+            # Caducado o a punto: al menos el refresh_token evita el login completo
+            return False
+        logger.info("Token de NowCerts recuperado de la caché en disco")
+        return True
+    
+    async def _renew_token_shared(self, force_refresh: bool, stale_token: Optional[str]):
+        """
+        Renueva el token coordinándose con otros procesos a través de la caché
+        
+        Con el bloqueo de archivo tomado, vuelve a leer la caché: si otra
+        réplica acaba de renovar, usa su token sin llamar a NowCerts; si no,
+        renueva y guarda el resultado para las demás.
+        """
+        lock = self._cache.lock()
+        locked = await asyncio.to_thread(lock.acquire)
+        if not locked:
+            logger.warning("Bloqueo de la caché de tokens no disponible; renovando sin coordinar")
+        try:
+            if await asyncio.to_thread(self._load_cached_token, stale_token):
+                return
+            await self._renew_token(force_refresh)
+            expires_at = self._token_expires_at.timestamp()
+            await asyncio.to_thread(
+                self._cache.save, self._access_token, self._refresh_token, expires_at
+            )
+        finally:
+            if locked:
+                lock.release()
+    
+    async def get_access_token(self, force_refresh: bool = False) -> str:
+        """
+        Obtiene un access_token válido, renovándolo si es necesario
+        
+        Args:
+            force_refresh: Si es True, fuerza la renovación del token
+        
+        Returns:
+            Access token válido
+        """
+        if self._needs_refresh(force_refresh):
+            # Serializar renovaciones: una ráfaga de peticiones en frío
+            # comparte un único login en lugar de lanzar uno por petición
+            if self._refresh_lock is None:
+                self._refresh_lock = asyncio.Lock()
             
-            # Actualizar tokens
-            self._access_token = token_data.get("access_token")
-            self._refresh_token = token_data.get("refresh_token")
-            
-            # Calcular expiración (asumir 1 hora si no se especifica)
-            expires_in = token_data.get("expires_in", 3600)
-            self._token_expires_at = now + timedelta(seconds=expires_in)
-            
-            logger.info(f"Token renovado exitosamente. Expira en {expires_in} segundos")
+            stale_token = self._access_token
+            async with self._refresh_lock:
+                # Otra corrutina pudo renovar el token mientras esperábamos
+                already_refreshed = self._access_token != stale_token
+                if self._needs_refresh(force_refresh and not already_refreshed):
+                    if self._cache.enabled:
+                        await self._renew_token_shared(force_refresh, stale_token)
+                    else:
+                        await self._renew_token(force_refresh)
         
         if not self._access_token:
             raise TokenExpiredError("No se pudo obtener un access token válido")
         
         return self._access_token
     
+    def token_status(self) -> Dict[str, Any]:
+        """
+        Estado del token actual (sin I/O)
+        
+        Returns:
+            valid: hay token y no ha expirado
+            expires_in_seconds: segundos hasta la expiración (None sin token)
+        """
+        if not self._access_token or not self._token_expires_at:
+            return {"valid": False, "expires_in_seconds": None}
+        
+        expires_in = (self._token_expires_at - datetime.now()).total_seconds()
+        return {"valid": expires_in > 0, "expires_in_seconds": round(expires_in, 1)}
+    
     def get_headers(self) -> Dict[str, str]:
         """
         Obtiene headers con autenticación (debe llamarse después de get_access_token)
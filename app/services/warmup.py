@@ -0,0 +1,68 @@
+"""
+Precarga en el arranque (token de NowCerts, metadatos de GHL y pools HTTP)
+"""
+import asyncio
+import time
+from typing import Optional, Dict, Any
+from app.core.config import settings
+from app.core.logger import logger
+from app.services.ghl_service import GHLService
+from app.services.token_manager import token_manager
+
+
+class StartupState:
+    """Estado del arranque de la aplicación y métricas de tiempo"""
+    
+    def __init__(self):
+        self.import_seconds: Optional[float] = None
+        self.warmup_seconds: Optional[float] = None
+        self.ready = False
+        self.warmup_errors: Dict[str, str] = {}
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Representación para endpoints de estado"""
+        return {
+            "ready": self.ready,
+            "import_seconds": self.import_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "warmup_errors": self.warmup_errors
+        }
+
+
+# Estado global del arranque
+startup_state = StartupState()
+
+
+async def warm_up():
+    """
+    Precarga en paralelo el token de NowCerts y los pipelines de GHL
+    
+    Ambas llamadas abren además las conexiones TLS de los clientes
+    compartidos, de modo que la primera petición real encuentra los pools
+    calientes. Los errores se registran pero no impiden el arranque.
+    """
+    started = time.perf_counter()
+    tasks: Dict[str, Any] = {}
+    
+    if settings.NOWCERTS_USERNAME and settings.NOWCERTS_PASSWORD:
+        tasks["nowcerts_token"] = token_manager.get_access_token()
+    if settings.GHL_API_KEY:
+        tasks["ghl_pipelines"] = GHLService().get_pipelines()
+    
+    if tasks:
+        try:
+            results = await asyncio.wait_for(
+                asyncio.gather(*tasks.values(), return_exceptions=True),
+                timeout=settings.STARTUP_WARMUP_TIMEOUT_SECONDS
+            )
+        except asyncio.TimeoutError:
+            results = [asyncio.TimeoutError("Tiempo de precarga agotado")] * len(tasks)
+        
+        for name, result in zip(tasks.keys(), results):
+            if isinstance(result, BaseException):
+                startup_state.warmup_errors[name] = str(result) or type(result).__name__
+                logger.warning(f"Precarga de {name} falló: {startup_state.warmup_errors[name]}")
+    
+    startup_state.warmup_seconds = time.perf_counter() - started
+    startup_state.ready = True
+    logger.info(f"Precarga completada en {startup_state.warmup_seconds:.3f}s")
@@ -0,0 +1,111 @@
+"""
+Benchmark del coste de CPU de JSON por webhook (stdlib vs app.core.json_codec)
+
+Mide cada punto donde un webhook de NowCerts pasa por JSON: parseo y
+validación del request, model_dump, ID de idempotencia, body hacia GHL,
+decodificación de la respuesta de GHL y respuesta del webhook.
+
+La forma canónica de la idempotencia solo cambia de motor con
+IDEMPOTENCY_CANONICAL_JSON=fast.
+
+Uso:
+    python -m benchmarks.json_codec_bench [--iterations 20000] [--policies 20]
+    IDEMPOTENCY_CANONICAL_JSON=fast python -m benchmarks.json_codec_bench
+"""
+import argparse
+import json
+import timeit
+from fastapi.responses import JSONResponse
+from app.core import json_codec
+from app.core.idempotency import generate_event_id
+from app.models.webhooks import NowCertsWebhookPayload, WebhookResponse
+from app.services.mapper import DataMapper
+
+
+def build_payload(policies: int) -> dict:
+    return {
+        "event_type": "INSURED_UPDATE",
+        "timestamp": "2024-05-01T10:00:00Z",
+        "data": {
+            "id": "b7a1c2d3-0000-4000-8000-000000000001",
+            "firstName": "José",
+            "lastName": "Pérez",
+            "email": "jose.perez@example.com",
+            "phone": "+1 555 0100",
+            "address": {"street": "Calle Mayor 1", "city": "Miami", "state": "FL", "zip": "33101"},
+            "modifiedDate": "2024-05-01T09:59:58Z",
+            "policies": [
+                {
+                    "policyNumber": f"POL-{i:06d}",
+                    "policyType": "Auto",
+                    "premium": 1234.56 + i,
+                    "carrier": "Acme Insurance",
+                    "coverages": [{"code": f"C{j}", "limit": 100000, "deductible": 500} for j in range(5)]
+                }
+                for i in range(policies)
+            ]
+        }
+    }
+
+
+def run(iterations: int, policies: int):
+    body = json.dumps(build_payload(policies)).encode()
+    payload = NowCertsWebhookPayload.model_validate_json(body)
+    payload_dict = payload.model_dump()
+    contact = DataMapper.nowcerts_to_ghl_contact(payload.data)
+    ghl_response = json.dumps({"contact": {"id": "abc123", **contact}}).encode()
+    webhook_response = WebhookResponse(
+        success=True, message="ok", event_id="nowcerts_x", data={"contact": contact}
+    ).model_dump()
+    
+    steps = {
+        "parseo + validación del request": (
+            lambda: NowCertsWebhookPayload.model_validate(json.loads(body)),
+            lambda: NowCertsWebhookPayload.model_validate(json_codec.loads(body))
+        ),
+        "model_dump": (
+            payload.model_dump,
+            payload.model_dump
+        ),
+        "ID de idempotencia (payload completo)": (
+            lambda: json.dumps({"source": "nowcerts", "payload": payload_dict}, sort_keys=True, default=str).encode(),
+            lambda: json_codec.canonical_dumps({"source": "nowcerts", "payload": payload_dict})
+        ),
+        "ID de idempotencia (clave semántica)": (
+            lambda: generate_event_id(payload_dict, "nowcerts"),
+            lambda: generate_event_id(payload_dict, "nowcerts")
+        ),
+        "body hacia GHL": (
+            lambda: json.dumps(contact).encode(),
+            lambda: json_codec.dumps(contact)
+        ),
+        "respuesta de GHL": (
+            lambda: json.loads(ghl_response),
+            lambda: json_codec.loads(ghl_response)
+        ),
+        "respuesta del webhook": (
+            lambda: JSONResponse(webhook_response).body,
+            lambda: json_codec.response_class()(webhook_response).body
+        )
+    }
+    
+    print(f"Payload: {len(body)} bytes, {policies} pólizas, {iterations} iteraciones")
+    print(f"orjson: {'sí' if json_codec.USE_ORJSON else 'no'}")
+    print(f"{'paso':<40} {'stdlib µs':>10} {'codec µs':>10} {'mejora':>8}")
+    
+    total_before = total_after = 0.0
+    for name, (before, after) in steps.items():
+        before_us = min(timeit.repeat(before, number=iterations, repeat=3)) / iterations * 1e6
+        after_us = min(timeit.repeat(after, number=iterations, repeat=3)) / iterations * 1e6
+        total_before += before_us
+        total_after += after_us
+        print(f"{name:<40} {before_us:>10.2f} {after_us:>10.2f} {before_us / after_us:>7.2f}x")
+    print(f"{'total por webhook':<40} {total_before:>10.2f} {total_after:>10.2f} {total_before / total_after:>7.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--policies", type=int, default=20)
+    args = parser.parse_args()
+    run(args.iterations, args.policies)
@@ -0,0 +1,82 @@
+"""
+Benchmark de la validación de webhooks: modelo genérico vs unión discriminada
+
+Compara, por tipo de evento, lo que hacía el procesamiento antes
+(model_validate del modelo genérico con `data: Dict[str, Any]` +
+model_dump) con lo que hace ahora (parse_*_event, que valida solo el
+esquema del tipo recibido, + raw_dict, que no vuelca el modelo).
+
+Uso:
+    python -m benchmarks.validation_bench [--iterations 20000] [--policies 20]
+"""
+import argparse
+import timeit
+from app.models.webhooks import (
+    NowCertsWebhookPayload,
+    GHLWebhookPayload,
+    parse_nowcerts_event,
+    parse_ghl_event
+)
+from benchmarks.json_codec_bench import build_payload
+
+
+def build_events(policies: int) -> dict:
+    insured = build_payload(policies)
+    return {
+        "nowcerts INSURED_UPDATE": ("nowcerts", insured),
+        "nowcerts POLICY_UPDATE": ("nowcerts", {
+            "event_type": "POLICY_UPDATE",
+            "timestamp": "2024-05-01T10:00:00Z",
+            "data": insured["data"]["policies"][0]
+        }),
+        "nowcerts otro evento": ("nowcerts", {
+            "event_type": "TASK_UPDATE",
+            "timestamp": "2024-05-01T10:00:00Z",
+            "data": {"id": "t-1", "title": "Llamar al cliente", "dueDate": "2024-05-02"}
+        }),
+        "ghl contacto": ("ghl", {
+            "event": "ContactUpdate",
+            "locationId": "loc-1",
+            "contact": {
+                "id": "c-1", "firstName": "José", "lastName": "Pérez",
+                "email": "jose.perez@example.com", "phone": "+1 555 0100",
+                "tags": ["cliente", "auto"], "dateUpdated": "2024-05-01T10:00:00Z"
+            }
+        }),
+        "ghl oportunidad": ("ghl", {
+            "event": "OpportunityUpdate",
+            "locationId": "loc-1",
+            "opportunity": {
+                "id": "o-1", "name": "Auto Policy - POL-000001", "monetaryValue": 1234.56,
+                "customFields": [{"key": "policy_type", "value": "Auto"}, {"key": "carrier", "value": "Acme"}]
+            }
+        })
+    }
+
+
+def run(iterations: int, policies: int):
+    print(f"{iterations} iteraciones, {policies} pólizas en el asegurado")
+    print(f"{'evento':<28} {'genérico µs':>12} {'tipado µs':>10} {'mejora':>8}")
+    
+    for name, (source, data) in build_events(policies).items():
+        if source == "nowcerts":
+            before = lambda: NowCertsWebhookPayload.model_validate(data).model_dump()
+            after = lambda: parse_nowcerts_event(data).raw_dict()
+            # Mismo payload para la idempotencia antes y después
+            assert before() == after()
+        else:
+            before = lambda: GHLWebhookPayload.model_validate(data).model_dump()
+            after = lambda: parse_ghl_event(data).raw_dict()
+            assert before() == after()
+        
+        before_us = min(timeit.repeat(before, number=iterations, repeat=3)) / iterations * 1e6
+        after_us = min(timeit.repeat(after, number=iterations, repeat=3)) / iterations * 1e6
+        print(f"{name:<28} {before_us:>12.2f} {after_us:>10.2f} {before_us / after_us:>7.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--policies", type=int, default=20)
+    args = parser.parse_args()
+    run(args.iterations, args.policies)
@@ -1,15 +1,32 @@
 """
-Script para ejecutar el servidor de desarrollo
+Script para ejecutar el servidor
+
+Fuera de DEBUG usa DrainingServer: al recibir SIGTERM drena la aplicación
+(/ready en 503, sin trabajo nuevo) antes de que uvicorn cierre conexiones.
 """
 import uvicorn
 from app.core.config import settings
+from app.core.shutdown import DrainingServer
 
 if __name__ == "__main__":
-    uvicorn.run(
-        "app.main:app",
-        host=settings.HOST,
-        port=settings.PORT,
-        reload=settings.DEBUG,
-        log_level=settings.LOG_LEVEL.lower()
-    )
+    if settings.DEBUG:
+        # La recarga automática usa el supervisor de uvicorn
+        uvicorn.run(
+            "app.main:create_app",
+            factory=True,
+            host=settings.HOST,
+            port=settings.PORT,
+            reload=True,
+            log_level=settings.LOG_LEVEL.lower(),
+            timeout_graceful_shutdown=int(settings.SHUTDOWN_GRACE_PERIOD_SECONDS)
+        )
+    else:
+        DrainingServer(uvicorn.Config(
+            "app.main:create_app",
+            factory=True,
+            host=settings.HOST,
+            port=settings.PORT,
+            log_level=settings.LOG_LEVEL.lower(),
+            timeout_graceful_shutdown=int(settings.SHUTDOWN_GRACE_PERIOD_SECONDS)
+        )).run()
 
@@ -0,0 +1,17 @@
+"""
+Configuración común de las pruebas: índices y diarios solo en memoria,
+sin sondeo ni precalentamiento
+"""
+import os
+
+for name, value in {
+    "SYNC_JOURNAL_FILE": "",
+    "OPPORTUNITY_INDEX_FILE": "",
+    "CONTACT_MATCH_INDEX_FILE": "",
+    "IDEMPOTENCY_STATE_FILE": "",
+    "NOWCERTS_POLL_ENABLED": "false",
+    "NOWCERTS_POLL_STATE_FILE": "",
+    "STARTUP_WARMUP_MODE": "off",
+    "LOG_LEVEL": "CRITICAL"
+}.items():
+    os.environ.setdefault(name, value)
@@ -0,0 +1,97 @@
+"""
+Pruebas del límite adaptativo y del reparto por carriles
+"""
+import itertools
+import pytest
+from app.core import adaptive_limiter
+from app.core.adaptive_limiter import AdaptiveLimiter, endpoint_key
+from app.core.priority import LaneQueue, REALTIME, MANUAL, BULK
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Reloj falso: avanza 50 ms en cada lectura"""
+    ticks = itertools.count()
+    monkeypatch.setattr(adaptive_limiter.time, "monotonic", lambda: next(ticks) * 0.05)
+
+
+def _busy_limiter() -> AdaptiveLimiter:
+    limiter = AdaptiveLimiter("test", initial_limit=10, min_limit=2, max_limit=100)
+    limiter.enabled = True
+    # Límite en uso: el aumento aditivo solo se aplica así
+    limiter.in_flight = limiter.current_limit
+    return limiter
+
+
+def test_mixed_endpoint_latencies_do_not_shrink_limit(clock):
+    limiter = _busy_limiter()
+    calls = [("GET /contacts/{id}", 0.060), ("GET /contacts/search", 0.300)]
+    for endpoint, rtt in calls * 500:
+        limiter._observe(rtt, False, endpoint)
+    
+    assert limiter.decreases == 0
+    assert limiter.current_limit >= 10
+
+
+def test_mostly_fast_mix_does_not_oscillate(clock):
+    limiter = _busy_limiter()
+    calls = [("GET /contacts/{id}", 0.060)] * 3 + [("POST /opportunities/search", 0.300)]
+    seen = set()
+    for endpoint, rtt in calls * 250:
+        limiter._observe(rtt, False, endpoint)
+        seen.add(limiter.current_limit)
+    
+    assert limiter.decreases == 0
+    assert min(seen) == 10
+
+
+def test_endpoint_slowdown_still_shrinks_limit(clock):
+    limiter = _busy_limiter()
+    for _ in range(50):
+        limiter._observe(0.060, False, "GET /contacts/{id}")
+    for _ in range(50):
+        limiter._observe(0.300, False, "GET /contacts/{id}")
+    
+    assert limiter.decreases > 0
+    assert limiter.current_limit < 10
+
+
+def test_overload_shrinks_limit(clock):
+    limiter = _busy_limiter()
+    for _ in range(5):
+        limiter._observe(None, True)
+    
+    assert limiter.overloads == 5
+    assert limiter.current_limit < 10
+
+
+def test_endpoint_key_replaces_ids():
+    assert endpoint_key("get", "https://x.test/contacts/ve9EPM428h8vShlRW1KT?a=1") == "GET /contacts/{id}"
+    assert endpoint_key("GET", "https://x.test/contacts/search") == "GET /contacts/search"
+    assert (
+        endpoint_key("PUT", "https://x.test/api/Insured/1b4e28ba-2fa1-11d2-883f-0016d3cca427")
+        == "PUT /api/Insured/{id}"
+    )
+
+
+def test_lane_queue_weighted_round_robin():
+    queue = LaneQueue({REALTIME: 8, MANUAL: 3, BULK: 1})
+    for name in (REALTIME, MANUAL, BULK):
+        for index in range(12):
+            queue.append(name, (name, index))
+    
+    order = [queue.pop()[0] for _ in range(12)]
+    
+    assert order.count(REALTIME) == 8
+    assert order.count(MANUAL) == 3
+    assert order.count(BULK) == 1
+    # Intercalados: el carril masivo no espera a que se vacíen los demás
+    assert order.index(BULK) < 11
+
+
+def test_lane_queue_skips_ineligible_lane():
+    queue = LaneQueue({REALTIME: 8, MANUAL: 3, BULK: 1})
+    queue.append(BULK, "bulk")
+    
+    assert queue.pop(lambda name: name != BULK) is None
+    assert queue.pop() == (BULK, "bulk")
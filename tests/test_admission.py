@@ -0,0 +1,47 @@
+"""
+Pruebas del middleware de control de admisión
+"""
+import asyncio
+from app.core.admission import AdmissionController, AdmissionMiddleware
+
+
+def _call(middleware, path):
+    async def receive():
+        return {"type": "http.request", "body": b""}
+    
+    async def send(message):
+        pass
+    
+    return middleware({"type": "http", "path": path}, receive, send)
+
+
+def test_sse_stream_does_not_hold_a_slot():
+    controller = AdmissionController(max_in_flight=1, max_queue=0, route_limits={})
+    seen = {}
+    
+    async def app(scope, receive, send):
+        seen[scope["path"]] = controller.in_flight
+        await asyncio.sleep(0.01)
+    
+    middleware = AdmissionMiddleware(app, controller, "/api/v1", ["/sync/jobs/*/events"])
+    
+    async def run():
+        await asyncio.gather(
+            _call(middleware, "/api/v1/sync/jobs/abc/events"),
+            _call(middleware, "/api/v1/webhooks/ghl")
+        )
+    
+    asyncio.run(run())
+    
+    assert seen == {"/api/v1/sync/jobs/abc/events": 0, "/api/v1/webhooks/ghl": 1}
+    assert controller.in_flight == 0
+    assert controller.rejected["global"] == 0
+
+
+def test_other_job_routes_are_admitted_normally():
+    controller = AdmissionController(max_in_flight=1, max_queue=0, route_limits={})
+    middleware = AdmissionMiddleware(None, controller, "/api/v1", ["/sync/jobs/*/events"])
+    
+    assert middleware._exempt("/api/v1/sync/jobs/abc/events")
+    assert not middleware._exempt("/api/v1/sync/jobs/abc")
+    assert not middleware._exempt("/api/v1/sync/jobs")
@@ -0,0 +1,107 @@
+"""
+Pruebas del emparejamiento de contactos NowCerts ↔ GHL
+"""
+import asyncio
+import pytest
+from app.services import contact_matching
+from app.services.contact_matching import (
+    ContactMatchIndex, NOWCERTS, normalize_contact, normalize_phone, score_match, upsert_nowcerts_contact
+)
+
+
+@pytest.fixture
+def index(monkeypatch):
+    index = ContactMatchIndex(path="", min_score=0.6)
+    monkeypatch.setattr(contact_matching, "contact_match_index", index)
+    yield index
+    index.close()
+
+
+class FakeNowCerts:
+    def __init__(self):
+        self.calls = []
+    
+    async def update_contact(self, record_id, data):
+        self.calls.append(("update", record_id))
+        return {}
+    
+    async def create_contact(self, data):
+        self.calls.append(("create", None))
+        return {"id": "nc-new"}
+
+
+@pytest.mark.parametrize("value", ["(555) 123-4567", "555.123.4567", "+1 555 123 4567", "1-555-123-4567", "0015551234567"])
+def test_normalize_phone_formats(value):
+    assert normalize_phone(value, "1") == "+15551234567"
+
+
+@pytest.mark.parametrize("value", [None, "", "123-4567", "ext 12"])
+def test_normalize_phone_rejects_ambiguous(value):
+    assert normalize_phone(value, "1") is None
+
+
+def test_shared_household_phone_is_not_a_match(index):
+    index.upsert(NOWCERTS, "nc-maria", {"firstName": "Maria", "lastName": "Garcia", "phone": "555-123-4567"})
+    
+    pedro = {"firstName": "Pedro", "lastName": "Lopez", "phone": "(555) 123-4567"}
+    
+    assert index.find_match(pedro, NOWCERTS) is None
+    candidate = index.candidates(pedro, NOWCERTS)[0]
+    assert set(candidate["conflicts"]) == {"first_name", "last_name"}
+    assert candidate["score"] < 0.5
+
+
+def test_same_last_name_different_first_name_is_not_a_match(index):
+    index.upsert(NOWCERTS, "nc-john", {"firstName": "John", "lastName": "Doe", "phone": "555-123-4567"})
+    
+    jane = {"firstName": "Jane", "lastName": "Doe", "email": "jane@x.com", "phone": "555-123-4567"}
+    
+    assert index.find_match(jane, NOWCERTS) is None
+
+
+def test_phone_and_last_name_with_initial_is_a_match(index):
+    index.upsert(NOWCERTS, "nc-jose", {"firstName": "J.", "lastName": "Pérez", "phone": "555-123-4567"})
+    
+    match = index.find_match({"firstName": "José", "lastName": "Perez", "phone": "+15551234567"}, NOWCERTS)
+    
+    assert match is not None and match["record_id"] == "nc-jose"
+
+
+def test_email_alone_is_a_match(index):
+    index.upsert(NOWCERTS, "nc-ana", {"email": "Ana@Example.com"})
+    
+    match = index.find_match({"email": "ana@example.com", "firstName": "Ana"}, NOWCERTS)
+    
+    assert match is not None and match["record_id"] == "nc-ana"
+
+
+def test_name_conflicts_are_penalised():
+    maria = normalize_contact({"firstName": "Maria", "lastName": "Garcia", "phone": "5551234567"})
+    pedro = normalize_contact({"firstName": "Pedro", "lastName": "Lopez", "phone": "5551234567"})
+    
+    score, matched = score_match(pedro, maria)
+    
+    assert matched == ["phone"]
+    assert score == 0.0
+
+
+def test_upsert_creates_instead_of_overwriting_household_member(index):
+    index.upsert(NOWCERTS, "nc-maria", {"firstName": "Maria", "lastName": "Garcia", "phone": "555-123-4567"})
+    service = FakeNowCerts()
+    pedro = {"firstName": "Pedro", "lastName": "Lopez", "phone": "555-123-4567"}
+    
+    result = asyncio.run(upsert_nowcerts_contact(service, pedro, {}))
+    
+    assert service.calls == [("create", None)]
+    assert result["id"] == "nc-new"
+
+
+def test_upsert_updates_the_same_person(index):
+    index.upsert(NOWCERTS, "nc-maria", {"firstName": "Maria", "lastName": "Garcia", "phone": "555-123-4567"})
+    service = FakeNowCerts()
+    maria = {"firstName": "Maria", "lastName": "Garcia", "phone": "+1 555 123 4567"}
+    
+    result = asyncio.run(upsert_nowcerts_contact(service, maria, {}))
+    
+    assert service.calls == [("update", "nc-maria")]
+    assert result["id"] == "nc-maria"
@@ -0,0 +1,53 @@
+"""
+Pruebas del escritor por lotes de contactos
+"""
+import asyncio
+from app.services import contact_writer
+from app.services.contact_writer import ContactBatchWriter
+
+
+class FakeGHL:
+    def __init__(self):
+        self.upserts = []
+    
+    async def upsert_contact(self, data):
+        self.upserts.append(data)
+        contact_id = f"ghl-{len(self.upserts)}"
+        await asyncio.sleep(0)
+        return {"contact": {"id": contact_id}}
+
+
+def test_full_batch_flush_is_tracked_until_done():
+    writer = ContactBatchWriter(FakeGHL(), window_seconds=10, max_batch_size=2, concurrency=2)
+    
+    async def run():
+        return await asyncio.gather(
+            writer.upsert({"email": "a@x.com"}),
+            writer.upsert({"email": "b@x.com"})
+        )
+    
+    results = asyncio.run(run())
+    
+    assert len(writer.ghl_service.upserts) == 2
+    assert {result["contact"]["id"] for result in results} == {"ghl-1", "ghl-2"}
+    assert not writer._batch_tasks
+
+
+def test_failed_flush_is_logged(monkeypatch):
+    writer = ContactBatchWriter(FakeGHL(), window_seconds=10, max_batch_size=1)
+    errors = []
+    monkeypatch.setattr(contact_writer.logger, "error", lambda message, **kwargs: errors.append(message))
+    
+    async def broken_flush():
+        raise RuntimeError("fallo del lote")
+    
+    async def run():
+        writer.flush = broken_flush
+        upsert = asyncio.ensure_future(writer.upsert({"email": "a@x.com"}))
+        await asyncio.sleep(0.01)
+        upsert.cancel()
+    
+    asyncio.run(run())
+    
+    assert errors and "fallo del lote" in errors[0]
+    assert not writer._batch_tasks
@@ -0,0 +1,96 @@
+"""
+Pruebas del procesamiento de eventos de NowCerts
+"""
+import asyncio
+import pytest
+from app.core.config import settings
+from app.core.exceptions import EventNotReadyError
+from app.core.idempotency import generate_event_id, is_duplicate
+from app.models.webhooks import parse_nowcerts_event
+from app.services import event_processor, opportunity_writer
+from app.services.event_processor import process_nowcerts_event
+
+
+def _policy_event(policy_id):
+    return parse_nowcerts_event({
+        "event_type": "POLICY_INSERT",
+        "data": {
+            "id": policy_id,
+            "policyNumber": f"POL-{policy_id}",
+            "insuredId": "ins-early",
+            "modifiedDate": "2026-10-01T10:00:00Z"
+        }
+    })
+
+
+def _fake_upsert(results):
+    async def upsert(kind, policy, contact_id=None):
+        return results.pop(0)
+    return upsert
+
+
+def test_policy_before_its_insured_is_retryable_and_not_marked(monkeypatch):
+    payload = _policy_event("early-1")
+    monkeypatch.setattr(event_processor.opportunity_writer, "upsert", _fake_upsert([
+        {"action": "skipped", "number": "POL-early-1", "retryable": True, "message": "sin contacto"},
+        {"action": "created", "number": "POL-early-1", "opportunity_id": "opp-1"}
+    ]))
+    
+    with pytest.raises(EventNotReadyError) as error:
+        asyncio.run(process_nowcerts_event(payload))
+    
+    assert error.value.status_code == 503
+    assert "Retry-After" in error.value.headers
+    assert not is_duplicate(generate_event_id(payload.raw_dict(), "nowcerts"))
+    
+    # La reentrega, con el asegurado ya sincronizado, se procesa
+    response = asyncio.run(process_nowcerts_event(_policy_event("early-1")))
+    
+    assert response.success
+    assert response.data["opportunity_id"] == "opp-1"
+
+
+def test_policy_that_cannot_be_indexed_is_marked(monkeypatch):
+    payload = _policy_event("bad-1")
+    monkeypatch.setattr(event_processor.opportunity_writer, "upsert", _fake_upsert([
+        {"action": "skipped", "message": "policy sin número ni ID: no se puede indexar"}
+    ]))
+    
+    response = asyncio.run(process_nowcerts_event(payload))
+    
+    assert response.data["action"] == "skipped"
+    assert is_duplicate(generate_event_id(payload.raw_dict(), "nowcerts"))
+
+
+def test_policy_without_insured_is_marked_not_retried():
+    payload = parse_nowcerts_event({
+        "event_type": "POLICY_INSERT",
+        "data": {"id": "orphan-1", "policyNumber": "POL-orphan-1", "modifiedDate": "2026-10-01T10:00:00Z"}
+    })
+    
+    response = asyncio.run(process_nowcerts_event(payload))
+    
+    assert response.data["action"] == "skipped"
+    assert "retryable" not in response.data
+    assert is_duplicate(generate_event_id(payload.raw_dict(), "nowcerts"))
+
+
+def test_policy_waiting_too_long_for_its_insured_is_marked(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(opportunity_writer.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(settings, "OPPORTUNITY_PENDING_RETRY_AFTER_SECONDS", 60)
+    monkeypatch.setattr(settings, "OPPORTUNITY_PENDING_MAX_RETRIES", 3)
+    
+    with pytest.raises(EventNotReadyError):
+        asyncio.run(process_nowcerts_event(_policy_event("late-1")))
+    clock[0] += 120
+    with pytest.raises(EventNotReadyError):
+        asyncio.run(process_nowcerts_event(_policy_event("late-1")))
+    
+    clock[0] += 60
+    payload = _policy_event("late-1")
+    response = asyncio.run(process_nowcerts_event(payload))
+    
+    assert response.data["action"] == "skipped"
+    assert "retryable" not in response.data
+    assert is_duplicate(generate_event_id(payload.raw_dict(), "nowcerts"))
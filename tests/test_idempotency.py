@@ -0,0 +1,78 @@
+"""
+Pruebas de la clave semántica de los eventos
+"""
+from app.core.idempotency import extract_semantic_key, generate_event_id
+
+
+def _policy_event(policy_id, event_type="POLICY_INSERT"):
+    return {
+        "event_type": event_type,
+        "data": {
+            "policyId": policy_id,
+            "insuredId": "ins-1",
+            "policyNumber": f"POL-{policy_id}",
+            "modifiedDate": "2026-10-01T10:00:00Z"
+        }
+    }
+
+
+def test_policies_of_the_same_insured_get_different_ids():
+    first = generate_event_id(_policy_event("p-1"), "nowcerts")
+    second = generate_event_id(_policy_event("p-2"), "nowcerts")
+    
+    assert first != second
+
+
+def test_policy_key_uses_policy_id_not_insured_id():
+    assert extract_semantic_key(_policy_event("p-1"), "nowcerts") == [
+        "POLICY", "p-1", "2026-10-01T10:00:00Z"
+    ]
+
+
+def test_policy_key_falls_back_to_policy_number():
+    payload = _policy_event("p-1")
+    del payload["data"]["policyId"]
+    
+    assert extract_semantic_key(payload, "nowcerts")[1] == "POL-p-1"
+
+
+def test_quote_key_uses_quote_id():
+    payload = {
+        "event_type": "QUOTE_UPDATE",
+        "data": {"quoteId": "q-9", "insuredId": "ins-1", "modifiedDate": "2026-10-01"}
+    }
+    
+    assert extract_semantic_key(payload, "nowcerts") == ["QUOTE", "q-9", "2026-10-01"]
+
+
+def test_insured_key_uses_insured_id():
+    payload = {"event_type": "INSURED_UPDATE", "data": {"insuredId": "ins-1", "modifiedDate": "2026-10-01"}}
+    
+    assert extract_semantic_key(payload, "nowcerts") == ["INSURED", "ins-1", "2026-10-01"]
+
+
+def test_redelivery_with_other_timestamp_is_the_same_event():
+    payload = _policy_event("p-1")
+    redelivered = {**payload, "timestamp": "2026-10-01T10:05:00Z"}
+    
+    assert generate_event_id(payload, "nowcerts") == generate_event_id(redelivered, "nowcerts")
+
+
+def test_polled_update_matches_webhook_insert():
+    webhook = _policy_event("p-1", "POLICY_INSERT")
+    polled = _policy_event("p-1", "POLICY_UPDATE")
+    
+    assert generate_event_id(webhook, "nowcerts") == generate_event_id(polled, "nowcerts")
+
+
+def test_same_id_in_other_entity_type_is_another_event():
+    policy = {"event_type": "POLICY_INSERT", "data": {"id": "x-1", "modifiedDate": "2026-10-01"}}
+    quote = {**policy, "event_type": "QUOTE_INSERT"}
+    
+    assert generate_event_id(policy, "nowcerts") != generate_event_id(quote, "nowcerts")
+
+
+def test_unknown_type_ignores_related_insured():
+    payload = {"event_type": "NOTE_INSERT", "data": {"insuredId": "ins-1", "modifiedDate": "2026-10-01"}}
+    
+    assert extract_semantic_key(payload, "nowcerts") is None
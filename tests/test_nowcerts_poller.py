@@ -0,0 +1,122 @@
+"""
+Pruebas del sondeo de NowCerts y su marca de agua
+"""
+import asyncio
+import pytest
+from app.services import nowcerts_poller
+from app.services.nowcerts_poller import NowCertsPoller, parse_changed_at
+
+
+@pytest.fixture
+def poller():
+    return NowCertsPoller(nowcerts_service=object(), state_file="")
+
+
+@pytest.mark.parametrize("value", [
+    "2026-10-01T10:00:00Z",
+    "2026-10-01T10:00:00+00:00",
+    "2026-10-01T10:00:00.0000000Z",
+    "2026-10-01T10:00:00.000",
+    "2026-10-01 10:00:00"
+])
+def test_parse_changed_at_formats(value):
+    parsed = parse_changed_at(value)
+    
+    assert parsed is not None
+    assert parsed.isoformat() == "2026-10-01T10:00:00+00:00"
+
+
+def test_parse_changed_at_keeps_offset_and_fraction():
+    parsed = parse_changed_at("2026-10-01T12:00:00.1234567+02:00")
+    
+    assert parsed.isoformat() == "2026-10-01T12:00:00.123456+02:00"
+    assert parse_changed_at("ayer") is None
+
+
+def test_watermark_uses_latest_date_across_formats(poller):
+    # Como texto, "…10:00:00Z" > "…10:00:00.5+00:00" > "…09:59:59+00:00"
+    changed = ["2026-10-01T10:00:00.5+00:00", "2026-10-01T10:00:00Z", "2026-10-01T12:00:00+02:00"]
+    
+    poller._advance_watermark("policies", changed, [])
+    
+    assert poller.watermarks["policies"] == "2026-10-01T10:00:00.5+00:00"
+
+
+def test_watermark_stops_at_earliest_failure_across_formats(poller):
+    failed = ["2026-10-01T10:00:00Z", "2026-10-01T09:30:00.1234567+00:00"]
+    
+    poller._advance_watermark("policies", ["2026-10-01T11:00:00Z"], failed)
+    
+    assert poller.watermarks["policies"] == "2026-10-01T09:30:00.1234567+00:00"
+
+
+def test_watermark_holds_on_unparseable_failure(poller):
+    poller.watermarks["policies"] = "2026-10-01T08:00:00Z"
+    
+    poller._advance_watermark("policies", [], ["2026-10-01T10:00:00Z", "01/10/2026 9:00"])
+    
+    assert poller.watermarks["policies"] == "2026-10-01T08:00:00Z"
+
+
+class PagedNowCerts:
+    """Colección paginada en memoria (respuesta en lista, sin totalCount)"""
+    
+    def __init__(self, records, page_size):
+        self.pages = [records[start:start + page_size] for start in range(0, len(records), page_size)]
+        self.requested = []
+    
+    async def list_changed_records(self, endpoint, modified_since, page=1, page_size=100):
+        self.requested.append(page)
+        return self.pages[page - 1] if page <= len(self.pages) else []
+
+
+def _policy(number, minute):
+    return {
+        "id": f"p-{number}",
+        "policyNumber": f"POL-{number}",
+        "insuredId": "ins-1",
+        "modifiedDate": f"2026-10-01T10:{minute:02d}:00Z"
+    }
+
+
+def test_poll_keeps_paging_past_a_failure_and_holds_the_watermark(monkeypatch):
+    records = [_policy(number, number) for number in range(7)]
+    service = PagedNowCerts(records, page_size=2)
+    poller = NowCertsPoller(nowcerts_service=service, state_file="")
+    poller.page_size = 2
+    poller.concurrency = 2
+    processed = []
+    
+    async def process(payload):
+        if payload.data.policyNumber == "POL-1":
+            raise RuntimeError("GHL no disponible")
+        processed.append(payload.data.policyNumber)
+    
+    monkeypatch.setattr(nowcerts_poller, "process_nowcerts_event", process)
+    
+    count, pages = asyncio.run(poller._poll_collection("policies", "/api/policies", "POLICY_UPDATE"))
+    
+    assert count == 7
+    assert pages == 4
+    assert sorted(processed) == [f"POL-{number}" for number in (0, 2, 3, 4, 5, 6)]
+    assert poller.watermarks["policies"] == "2026-10-01T10:01:00Z"
+
+
+def test_poll_drops_a_record_stuck_for_too_many_rounds(monkeypatch):
+    service = PagedNowCerts([_policy(0, 0), _policy(1, 1), _policy(2, 2)], page_size=2)
+    poller = NowCertsPoller(nowcerts_service=service, state_file="")
+    poller.page_size = 2
+    poller.max_stuck_rounds = 3
+    
+    async def process(payload):
+        if payload.data.policyNumber == "POL-1":
+            raise RuntimeError("GHL no disponible")
+    
+    monkeypatch.setattr(nowcerts_poller, "process_nowcerts_event", process)
+    
+    for _ in range(2):
+        asyncio.run(poller._poll_collection("policies", "/api/policies", "POLICY_UPDATE"))
+        assert poller.watermarks["policies"] == "2026-10-01T10:01:00Z"
+    asyncio.run(poller._poll_collection("policies", "/api/policies", "POLICY_UPDATE"))
+    
+    assert poller.watermarks["policies"] == "2026-10-01T10:02:00Z"
@@ -0,0 +1,31 @@
+"""
+Pruebas de las sondas de readiness
+"""
+import asyncio
+from app.core.config import settings
+from app.core.exceptions import ExternalAPIConnectionError
+from app.services import readiness
+from app.services.nowcerts_service import NowCertsService
+from app.services.readiness import UpstreamProbe
+
+
+def test_nowcerts_probe_fails_on_outage_with_a_cached_token(monkeypatch):
+    calls = []
+    
+    async def cached_token(force_refresh=False):
+        return "token-en-cache"
+    
+    async def outage(self, endpoint, modified_since, page=1, page_size=100):
+        calls.append((endpoint, page_size))
+        raise ExternalAPIConnectionError("connection refused", service_name="NowCerts")
+    
+    monkeypatch.setattr(readiness.token_manager, "get_access_token", cached_token)
+    monkeypatch.setattr(NowCertsService, "list_changed_records", outage)
+    probe = UpstreamProbe("nowcerts", readiness._probe_nowcerts)
+    
+    for _ in range(settings.READINESS_FAILURE_THRESHOLD):
+        asyncio.run(probe.run())
+    
+    assert calls[0] == ("/api/contacts", 1)
+    assert probe.breaker_state == "open"
+    assert "connection refused" in probe.last_error
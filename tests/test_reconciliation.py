@@ -0,0 +1,45 @@
+"""
+Pruebas del árbol de hashes de la reconciliación
+"""
+from app.services.reconciliation import HashTree, bucket_of, diff_buckets, _record_digest
+
+BUCKETS = 4096
+
+# Nodos comparados para bajar hasta una hoja: raíz y 16 hijos en cada nivel
+TREE_PATH = 1 + 16 + 16 + 16
+
+
+def _tree(records):
+    tree = HashTree(BUCKETS)
+    for key, content_hash in records:
+        tree.add(bucket_of(key, BUCKETS), _record_digest(key, content_hash))
+    return tree
+
+
+def _records(count):
+    return [(f"email:user{i}@x.com", f"hash-{i}") for i in range(count)]
+
+
+def test_identical_sides_have_no_differences_regardless_of_order():
+    records = _records(1000)
+    
+    mismatched, compared = diff_buckets(_tree(records), _tree(list(reversed(records))))
+    
+    assert mismatched == []
+    # Solo se compara la raíz
+    assert compared == 1
+
+
+def test_changed_missing_and_duplicated_records_are_found():
+    records = _records(1000)
+    changed = list(records)
+    changed[10] = (records[10][0], "otro-hash")
+    del changed[20]
+    changed.append(records[30])
+    
+    mismatched, compared = diff_buckets(_tree(records), _tree(changed))
+    
+    expected = {bucket_of(records[i][0], BUCKETS) for i in (10, 20, 30)}
+    assert set(mismatched) == expected
+    # Baja solo por las ramas distintas, sin recorrer las 4096 hojas
+    assert compared < 3 * TREE_PATH
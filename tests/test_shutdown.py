@@ -0,0 +1,58 @@
+"""
+Pruebas del cierre ordenado
+"""
+import asyncio
+import json
+from app.core import idempotency
+from app.core.shutdown import GracefulShutdown
+
+
+def test_drain_runs_once_and_shares_the_deadline():
+    shutdown = GracefulShutdown(grace_seconds=5)
+    calls = []
+    
+    async def drain():
+        calls.append(shutdown.remaining())
+        await asyncio.sleep(0.01)
+        return True
+    
+    shutdown.configure(drain)
+    
+    async def run():
+        # El manejador de la señal y el evento shutdown drenan a la vez
+        return await asyncio.gather(shutdown.drain(), shutdown.drain())
+    
+    assert asyncio.run(run()) == [True, True]
+    assert len(calls) == 1
+    assert 4 < calls[0] <= 5
+    assert shutdown.remaining() < 5
+
+
+def test_unfinished_events_are_checkpointed(tmp_path):
+    state = str(tmp_path / "idempotency.bin")
+    
+    async def run():
+        finished = asyncio.Event()
+        stuck = asyncio.Event()
+        
+        async def process(event_id, done):
+            idempotency.begin_processing(event_id, "nowcerts")
+            await done.wait()
+            idempotency.mark_event_processed(event_id)
+        
+        tasks = [
+            asyncio.create_task(process("nowcerts_done", finished)),
+            asyncio.create_task(process("nowcerts_stuck", stuck))
+        ]
+        await asyncio.sleep(0)
+        finished.set()
+        await tasks[0]
+        saved = idempotency.save_pending(state)
+        tasks[1].cancel()
+        return saved
+    
+    assert asyncio.run(run()) == 1
+    with open(idempotency.pending_state_path(state)) as f:
+        pending = json.load(f)
+    assert pending["events"] == [{"event_id": "nowcerts_stuck", "source": "nowcerts"}]
+    assert idempotency.in_flight_events() == {}
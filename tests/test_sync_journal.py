@@ -0,0 +1,30 @@
+"""
+Pruebas del diario de sincronización
+"""
+import asyncio
+from app.services.sync_journal import SyncJournal
+
+
+async def _write(journal, entity_key, source_id, target_id):
+    async with journal.writing("contact", entity_key, "nowcerts", "ghl", "hash", source_id=source_id) as write:
+        write.target_id = target_id
+
+
+def test_write_links_ids_and_marks_echoes():
+    journal = SyncJournal(path="")
+    
+    asyncio.run(_write(journal, "email:jane@example.com", "ins-1", "ghl-1"))
+    
+    assert journal.counterpart_id("contact", "nowcerts", "ins-1") == "ghl-1"
+    assert journal.counterpart_id("contact", "ghl", "ghl-1") == "ins-1"
+    assert journal.is_echo("contact", "email:jane@example.com", "ghl", "hash")
+
+
+def test_write_without_entity_key_still_links_ids():
+    journal = SyncJournal(path="")
+    
+    asyncio.run(_write(journal, None, "ins-2", "ghl-2"))
+    
+    assert journal.counterpart_id("contact", "nowcerts", "ins-2") == "ghl-2"
+    assert not journal.is_echo("contact", None, "ghl", "hash")
+    assert journal.history("contact", "id:ins-2")[0]["target_id"] == "ghl-2"